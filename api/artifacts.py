@@ -0,0 +1,307 @@
+# api/artifacts.py
+# Versioned lexicons and models, swapped into running workers without a
+# restart.
+#
+# CLASSIFIER_REGISTRY_DIR holds immutable versions and one pointer file:
+#
+#   lexicons/<version>.json   {"red": [...], "yellow": [...], "subword": [...], "whole_word": [...]}
+#   models/<version>.joblib   a trained pipeline, or
+#   models/<version>/         a `train_model --export` directory
+#   active.json               {"lexicon": "<version>", "model": "<version>"}
+#
+# A kind missing from active.json uses the built-in one (api/lexicon.py,
+# CLASSIFIER_MODEL_PATH). `manage.py publish_classifier` adds versions and
+# rewrites active.json with an atomic rename.
+#
+# Each worker polls active.json's mtime from a daemon thread. When it
+# changes, the new lexicon is compiled and the new model loaded in that
+# thread, then each is swapped in with a single assignment. Requests pin
+# the versions current when they start (PinArtifactsMiddleware), so one
+# that is running during a swap finishes on the old versions, and cached
+# verdicts are keyed by version, so old and new never mix in the cache.
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .classifier import BUILTIN_LEXICON, get_lexicon, load_lexicon, pinned_lexicon, set_lexicon
+from .engine import ClassifierEngine, get_engine, pinned_engine, set_engine
+from .metrics import ARTIFACT_SWAPS
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = 'active.json'
+KINDS = ('lexicon', 'model')
+BUILTIN = 'builtin'
+
+_VERSION_NAME = re.compile(r'[A-Za-z0-9][A-Za-z0-9._-]*')
+
+
+def validate_version(version):
+    if not _VERSION_NAME.fullmatch(version) or version == BUILTIN:
+        raise ValueError(f"Invalid version name: {version!r}")
+    return version
+
+
+class ArtifactRegistry:
+    """The versions in a registry directory and which of them are active"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    @property
+    def active_path(self):
+        return self.root / ACTIVE
+
+    def lexicon_path(self, version):
+        return self.root / 'lexicons' / f"{validate_version(version)}.json"
+
+    def model_path(self, version):
+        directory = self.root / 'models' / validate_version(version)
+        return directory if directory.is_dir() else directory.with_name(f"{version}.joblib")
+
+    def versions(self, kind):
+        """Published versions of kind, oldest first"""
+        directory = self.root / ('lexicons' if kind == 'lexicon' else 'models')
+        if not directory.is_dir():
+            return []
+        paths = [p for p in directory.iterdir() if not p.name.startswith('.')]
+        return [p.name.removesuffix('.json').removesuffix('.joblib')
+                for p in sorted(paths, key=lambda p: p.stat().st_mtime_ns)]
+
+    def active(self):
+        """{kind: version} from active.json; {} before anything is activated"""
+        try:
+            with open(self.active_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _install(self, source, target):
+        """Copy source to target via a temporary name, so a watcher never sees half a copy"""
+        if target.exists():
+            raise FileExistsError(f"{target} already exists; versions are immutable")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        staging = target.with_name(f".{target.name}.tmp")
+        if Path(source).is_dir():
+            shutil.rmtree(staging, ignore_errors=True)
+            shutil.copytree(source, staging)
+        else:
+            shutil.copy2(source, staging)
+        os.replace(staging, target)
+        return target
+
+    def publish_lexicon(self, source, version):
+        load_lexicon(source)  # refuse a file that doesn't compile
+        return self._install(source, self.lexicon_path(version))
+
+    def publish_model(self, source, version):
+        ClassifierEngine(source).load()  # refuse a model that doesn't load
+        name = validate_version(version) if Path(source).is_dir() else f"{validate_version(version)}.joblib"
+        return self._install(source, self.root / 'models' / name)
+
+    def activate(self, **versions):
+        """
+        Point kinds at versions (None: back to the built-in one) by replacing
+        active.json in one rename
+        """
+        active = self.active()
+        for kind, version in versions.items():
+            if kind not in KINDS:
+                raise ValueError(f"Unknown kind: {kind}")
+            if version is None:
+                active.pop(kind, None)
+                continue
+            path = self.lexicon_path(version) if kind == 'lexicon' else self.model_path(version)
+            if not path.exists():
+                raise FileNotFoundError(f"No {kind} version {version!r} in {self.root}")
+            active[kind] = version
+        self.root.mkdir(parents=True, exist_ok=True)
+        staging = self.root / f".{ACTIVE}.tmp"
+        with open(staging, 'w', encoding='utf-8') as f:
+            json.dump(active, f, indent=2)
+        os.replace(staging, self.active_path)
+        return active
+
+
+class ArtifactWatcher:
+    """
+    Swaps in the versions a registry's active.json names whenever the file
+    changes. check() runs one poll; start() polls every `interval` seconds
+    from a daemon thread, and starts it again in a forked child.
+    """
+
+    def __init__(self, registry, interval):
+        self.registry = registry
+        self.interval = interval
+        self.error = None
+        self.swapped_at = None
+        self._stamp = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _read_stamp(self):
+        try:
+            stat = self.registry.active_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def check(self):
+        """Swap in the active versions if active.json changed since the last check"""
+        stamp = self._read_stamp()
+        if stamp == self._stamp:
+            return False
+        with self._lock:
+            if stamp == self._stamp:
+                return False
+            try:
+                active = self.registry.active()
+            except (OSError, ValueError) as e:
+                self._failed('registry', e)
+                return False
+            # Not retried until active.json changes again; the old versions stay
+            self._stamp = stamp
+            self.error = None
+            self._swap_lexicon(active.get('lexicon'))
+            self._swap_model(active.get('model'))
+            self.swapped_at = time.time()
+            return True
+
+    def _failed(self, kind, error):
+        logger.error("Could not swap in %s from %s: %s", kind, self.registry.root, error)
+        ARTIFACT_SWAPS.inc(kind=kind, result='error')
+        self.error = f"{kind}: {error}"
+
+    def _swap_lexicon(self, version):
+        if (version or BUILTIN) == get_lexicon().name:
+            return
+        try:
+            lexicon = load_lexicon(self.registry.lexicon_path(version), version) if version else BUILTIN_LEXICON
+        except Exception as e:
+            return self._failed('lexicon', e)
+        set_lexicon(lexicon)
+        ARTIFACT_SWAPS.inc(kind='lexicon', result='ok')
+        logger.info("Lexicon %s (%s) is now active", lexicon.name, lexicon.version)
+
+    def _swap_model(self, version):
+        from .pool import get_pool
+
+        if (version or BUILTIN) == get_engine().name:
+            return
+        try:
+            if version:
+                engine = ClassifierEngine(self.registry.model_path(version), version)
+            else:
+                engine = ClassifierEngine(settings.CLASSIFIER_MODEL_PATH)
+            engine.load()
+        except Exception as e:
+            return self._failed('model', e)
+        set_engine(engine)
+        pool = get_pool()
+        if pool is not None:
+            pool.swap(engine)
+        ARTIFACT_SWAPS.inc(kind='model', result='ok')
+        logger.info("Model %s (%s) is now active", engine.name, engine.version)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Artifact watcher check failed")
+
+    def start(self):
+        """Start polling in this process; a no-op while the thread is alive"""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='artifact-watcher', daemon=True)
+                self._thread.start()
+
+    def status(self):
+        return {
+            "path": str(self.registry.root),
+            "swapped_at": self.swapped_at,
+            "error": self.error,
+        }
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_watcher():
+    """Return the process-wide ArtifactWatcher, or None without CLASSIFIER_REGISTRY_DIR"""
+    global _watcher
+    if not settings.CLASSIFIER_REGISTRY_DIR:
+        return None
+    if _watcher is None:
+        with _watcher_lock:
+            if _watcher is None:
+                _watcher = ArtifactWatcher(ArtifactRegistry(settings.CLASSIFIER_REGISTRY_DIR),
+                                           settings.CLASSIFIER_REGISTRY_POLL_SECONDS)
+    return _watcher
+
+
+def active_versions():
+    """The lexicon and model versions serving the current request"""
+    return {"lexicon": get_lexicon().name, "model": get_engine().name}
+
+
+@contextmanager
+def pinned():
+    """Keep the current lexicon and model for the rest of the block, across swaps"""
+    lexicon_token = pinned_lexicon.set(get_lexicon())
+    engine_token = pinned_engine.set(get_engine())
+    try:
+        yield
+    finally:
+        pinned_engine.reset(engine_token)
+        pinned_lexicon.reset(lexicon_token)
+
+
+class PinArtifactsMiddleware:
+    """
+    Pins the lexicon and model for each request, and starts the registry
+    watcher in a worker on its first request (threads don't survive the
+    fork from a preloading master).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        _start_watcher()
+        with pinned():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        _start_watcher()
+        with pinned():
+            return await self.get_response(request)
+
+
+def _start_watcher():
+    watcher = get_watcher()
+    if watcher is not None:
+        watcher.start()
@@ -0,0 +1,174 @@
+# api/async_views.py
+# Async variants of the classify endpoints, for running under ASGI
+# (backend_django/asgi.py). OpenAI calls use the async client, so one process
+# can keep many classifications in flight; model inference runs in a bounded
+# thread pool so it never blocks the event loop.
+#
+# They also answer under the shipped gunicorn sync workers (gunicorn.conf.py),
+# but there Django runs each async view on a new event loop, so OpenAI
+# connections are opened and closed per request instead of pooled. Serve
+# backend_django.asgi with an ASGI server (e.g. uvicorn) to pool them.
+import asyncio
+import json
+import logging
+
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .artifacts import active_versions
+from .batching import aclassify_with_llm
+from .cache import verdict_cache
+from .cascade import aclassify_cascade_many
+from .classifier import Verdict, classify_text
+from .engine import aclassify_many
+from .inflight import verdict_calls
+from .metrics import FALLBACKS, count_verdicts, instrumented, stage
+from .ratelimit import athrottle, client_address
+from .views import (
+    batch_response, classifier_version, get_classification_method, validate_texts, verdict_fields,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_json_body(request):
+    """Return the decoded JSON body, or None if it isn't a JSON object"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def aclassify(text, method):
+    """
+    Async counterpart of ClassifyTextView.classify: cached, with concurrent
+    misses for the same text coalesced and a keyword fallback when the AI or
+    the model fails.
+    """
+    version = classifier_version(method)
+    verdict = await verdict_cache.aget(text, method, version)
+    if verdict is not None:
+        return verdict
+    return await verdict_calls.arun(
+        verdict_cache.key(text, method, version), lambda: _acompute(text, method, version)
+    )
+
+
+async def _acompute(text, method, version):
+    try:
+        if method == 'ai':
+            verdict = Verdict(await aclassify_with_llm(text), None, 'ai')
+        elif method == 'model':
+            verdict = (await aclassify_many([text]))[0]
+        elif method == 'cascade':
+            verdict = (await aclassify_cascade_many([text]))[0]
+        else:
+            verdict = Verdict(classify_text(text), None, 'keywords')
+    except Exception as e:
+        logger.error("%s classifier error: %s", method, e)
+        FALLBACKS.inc(method=method)
+        return await aclassify(text, 'keywords')
+
+    if not verdict.degraded:
+        await verdict_cache.aset(text, method, version, verdict)
+    return verdict
+
+
+async def aclassify_batch_vectorized(texts, method, aclassify_many_fn):
+    """Run aclassify_many_fn once over the cache misses"""
+    version = classifier_version(method)
+    verdicts = await verdict_cache.aget_many(texts, method, version)
+    missing = [i for i in range(len(texts)) if i not in verdicts]
+    if missing:
+        try:
+            computed = await aclassify_many_fn([texts[i] for i in missing])
+        except Exception as e:
+            logger.error("Model error: %s", e)
+            FALLBACKS.inc(method=method)
+            return [await aclassify(text, 'keywords') for text in texts]
+        computed = dict(zip(missing, computed))
+        await verdict_cache.aset_many({i: texts[i] for i in missing}, method, version,
+                                      {i: verdict for i, verdict in computed.items() if not verdict.degraded})
+        verdicts.update(computed)
+    return [verdicts[i] for i in range(len(texts))]
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncClassifyTextView(View):
+    """Async /classify-text/: same request and response shape"""
+
+    @instrumented('async-classify-text', get_classification_method)
+    async def post(self, request, *args, **kwargs):
+        with stage('parse'):
+            data = parse_json_body(request)
+        if data is None:
+            return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+        plain_text = data.get('text')
+        if not plain_text:
+            return JsonResponse({"error": "Missing text"}, status=400)
+
+        limited = await athrottle('async-classify-text', 'client', client_address(request))
+        if limited:
+            return limited
+
+        try:
+            method = get_classification_method()
+            logger.debug("Classifying text with %s (async): %.50s...", method, plain_text)
+            verdict = await aclassify(plain_text, method)
+            count_verdicts(method, [verdict])
+
+            logger.debug("Text classified as: %s (by %s)", verdict.flag, verdict.tier)
+
+            return JsonResponse({
+                "status": "success",
+                "method": method,
+                "versions": active_versions(),
+                **verdict_fields(verdict)
+            })
+
+        except Exception as e:
+            logger.error("Classification error: %s", e)
+            return JsonResponse({"error": str(e)}, status=500)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncClassifyBatchView(View):
+    """Async /classify-batch/: AI calls for the batch run concurrently"""
+
+    @instrumented('async-classify-batch', get_classification_method)
+    async def post(self, request, *args, **kwargs):
+        with stage('parse'):
+            data = parse_json_body(request)
+        if data is None:
+            return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+        texts = data.get('texts')
+        error = validate_texts(texts)
+        if error:
+            return JsonResponse({"error": error}, status=400)
+
+        limited = await athrottle('async-classify-batch', 'client', client_address(request), len(texts))
+        if limited:
+            return limited
+
+        try:
+            method = get_classification_method()
+            logger.debug("Classifying batch of %d texts with %s (async)", len(texts), method)
+
+            if method == 'model':
+                verdicts = await aclassify_batch_vectorized(texts, 'model', aclassify_many)
+            elif method == 'cascade':
+                verdicts = await aclassify_batch_vectorized(texts, 'cascade', aclassify_cascade_many)
+            else:
+                verdicts = await asyncio.gather(*(aclassify(text, method) for text in texts))
+            count_verdicts(method, verdicts)
+
+            return JsonResponse(batch_response(method, verdicts))
+
+        except Exception as e:
+            logger.error("Batch classification error: %s", e)
+            return JsonResponse({"error": str(e)}, status=500)
@@ -0,0 +1,193 @@
+# api/batching.py
+import asyncio
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+
+from .llm import AI_SYSTEM_PROMPT, get_llm_client
+
+logger = logging.getLogger(__name__)
+
+BATCH_LINE = re.compile(r"^\s*(\d+)\s*[:.)\-]\s*(RED|YELLOW|GREEN)\b", re.IGNORECASE)
+
+
+class BatchParseError(Exception):
+    """The model's reply to a batched prompt couldn't be mapped back to items"""
+
+
+def batch_messages(texts):
+    """Chat messages asking for one verdict per numbered text"""
+    numbered = "\n".join(f"{i}. {json.dumps(text, ensure_ascii=False)}" for i, text in enumerate(texts, 1))
+    return [
+        {"role": "system", "content": AI_SYSTEM_PROMPT},
+        {"role": "user", "content": (
+            f"Classify each of the following {len(texts)} messages independently. "
+            f"Reply with exactly {len(texts)} lines, one per message, in the form "
+            f"'<number>: RED', '<number>: YELLOW' or '<number>: GREEN'.\n\n{numbered}"
+        )},
+    ]
+
+
+def parse_batch_flags(content, count):
+    """Parse '<n>: FLAG' lines into a list of count flags, in order"""
+    flags = {}
+    for line in (content or "").splitlines():
+        match = BATCH_LINE.match(line)
+        if match:
+            flags[int(match.group(1))] = match.group(2).lower()
+    if sorted(flags) != list(range(1, count + 1)):
+        raise BatchParseError(f"Expected {count} verdicts, got {len(flags)}")
+    return [flags[i] for i in range(1, count + 1)]
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent LLM classifications into multi-message prompts.
+
+    submit() queues a text and returns a Future. A collector thread waits for
+    the first queued text, then keeps collecting for up to max_wait seconds
+    or until max_items are queued, and hands the batch to a dispatch pool that
+    sends one chat completion for the whole batch and resolves each Future
+    with its own verdict. When the reply can't be parsed, the futures fail
+    with BatchParseError and classify() retries the item on its own.
+    """
+
+    def __init__(self, client=None, max_items=None, max_wait=None):
+        self.client = client or get_llm_client()
+        self.max_items = max_items or settings.OPENAI_MICROBATCH_MAX_ITEMS
+        self.max_wait = max_wait if max_wait is not None else settings.OPENAI_MICROBATCH_WAIT_MS / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._dispatcher = None
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so start them lazily in each worker
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._dispatcher = ThreadPoolExecutor(
+                        max_workers=self.client.max_concurrency,
+                        thread_name_prefix='llm-batch',
+                    )
+                    threading.Thread(target=self._collect, name='llm-batcher', daemon=True).start()
+                    self._pid = os.getpid()
+
+    def submit(self, text):
+        """Queue text for classification; returns a Future of its flag"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def classify(self, text):
+        """Classify text through the batcher, blocking until its verdict is in"""
+        try:
+            return self.submit(text).result(timeout=self.client.timeout + self.max_wait + 1)
+        except BatchParseError:
+            return self.client.classify(text)
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatcher.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        texts = [text for text, _ in batch]
+        futures = [future for _, future in batch]
+        try:
+            if len(batch) == 1:
+                flags = [self.client.classify(texts[0])]
+            else:
+                content = self.client.complete(batch_messages(texts), max_tokens=8 * len(texts) + 10)
+                flags = parse_batch_flags(content, len(texts))
+                logger.debug("GPT batch of %d classified in one call", len(texts))
+        except Exception as e:
+            if isinstance(e, BatchParseError):
+                logger.warning("Could not parse batched GPT reply: %s", e)
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, flag in zip(futures, flags):
+            future.set_result(flag)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """Return the process-wide micro-batcher"""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher()
+    return _batcher
+
+
+def microbatching_enabled():
+    return settings.OPENAI_MICROBATCH_WAIT_MS > 0 and settings.OPENAI_MICROBATCH_MAX_ITEMS > 1
+
+
+def classify_with_llm(text):
+    """Classify one text with the LLM, micro-batched when enabled"""
+    if microbatching_enabled():
+        return get_batcher().classify(text)
+    return get_llm_client().classify(text)
+
+
+def classify_many_with_llm(texts):
+    """
+    Classify several texts with the LLM; coalesced through the batcher when
+    enabled. Items whose call fails come back as None.
+    """
+    if microbatching_enabled():
+        batcher = get_batcher()
+        futures = [batcher.submit(text) for text in texts]
+        flags = []
+        for text, future in zip(texts, futures):
+            try:
+                flags.append(future.result(timeout=batcher.client.timeout + batcher.max_wait + 1))
+            except BatchParseError:
+                flags.append(_classify_or_none(text))
+            except Exception as e:
+                logger.error("OpenAI error: %s", e)
+                flags.append(None)
+        return flags
+    return [_classify_or_none(text) for text in texts]
+
+
+def _classify_or_none(text):
+    try:
+        return get_llm_client().classify(text)
+    except Exception as e:
+        logger.error("OpenAI error: %s", e)
+        return None
+
+
+async def aclassify_with_llm(text):
+    """Async classify_with_llm()"""
+    if microbatching_enabled():
+        try:
+            return await asyncio.wrap_future(get_batcher().submit(text))
+        except BatchParseError:
+            pass
+    return await get_llm_client().aclassify(text)
@@ -0,0 +1,222 @@
+# api/benchmark.py
+# Replays classification traffic against the API and summarizes latency.
+#
+# Captured traffic is JSON Lines, one request per line:
+#   {"path": "/classify-text/", "body": {"text": "..."}}
+# Requests are sent either in-process through Django's test client, with
+# OpenAI and Firestore replaced by the offline fakes in api/fakes.py, or
+# over HTTP to a running server.
+import http.client
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+from urllib.parse import urlsplit
+
+ENDPOINTS = {
+    'classify-text': '/classify-text/',
+    'classify': '/classify/',
+    'classify-batch': '/classify-batch/',
+}
+
+DEFAULT_MIX = (('classify-text', 0.7), ('classify', 0.2), ('classify-batch', 0.1))
+
+
+def synthesize_traffic(texts, count, mix=DEFAULT_MIX, batch_size=20, seed=0):
+    """Build count requests from sample texts, spread over endpoints by mix weights"""
+    from .fakes import encrypt_message
+
+    rng = random.Random(seed)
+    names, weights = zip(*mix)
+    traffic = []
+    for i in range(count):
+        endpoint = rng.choices(names, weights)[0]
+        if endpoint == 'classify-batch':
+            body = {'texts': rng.sample(texts, min(batch_size, len(texts)))}
+        elif endpoint == 'classify':
+            chat_id = f'bench-chat-{rng.randrange(100)}'
+            body = {
+                'chatId': chat_id,
+                'messageId': f'bench-message-{i}',
+                'encryptedText': encrypt_message(rng.choice(texts), chat_id),
+            }
+        else:
+            body = {'text': rng.choice(texts)}
+        traffic.append({'path': ENDPOINTS[endpoint], 'body': body})
+    return traffic
+
+
+def load_traffic(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_traffic(path, traffic):
+    with open(path, 'w', encoding='utf-8') as f:
+        for request in traffic:
+            f.write(json.dumps(request, ensure_ascii=False))
+            f.write('\n')
+
+
+def percentile(sorted_values, q):
+    """q-th percentile (0-100) of an ascending list, linearly interpolated"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+
+def summarize(latencies, errors, elapsed):
+    """Latency percentiles (ms) and throughput for one group of requests"""
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput_rps': round(count / elapsed, 1) if elapsed else None,
+        'mean_ms': ms(sum(latencies) / count) if count else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if count else None,
+    }
+
+
+def replay(send, traffic, concurrency=1):
+    """
+    Send every request with `concurrency` threads. send(path, body) returns
+    an HTTP status. Returns summaries per path, plus 'all'. Throughput is
+    over the whole run's wall time, so per-path values add up to 'all'.
+    """
+    def timed(request):
+        started = time.perf_counter()
+        try:
+            ok = send(request['path'], request['body']) < 400
+        except Exception:
+            ok = False
+        return request['path'], time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, traffic))
+    elapsed = time.perf_counter() - started
+
+    groups = {}
+    for path, latency, ok in results:
+        for key in (path, 'all'):
+            latencies, errors = groups.setdefault(key, ([], [0]))
+            latencies.append(latency)
+            errors[0] += not ok
+    return {key: summarize(latencies, errors[0], elapsed) for key, (latencies, errors) in groups.items()}
+
+
+class ClientSender:
+    """Sends requests in-process through django.test.Client, one client per thread"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def __call__(self, path, body):
+        from django.test import Client
+
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client()
+        return client.post(path, json.dumps(body), content_type='application/json').status_code
+
+
+class HTTPSender:
+    """Sends requests to a running server, one keep-alive connection per thread"""
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __call__(self, path, body):
+        payload = json.dumps(body).encode()
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = self.connection_class(self.netloc, timeout=self.timeout)
+            try:
+                connection.request('POST', self.prefix + path, payload, {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    connection.close()
+                    self._local.connection = None
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                # Server closed an idle keep-alive connection; reconnect once
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+
+def fake_openai_reply(body):
+    """Answer like the real model would, using the keyword classifier"""
+    from .classifier import classify_text
+
+    content = body['messages'][-1]['content']
+    return classify_text(content.removeprefix('Classify: ')).upper()
+
+
+@contextmanager
+def offline_backends(ai_latency=0.0):
+    """
+    Route the app's OpenAI and Firestore calls to local fakes for the
+    duration of the block. Yields (fake OpenAI server, FakeFirestore).
+    """
+    from django.conf import settings
+    from django.test import override_settings
+
+    from . import batching, firebase, llm, writebehind
+    from .fakes import FakeFirestore, start_fake_openai
+
+    if not getattr(settings._wrapped, 'SECRET_KEY', None):
+        # The session and messages middleware refuse to run without one; in
+        # production it comes from the environment. Left set: override_settings
+        # can't restore an empty SECRET_KEY.
+        settings.SECRET_KEY = 'offline-benchmark'
+    server = start_fake_openai(reply=fake_openai_reply, latency=ai_latency)
+    db = FakeFirestore()
+    with ExitStack() as stack:
+        stack.callback(server.server_close)
+        stack.callback(server.shutdown)
+        # No spool: nothing from a real run is replayed into the fake
+        stack.enter_context(override_settings(OPENAI_BASE_URL=server.base_url, FLAG_WRITE_SPOOL_PATH=''))
+        stack.enter_context(mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'offline-benchmark'}))
+        # Fresh singletons built against the fake server, closed afterwards
+        stack.enter_context(mock.patch.object(llm, '_llm_client', None))
+        stack.enter_context(mock.patch.object(batching, '_batcher', None))
+        stack.enter_context(mock.patch.object(firebase, '_db', db))
+        # A queue writing to the fake, drained before the fake goes away
+        stack.enter_context(mock.patch.object(writebehind, '_writer', None))
+        stack.callback(writebehind.shutdown)
+        stack.callback(lambda: llm._llm_client and llm._llm_client.close())
+        yield server, db
+
+
+def git_commit():
+    import subprocess
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,136 @@
+# api/cache.py
+import hashlib
+import logging
+import threading
+
+from django.core.cache import caches
+
+from .metrics import stage
+from .normalize import NORMALIZATION_VERSION, normalize
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_for_key(text):
+    """
+    Text as the classifiers see it (normalize(text).text), so texts that
+    differ only in case, Unicode form or spacing share a cache entry
+    """
+    return normalize(text).text if text else ""
+
+
+class VerdictCache:
+    """
+    Content-addressed cache of classification verdicts.
+
+    Keys are a SHA-256 of the normalized text combined with the classifier
+    method and its version (lexicon hash, model file, prompt) and the
+    normalization version, so a lexicon, model or normalization change never
+    serves stale verdicts. Storage is the Django cache
+    alias configured in settings.CACHES: by default a bounded LocMemCache,
+    which evicts least-recently-used entries past MAX_ENTRIES and expires
+    entries after TIMEOUT; point VERDICT_CACHE_URL at Redis to share it
+    between workers. Backend errors are logged and treated as misses.
+    """
+
+    def __init__(self, alias='verdicts'):
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def key(self, text, method, version):
+        digest = hashlib.sha256(normalize_for_key(text).encode('utf-8')).hexdigest()
+        return f"verdict:{method}:{version}:n{NORMALIZATION_VERSION}:{digest}"
+
+    def _count(self, hits=0, misses=0, errors=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.errors += errors
+
+    def get(self, text, method, version):
+        """Return the cached Verdict or None"""
+        return self.get_many([text], method, version).get(0)
+
+    def set(self, text, method, version, verdict):
+        self.set_many({0: text}, method, version, {0: verdict})
+
+    def get_many(self, texts, method, version):
+        """Look up several texts at once; returns {index: Verdict} for hits"""
+        keys = [self.key(text, method, version) for text in texts]
+        try:
+            with stage('cache'):
+                found = self.backend.get_many(keys)
+        except Exception as e:
+            logger.warning("Verdict cache read failed: %s", e)
+            self._count(misses=len(keys), errors=1)
+            return {}
+        verdicts = {i: found[key] for i, key in enumerate(keys) if key in found}
+        self._count(hits=len(verdicts), misses=len(keys) - len(verdicts))
+        return verdicts
+
+    def set_many(self, texts, method, version, verdicts):
+        """Store verdicts; texts and verdicts are both {index: value} maps"""
+        values = {
+            self.key(texts[i], method, version): verdict
+            for i, verdict in verdicts.items()
+        }
+        try:
+            with stage('cache'):
+                self.backend.set_many(values)
+        except Exception as e:
+            logger.warning("Verdict cache write failed: %s", e)
+            self._count(errors=1)
+
+    async def aget(self, text, method, version):
+        return (await self.aget_many([text], method, version)).get(0)
+
+    async def aset(self, text, method, version, verdict):
+        await self.aset_many({0: text}, method, version, {0: verdict})
+
+    async def aget_many(self, texts, method, version):
+        """Async get_many, for the ASGI views"""
+        keys = [self.key(text, method, version) for text in texts]
+        try:
+            with stage('cache'):
+                found = await self.backend.aget_many(keys)
+        except Exception as e:
+            logger.warning("Verdict cache read failed: %s", e)
+            self._count(misses=len(keys), errors=1)
+            return {}
+        verdicts = {i: found[key] for i, key in enumerate(keys) if key in found}
+        self._count(hits=len(verdicts), misses=len(keys) - len(verdicts))
+        return verdicts
+
+    async def aset_many(self, texts, method, version, verdicts):
+        """Async set_many, for the ASGI views"""
+        values = {
+            self.key(texts[i], method, version): verdict
+            for i, verdict in verdicts.items()
+        }
+        try:
+            with stage('cache'):
+                await self.backend.aset_many(values)
+        except Exception as e:
+            logger.warning("Verdict cache write failed: %s", e)
+            self._count(errors=1)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": self.backend.__class__.__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+verdict_cache = VerdictCache()
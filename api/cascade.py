@@ -0,0 +1,127 @@
+# api/cascade.py
+# Tiered classification: keywords -> local model -> LLM only when uncertain.
+#
+# When a tier fails the next one answers and the verdict is marked degraded,
+# so the views don't cache it past the outage: the LLM stands in for a
+# failed model, and an uncertain model verdict stands when the LLM fails.
+# If the model and the LLM both fail, CascadeUnavailable is raised.
+import asyncio
+import logging
+
+from django.conf import settings
+
+from .batching import aclassify_with_llm, classify_many_with_llm
+from .classifier import Verdict, get_lexicon, match_keywords
+from .engine import aclassify_many, classify_many, get_engine
+from .llm import AI_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+def cascade_version():
+    """Version tag covering every tier and the cascade thresholds"""
+    return "-".join([
+        get_lexicon().version, get_engine().version, AI_VERSION,
+        ",".join(settings.CASCADE_KEYWORD_FLAGS),
+        str(settings.CASCADE_GREEN_LOW), str(settings.CASCADE_GREEN_HIGH),
+    ])
+
+
+def keyword_tier(text):
+    """Verdict from a confident keyword hit, or None to fall through"""
+    flag = match_keywords(text).flag
+    if flag in settings.CASCADE_KEYWORD_FLAGS:
+        return Verdict(flag, None, 'keywords')
+    return None
+
+
+def is_uncertain(verdict):
+    """True if the model's verdict falls in the band that escalates to the LLM"""
+    green = verdict.scores.get('green', 0.0)
+    return settings.CASCADE_GREEN_LOW <= green < settings.CASCADE_GREEN_HIGH
+
+
+def _split(texts):
+    """Run the keyword tier; returns (verdicts, indices still pending)"""
+    verdicts = [keyword_tier(text) for text in texts]
+    pending = [i for i, verdict in enumerate(verdicts) if verdict is None]
+    return verdicts, pending
+
+
+class CascadeUnavailable(Exception):
+    """Neither the model nor the LLM could classify a text"""
+
+
+def _llm_instead(verdicts, pending, flags, error):
+    """Verdicts from the LLM for the texts the model failed on"""
+    for i, flag in zip(pending, flags):
+        if flag is None:
+            raise CascadeUnavailable(f"Model and LLM both failed: {error}") from error
+        verdicts[i] = Verdict(flag, None, 'ai', degraded=True)
+    return verdicts
+
+
+def _llm_answers(verdicts, uncertain, flags):
+    """Apply the LLM's flags to the uncertain model verdicts"""
+    for i, flag in zip(uncertain, flags):
+        if flag is None:
+            # The LLM failed: the model's verdict stands, marked degraded
+            verdicts[i] = verdicts[i]._replace(degraded=True)
+        else:
+            verdicts[i] = Verdict(flag, verdicts[i].scores, 'ai')
+    return verdicts
+
+
+def classify_cascade_many(texts):
+    """Cascade-classify a list of texts; the model tier runs vectorized"""
+    verdicts, pending = _split(texts)
+    if not pending:
+        return verdicts
+    try:
+        model_verdicts = classify_many([texts[i] for i in pending])
+    except Exception as e:
+        logger.error("Model error, escalating %d texts to the LLM: %s", len(pending), e)
+        return _llm_instead(verdicts, pending, classify_many_with_llm([texts[i] for i in pending]), e)
+
+    uncertain = []
+    for i, verdict in zip(pending, model_verdicts):
+        verdicts[i] = verdict
+        if is_uncertain(verdict):
+            uncertain.append(i)
+    if uncertain:
+        _llm_answers(verdicts, uncertain, classify_many_with_llm([texts[i] for i in uncertain]))
+    return verdicts
+
+
+def classify_cascade(text):
+    return classify_cascade_many([text])[0]
+
+
+async def aclassify_cascade_many(texts):
+    """Async classify_cascade_many(): model in the executor, LLM calls concurrent"""
+    verdicts, pending = _split(texts)
+    if not pending:
+        return verdicts
+    try:
+        model_verdicts = await aclassify_many([texts[i] for i in pending])
+    except Exception as e:
+        logger.error("Model error, escalating %d texts to the LLM: %s", len(pending), e)
+        return _llm_instead(verdicts, pending, await _aclassify_many_with_llm([texts[i] for i in pending]), e)
+
+    uncertain = []
+    for i, verdict in zip(pending, model_verdicts):
+        verdicts[i] = verdict
+        if is_uncertain(verdict):
+            uncertain.append(i)
+    if uncertain:
+        _llm_answers(verdicts, uncertain, await _aclassify_many_with_llm([texts[i] for i in uncertain]))
+    return verdicts
+
+
+async def _aclassify_many_with_llm(texts):
+    """Concurrent LLM calls; like classify_many_with_llm, failures come back as None"""
+    flags = await asyncio.gather(*(aclassify_with_llm(text) for text in texts), return_exceptions=True)
+    for flag in flags:
+        if isinstance(flag, Exception):
+            logger.error("OpenAI error: %s", flag)
+    return [None if isinstance(flag, Exception) else flag for flag in flags]
@@ -1,17 +1,79 @@
 # api/classifier.py
+import hashlib
+import json
+from contextvars import ContextVar
+from typing import NamedTuple
+
+from .lexicon import RED_FLAGS, SUBWORD_FLAGS, WHOLE_WORD_FLAGS, YELLOW_FLAGS
+from .matcher import KeywordMatcher
+from .metrics import stage
+from .normalize import NORMALIZATION_VERSION
+
+class Verdict(NamedTuple):
+    """A classification result: the flag, model scores if any, and which classifier produced it"""
+    flag: str
+    scores: dict = None
+    tier: str = None
+    # A tier that should have answered failed; degraded verdicts aren't cached
+    degraded: bool = False
+
+
+class Lexicon(NamedTuple):
+    """A compiled keyword lexicon: the matcher, a hash of what it matches and where it came from"""
+    matcher: KeywordMatcher
+    version: str  # part of every keyword verdict cache key
+    name: str  # registry version (api/artifacts.py), or 'builtin'
+
+
+def compile_lexicon(red, yellow, subword=(), whole_word=(), name='builtin'):
+    matcher = KeywordMatcher(red, yellow, subword, whole_word)
+    # Changes whenever the terms or the normalization do
+    version = hashlib.sha256(
+        "\n".join(
+            [f"normalize:{NORMALIZATION_VERSION}"]
+            + [f"{severity}:{pattern}" for severity, pattern in zip(matcher.severities, matcher.patterns)]
+        ).encode()
+    ).hexdigest()[:12]
+    return Lexicon(matcher, version, name)
+
+
+def load_lexicon(path, name='builtin'):
+    """
+    Compile a lexicon file: JSON with "red" and "yellow" term lists and
+    optional "subword" and "whole_word" lists, as in api/lexicon.py
+    """
+    with open(path, encoding='utf-8') as f:
+        terms = json.load(f)
+    return compile_lexicon(terms['red'], terms['yellow'], terms.get('subword', ()), terms.get('whole_word', ()), name)
+
+
+# Compiled once at import; api/artifacts.py swaps in registry versions
+BUILTIN_LEXICON = compile_lexicon(RED_FLAGS, YELLOW_FLAGS, SUBWORD_FLAGS, WHOLE_WORD_FLAGS)
+_lexicon = BUILTIN_LEXICON
+
+# The lexicon a request started with; it keeps using it across a swap
+pinned_lexicon = ContextVar('pinned_lexicon', default=None)
+
+
+def get_lexicon():
+    """The lexicon pinned for this request, else the current one"""
+    return pinned_lexicon.get() or _lexicon
+
+
+def set_lexicon(lexicon):
+    """Serve lexicon from now on; requests already running keep theirs"""
+    global _lexicon
+    _lexicon = lexicon
+
+
+def match_keywords(text):
+    """Return the KeywordMatch (flag plus matched terms) for text"""
+    matcher = get_lexicon().matcher
+    with stage('keywords'):
+        return matcher.match(text)
+
 
 def classify_text(text):
-    lower_case_text = text.lower()
-    
-    # Keywords that indicate a threat
-    red_flags = ["threat", "hack", "kill", "attack", "expose you", "doxx you", "fuck", "shit", "bitch", "asshole", "cunt", "kutte", "kameene", "chutiya", "madarchod"]
-    
-    # Keywords that indicate potential spam or phishing
-    yellow_flags = ["prize", "winner", "congratulations", "claim", "lottery", "free money", "investment", "verify your account", "urgent", "click this link", "inaam jeeta"]
-
-    if any(keyword in lower_case_text for keyword in red_flags):
-        return 'red'
-    if any(keyword in lower_case_text for keyword in yellow_flags):
-        return 'yellow'
-        
-    return 'green'
\ No newline at end of file
+    matcher = get_lexicon().matcher
+    with stage('keywords'):
+        return matcher.classify(text)
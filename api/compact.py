@@ -0,0 +1,245 @@
+# api/compact.py
+# Compact, mmap-able export of the trained text classifier and a numpy-only
+# scorer for it.
+#
+# An exported model is a directory of raw .npy arrays plus meta.json:
+#   class_log_prior.npy    (n_classes,)               float64
+#   feature_log_prob.npy   (n_features, n_classes)    float32
+#   term_hashes.npy        (n_terms,) sorted          uint64   TF-IDF only
+#   term_ids.npy           (n_terms,)                 int32    TF-IDF only
+#   idf.npy                (n_features,)              float32  TF-IDF only
+# TF-IDF terms are looked up by a 64-bit hash of the term (binary search over
+# term_hashes), so no Python dict is built at load time. Hashing models need
+# no vocabulary at all. Workers load the arrays with mmap_mode='r' and share
+# the pages through the OS page cache.
+#
+# The export path is a symlink to a hidden sibling directory holding one
+# version (.model.<n>). A new export is written beside it and the link is
+# swapped in one rename, so a loader sees either the old arrays or the new
+# ones. The previous version is kept for loaders still reading it.
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+META = 'meta.json'
+FORMAT_VERSION = 1
+MASK32 = 0xffffffff
+
+
+def term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _rotl32(x, r):
+    return ((x << r) | (x >> (32 - r))) & MASK32
+
+
+def murmurhash3_32(data, seed=0):
+    """Signed MurmurHash3 x86_32, matching sklearn.utils.murmurhash3_32"""
+    c1, c2 = 0xcc9e2d51, 0x1b873593
+    h = seed & MASK32
+    nblocks = len(data) // 4
+    for i in range(nblocks):
+        k = int.from_bytes(data[4 * i:4 * i + 4], 'little')
+        k = _rotl32((k * c1) & MASK32, 15)
+        h ^= (k * c2) & MASK32
+        h = (_rotl32(h, 13) * 5 + 0xe6546b64) & MASK32
+    tail = data[4 * nblocks:]
+    k = 0
+    if len(tail) >= 3:
+        k ^= tail[2] << 16
+    if len(tail) >= 2:
+        k ^= tail[1] << 8
+    if tail:
+        k ^= tail[0]
+        k = _rotl32((k * c1) & MASK32, 15)
+        h ^= (k * c2) & MASK32
+    h ^= len(data)
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & MASK32
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & MASK32
+    h ^= h >> 16
+    return h - (1 << 32) if h & 0x80000000 else h
+
+
+def _check_supported(vectorizer):
+    params = vectorizer.get_params()
+    if params.get('analyzer') != 'word' or params.get('ngram_range') != (1, 1) \
+            or params.get('stop_words') is not None or params.get('strip_accents') is not None \
+            or params.get('preprocessor') is not None or params.get('tokenizer') is not None:
+        raise ValueError("Only word unigram vectorizers with default preprocessing can be exported")
+
+
+def export_model(pipeline, path):
+    """
+    Write a fitted [TfidfVectorizer|HashingVectorizer] + MultinomialNB
+    pipeline as flat arrays to a new version directory and point the
+    symlink at path to it atomically.
+    """
+    from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+
+    vectorizer, nb = pipeline.steps[0][1], pipeline.steps[-1][1]
+    _check_supported(vectorizer)
+    meta = {
+        'format': FORMAT_VERSION,
+        'classes': [str(c) for c in nb.classes_],
+        'lowercase': vectorizer.lowercase,
+        'token_pattern': vectorizer.token_pattern,
+        'norm': vectorizer.norm,
+    }
+    arrays = {
+        'class_log_prior': np.asarray(nb.class_log_prior_, dtype=np.float64),
+        'feature_log_prob': np.ascontiguousarray(nb.feature_log_prob_.T, dtype=np.float32),
+    }
+    if isinstance(vectorizer, TfidfVectorizer):
+        if vectorizer.sublinear_tf or vectorizer.binary:
+            raise ValueError("sublinear_tf / binary TF-IDF export isn't supported")
+        terms = list(vectorizer.vocabulary_.items())
+        hashes = np.fromiter((term_hash(t) for t, _ in terms), dtype=np.uint64, count=len(terms))
+        ids = np.fromiter((i for _, i in terms), dtype=np.int32, count=len(terms))
+        order = np.argsort(hashes)
+        if np.any(hashes[order][1:] == hashes[order][:-1]):
+            raise ValueError("Term hash collision; can't export this vocabulary")
+        meta.update(kind='tfidf', n_features=len(terms), use_idf=vectorizer.use_idf)
+        arrays.update(term_hashes=hashes[order], term_ids=ids[order])
+        if vectorizer.use_idf:
+            arrays['idf'] = np.asarray(vectorizer.idf_, dtype=np.float32)
+    elif isinstance(vectorizer, HashingVectorizer):
+        if vectorizer.alternate_sign or vectorizer.binary:
+            raise ValueError("Only alternate_sign=False, binary=False hashing models can be exported")
+        meta.update(kind='hashing', n_features=vectorizer.n_features)
+    else:
+        raise ValueError(f"Unsupported vectorizer {type(vectorizer).__name__}")
+
+    path = Path(path)
+    version = path.with_name(f'.{path.name}.{time.time_ns():x}')
+    version.mkdir(parents=True)
+    for name, array in arrays.items():
+        np.save(version / f'{name}.npy', array)
+    (version / META).write_text(json.dumps(meta, indent=2))
+
+    link = path.with_name(f'.{path.name}.link')
+    link.unlink(missing_ok=True)
+    os.symlink(version.name, link)
+    if path.is_dir() and not path.is_symlink():
+        # An export from before versioned directories: the one swap that
+        # can't be atomic
+        shutil.rmtree(path)
+    os.replace(link, path)
+    _remove_old_versions(path, keep=2)
+    return path
+
+
+def _remove_old_versions(path, keep):
+    """Delete all but the newest `keep` version directories behind path"""
+    versions = sorted(
+        (p for p in path.parent.glob(f'.{path.name}.*') if re.fullmatch(r'\.[0-9a-f]+', p.suffix)),
+        key=lambda p: int(p.suffix[1:], 16),
+    )
+    for old in versions[:-keep]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+class CompactModel:
+    """
+    numpy-only scorer for an exported model. Exposes the subset of the
+    sklearn pipeline API the engine uses: classes_ and predict_proba().
+    """
+
+    def __init__(self, path, mmap_mode='r'):
+        # Resolve the link once, so every file comes from the same version
+        path = Path(path).resolve()
+        meta = json.loads((path / META).read_text())
+        if meta.get('format') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compact model format {meta.get('format')}")
+        self.meta = meta
+        self.kind = meta['kind']
+        self.classes_ = np.asarray(meta['classes'])
+        self.n_features = meta['n_features']
+        self.lowercase = meta['lowercase']
+        self.norm = meta['norm']
+        self._token_re = re.compile(meta['token_pattern'])
+
+        def load(name):
+            return np.load(path / f'{name}.npy', mmap_mode=mmap_mode)
+
+        self.class_log_prior = load('class_log_prior')
+        self.feature_log_prob = load('feature_log_prob')
+        if self.kind == 'tfidf':
+            self.term_hashes = load('term_hashes')
+            self.term_ids = load('term_ids')
+            self.idf = load('idf') if meta.get('use_idf') else None
+            self._feature_ids = self._tfidf_ids
+        else:
+            self.idf = None
+            self._feature_ids = self._hashing_ids
+            self._hash_index = lru_cache(maxsize=65536)(self._hash_index_uncached)
+
+    def tokens(self, text):
+        if self.lowercase:
+            text = text.lower()
+        return self._token_re.findall(text)
+
+    def _tfidf_ids(self, tokens):
+        if not tokens:
+            return np.empty(0, dtype=np.int64)
+        hashes = np.fromiter((term_hash(t) for t in tokens), dtype=np.uint64, count=len(tokens))
+        pos = np.searchsorted(self.term_hashes, hashes)
+        pos[pos == len(self.term_hashes)] = 0
+        found = self.term_hashes[pos] == hashes
+        return self.term_ids[pos[found]].astype(np.int64)
+
+    def _hash_index_uncached(self, token):
+        h = murmurhash3_32(token.encode('utf-8'))
+        if h == -2147483648:
+            return (2147483647 - (self.n_features - 1)) % self.n_features
+        return abs(h) % self.n_features
+
+    def _hashing_ids(self, tokens):
+        return np.fromiter((self._hash_index(t) for t in tokens), dtype=np.int64, count=len(tokens))
+
+    def joint_log_likelihood(self, texts):
+        n = len(texts)
+        ids_per_doc = [self._feature_ids(self.tokens(text)) for text in texts]
+        lengths = np.fromiter((len(ids) for ids in ids_per_doc), dtype=np.int64, count=n)
+        jll = np.tile(self.class_log_prior, (n, 1))
+        if not lengths.sum():
+            return jll
+
+        docs = np.repeat(np.arange(n), lengths)
+        ids = np.concatenate(ids_per_doc)
+        # Term counts per (doc, feature)
+        keys, counts = np.unique(docs * self.n_features + ids, return_counts=True)
+        docs, ids = keys // self.n_features, keys % self.n_features
+        values = counts.astype(np.float64)
+        if self.idf is not None:
+            values *= self.idf[ids]
+        if self.norm == 'l2':
+            norms = np.sqrt(np.bincount(docs, weights=values * values, minlength=n))
+            values /= norms[docs]
+        elif self.norm == 'l1':
+            norms = np.bincount(docs, weights=np.abs(values), minlength=n)
+            values /= norms[docs]
+
+        weights = self.feature_log_prob[ids].astype(np.float64)
+        for c in range(len(self.classes_)):
+            jll[:, c] += np.bincount(docs, weights=values * weights[:, c], minlength=n)
+        return jll
+
+    def predict_proba(self, texts):
+        jll = self.joint_log_likelihood(list(texts))
+        jll -= jll.max(axis=1, keepdims=True)
+        proba = np.exp(jll)
+        proba /= proba.sum(axis=1, keepdims=True)
+        return proba
+
+    def predict(self, texts):
+        return self.classes_[self.joint_log_likelihood(list(texts)).argmax(axis=1)]
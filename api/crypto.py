@@ -1,7 +1,41 @@
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import unpad
+from functools import lru_cache
+from typing import NamedTuple, Optional
 import base64
+import binascii
 import hashlib
+import logging
+
+import numpy as np
+
+from .metrics import stage
+
+logger = logging.getLogger(__name__)
+
+DECRYPTION_FAILED = "[Decryption Failed]"
+
+IV_SIZE = 16
+
+
+class DecryptResult(NamedTuple):
+    """Outcome of decrypting one message: text on success, error otherwise"""
+    text: Optional[str]
+    error: Optional[str] = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+@lru_cache(maxsize=4096)
+def chat_key(chat_id):
+    """
+    Derive the AES-256 key for a chat. The key is the SHA-256 of the chat id,
+    cached per chat (LRU) so bulk decrypts of one chat hash it only once.
+    """
+    return hashlib.sha256(chat_id.encode()).digest()
+
 
 def decrypt_message(encrypted_text, chat_id):
     """
@@ -9,27 +43,87 @@ def decrypt_message(encrypted_text, chat_id):
     The encryption key is derived from the chat_id to ensure it's always 32 bytes.
     """
     try:
-        # Use SHA-256 to hash the chat_id into a secure, 32-byte key.
-        # This ensures the key is always the correct length for AES-256.
-        key = hashlib.sha256(chat_id.encode()).digest()
-        
+        key = chat_key(chat_id)
+
         # Decode the Base64 encoded message
         decoded_data = base64.b64decode(encrypted_text)
-        
+
         # The first 16 bytes are the initialization vector (IV)
-        iv = decoded_data[:16]
+        iv = decoded_data[:IV_SIZE]
         # The rest of the data is the encrypted ciphertext
-        encrypted_data = decoded_data[16:]
-        
-        cipher = AES.new(key, AES.MODE_CBC, iv)
-        
-        # Decrypt and unpad the data to get the original message
-        decrypted_padded_data = cipher.decrypt(encrypted_data)
-        decrypted_data = unpad(decrypted_padded_data, AES.block_size)
-        
+        encrypted_data = decoded_data[IV_SIZE:]
+
+        with stage('decrypt'):
+            cipher = AES.new(key, AES.MODE_CBC, iv)
+
+            # Decrypt and unpad the data to get the original message
+            decrypted_padded_data = cipher.decrypt(encrypted_data)
+            decrypted_data = unpad(decrypted_padded_data, AES.block_size)
+
         return decrypted_data.decode('utf-8')
 
     except Exception as e:
-        print(f"Decryption error: {e}")
+        logger.warning("Decryption error: %s", e)
         # If decryption fails, return a placeholder string
-        return "[Decryption Failed]"
+        return DECRYPTION_FAILED
+
+
+@lru_cache(maxsize=256)
+def _block_cipher(chat_id):
+    # ECB applies the raw block cipher and holds no per-message state, so one
+    # object per chat can be reused for every bulk decrypt.
+    return AES.new(chat_key(chat_id), AES.MODE_ECB)
+
+
+def decrypt_many(chat_id, ciphertexts):
+    """
+    Decrypt a list of Base64 AES-CBC messages from one chat.
+
+    CBC decryption is P[i] = D(C[i]) XOR C[i-1], with C[-1] the IV. So
+    instead of building a cipher per message, every message's blocks are
+    laid end to end. One ECB cipher, built once per chat, decrypts the
+    whole stream in a single call, and numpy XORs the result with the
+    matching stream of previous blocks. Both streams are assembled from
+    memoryview slices of the decoded messages. Each plaintext is unpadded
+    and decoded straight from a view of the output.
+
+    Base64 is decoded as in decrypt_message, so line breaks and other
+    characters outside the alphabet are skipped rather than rejected.
+
+    Returns one DecryptResult per input, in order. Failures carry an error
+    message instead of raising.
+    """
+    results = [None] * len(ciphertexts)
+    bodies, chains, spans = [], [], []
+    offset = 0
+    for index, encrypted_text in enumerate(ciphertexts):
+        try:
+            decoded = memoryview(base64.b64decode(encrypted_text))
+        except (binascii.Error, TypeError, ValueError) as e:
+            results[index] = DecryptResult(None, f"invalid base64: {e}")
+            continue
+        size = len(decoded) - IV_SIZE
+        if size <= 0 or size % AES.block_size:
+            results[index] = DecryptResult(None, "ciphertext length is not a multiple of the block size")
+            continue
+        bodies.append(decoded[IV_SIZE:])
+        chains.append(decoded[:-AES.block_size])
+        spans.append((index, offset, size))
+        offset += size
+
+    if spans:
+        with stage('decrypt'):
+            decrypted = np.frombuffer(_block_cipher(chat_id).decrypt(b"".join(bodies)), np.uint8)
+            chain = np.frombuffer(b"".join(chains), np.uint8)
+            plain = memoryview(np.bitwise_xor(decrypted, chain))
+        for index, start, size in spans:
+            message = plain[start:start + size]
+            padding = message[-1]
+            if not 1 <= padding <= AES.block_size or message[-padding:] != bytes([padding]) * padding:
+                results[index] = DecryptResult(None, "padding is incorrect")
+                continue
+            try:
+                results[index] = DecryptResult(str(message[:size - padding], 'utf-8'))
+            except UnicodeDecodeError as e:
+                results[index] = DecryptResult(None, f"invalid utf-8: {e}")
+    return results
@@ -0,0 +1,175 @@
+# api/datasets.py
+# Streaming dataset preparation and sharded storage for training.
+#
+# A prepared dataset is a directory holding a manifest.json and, per shard,
+# three .npy files: the UTF-8 bytes of every text laid end to end
+# (shard-NNNNN.text.npy), the start offset of each text
+# (shard-NNNNN.offsets.npy, one extra entry marking the end) and the
+# label ids (shard-NNNNN.labels.npy). Shards can be memory-mapped and
+# consumed one at a time.
+import hashlib
+import json
+import random
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from .normalize import fold
+
+LABELS = ('green', 'red', 'yellow')
+LABEL_IDS = {label: i for i, label in enumerate(LABELS)}
+
+MANIFEST = 'manifest.json'
+
+
+def normalize_text(text):
+    """Text in the form the model is served (normalize.fold), or '' for missing values"""
+    if not isinstance(text, str):
+        return ''
+    return fold(text)
+
+
+def content_hash(text):
+    """64-bit content hash used for de-duplication (case-insensitive)"""
+    return int.from_bytes(hashlib.blake2b(text.lower().encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def iter_csv(path, text_column, label_column, label_map=None, chunksize=10000, **read_csv_kwargs):
+    """Yield (text, label) pairs from a CSV file, chunksize rows at a time"""
+    import pandas as pd
+
+    for chunk in pd.read_csv(path, chunksize=chunksize, encoding='utf-8', **read_csv_kwargs):
+        labels = chunk[label_column]
+        if label_map is not None:
+            labels = labels.map(label_map)
+        yield from zip(chunk[text_column], labels)
+
+
+def iter_sms_spam(path='SMSSpamCollection', chunksize=10000):
+    return iter_csv(path, 'text', 'label_raw', {'ham': 'green', 'spam': 'yellow'}, chunksize,
+                    sep='\t', header=None, names=['label_raw', 'text'])
+
+
+def iter_labeled_data(path='labeled_data.csv', chunksize=10000):
+    return iter_csv(path, 'tweet', 'class', {0: 'red', 1: 'red', 2: 'green'}, chunksize)
+
+
+def iter_labeled_csv(path, chunksize=10000):
+    """Extra labeled data (e.g. production-flagged messages) with text,label columns"""
+    return iter_csv(path, 'text', 'label', None, chunksize)
+
+
+class DatasetWriter:
+    """
+    Normalizes, de-duplicates and externally shuffles (text, label) rows into
+    shards.
+
+    Pass one scatters each accepted row into one of `buckets` temporary files
+    at random. Pass two loads one bucket at a time, shuffles it in memory and
+    writes it out as a shard, so peak memory is about one bucket. The
+    de-duplication keeps one 64-bit hash per distinct text.
+    """
+
+    def __init__(self, output_dir, buckets=16, seed=None):
+        self.output_dir = Path(output_dir)
+        self.buckets = buckets
+        self.random = random.Random(seed)
+        self.seen = set()
+        self.stats = {'read': 0, 'written': 0, 'duplicates': 0, 'invalid': 0}
+        self._tmp = Path(tempfile.mkdtemp(prefix='prepare-'))
+        self._files = [open(self._tmp / f'bucket-{i}.jsonl', 'w', encoding='utf-8') for i in range(buckets)]
+
+    def add(self, rows):
+        for text, label in rows:
+            self.stats['read'] += 1
+            text = normalize_text(text)
+            if not text or label not in LABEL_IDS:
+                self.stats['invalid'] += 1
+                continue
+            digest = content_hash(text)
+            if digest in self.seen:
+                self.stats['duplicates'] += 1
+                continue
+            self.seen.add(digest)
+            bucket = self._files[self.random.randrange(self.buckets)]
+            bucket.write(json.dumps([LABEL_IDS[label], text], ensure_ascii=False))
+            bucket.write('\n')
+
+    def finish(self):
+        """Shuffle each bucket into a shard and write the manifest"""
+        for f in self._files:
+            f.close()
+        if self.output_dir.exists():
+            shutil.rmtree(self.output_dir)
+        self.output_dir.mkdir(parents=True)
+
+        shards, counts = [], [0] * len(LABELS)
+        try:
+            for i in range(self.buckets):
+                with open(self._tmp / f'bucket-{i}.jsonl', encoding='utf-8') as f:
+                    rows = [json.loads(line) for line in f]
+                if not rows:
+                    continue
+                self.random.shuffle(rows)
+                name = f'shard-{len(shards):05d}'
+                write_shard(self.output_dir / name, [text for _, text in rows], [label for label, _ in rows])
+                for label, _ in rows:
+                    counts[label] += 1
+                shards.append({'name': name, 'rows': len(rows)})
+        finally:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+
+        self.stats['written'] = sum(counts)
+        manifest = {
+            'labels': list(LABELS),
+            'rows': self.stats['written'],
+            'label_counts': dict(zip(LABELS, counts)),
+            'shards': shards,
+        }
+        (self.output_dir / MANIFEST).write_text(json.dumps(manifest, indent=2))
+        return manifest
+
+
+def write_shard(prefix, texts, labels):
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(f'{prefix}.text.npy', np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    np.save(f'{prefix}.offsets.npy', offsets)
+    np.save(f'{prefix}.labels.npy', np.asarray(labels, dtype=np.int8))
+
+
+def read_manifest(dataset_dir):
+    return json.loads((Path(dataset_dir) / MANIFEST).read_text())
+
+
+def iter_shards(dataset_dir):
+    """Yield (texts, labels) per shard; labels are label names, as a numpy array"""
+    dataset_dir = Path(dataset_dir)
+    manifest = read_manifest(dataset_dir)
+    label_names = np.asarray(manifest['labels'])
+    for shard in manifest['shards']:
+        prefix = dataset_dir / shard['name']
+        data = np.load(f'{prefix}.text.npy', mmap_mode='r')
+        offsets = np.load(f'{prefix}.offsets.npy')
+        labels = np.load(f'{prefix}.labels.npy')
+        buffer = memoryview(data)
+        texts = [str(buffer[start:end], 'utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+        yield texts, label_names[labels]
+
+
+def read_labels(dataset_dir):
+    """All label names of a dataset, in shard order, without decoding any text"""
+    dataset_dir = Path(dataset_dir)
+    manifest = read_manifest(dataset_dir)
+    label_ids = [np.load(dataset_dir / f"{shard['name']}.labels.npy") for shard in manifest['shards']]
+    return np.asarray(manifest['labels'])[np.concatenate(label_ids)]
+
+
+def iter_batches(dataset_dir, batch_size=5000):
+    """Yield (texts, labels) mini-batches of at most batch_size rows"""
+    for texts, labels in iter_shards(dataset_dir):
+        for start in range(0, len(texts), batch_size):
+            yield texts[start:start + batch_size], labels[start:start + batch_size]
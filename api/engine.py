@@ -0,0 +1,194 @@
+# api/engine.py
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+from .classifier import Verdict
+from .metrics import stage
+from .normalize import normalize
+
+logger = logging.getLogger(__name__)
+
+
+class ClassifierEngine:
+    """
+    Serves the trained TF-IDF + MultinomialNB pipeline in-process.
+
+    The joblib file is loaded with mmap_mode='r' so the numpy arrays inside
+    the pipeline (idf weights, NB log-probabilities) are backed by the file's
+    page cache. When the engine is preloaded in the gunicorn master the pages
+    are shared copy-on-write by every forked worker.
+
+    If model_path is a directory written by `train_model --export`, the
+    compact export is loaded instead: no unpickling and no sklearn import,
+    only a few mmapped .npy files (see api/compact.py).
+
+    name is the registry version the model came from (api/artifacts.py),
+    or 'builtin' for CLASSIFIER_MODEL_PATH.
+    """
+
+    def __init__(self, model_path, name='builtin'):
+        self.model_path = Path(model_path)
+        self.name = name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Pool children started without fork get the path, not the model
+        return {'model_path': self.model_path, 'name': self.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['model_path'], state['name'])
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def load(self):
+        """Load the pipeline once; safe to call from several threads"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    if self.model_path.is_dir():
+                        from .compact import CompactModel
+
+                        self._model = CompactModel(self.model_path)
+                    else:
+                        import joblib
+
+                        self._model = joblib.load(self.model_path, mmap_mode='r')
+                    logger.info("Classifier model loaded from %s", self.model_path)
+        return self._model
+
+    @property
+    def version(self):
+        """Identifies the model file on disk without loading it"""
+        path = self.model_path
+        if path.is_dir():
+            from .compact import META
+
+            path = path / META
+        try:
+            stat = path.stat()
+        except OSError:
+            return "missing"
+        return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+    @property
+    def classes(self):
+        return [str(label) for label in self.load().classes_]
+
+    def predict_proba(self, texts):
+        """Return an (n_texts, n_classes) probability matrix for normalized texts"""
+        return self.load().predict_proba(texts)
+
+    def classify(self, text):
+        """Classify one text, returning a Verdict with {label: probability} scores"""
+        return self.classify_many([text])[0]
+
+    def classify_many(self, texts):
+        """
+        Classify a list of texts with a single vectorized pass: one sparse
+        TF-IDF transform and one predict_proba over the whole matrix.
+        The model sees normalize(text).text, the same form it was trained on.
+        Returns a list of Verdicts in input order.
+        """
+        if not texts:
+            return []
+        with stage('model'):
+            probabilities = self.predict_proba([normalize(text).text for text in texts])
+        return self.verdicts(probabilities)
+
+    def verdicts(self, probabilities):
+        """Verdicts for the rows of a predict_proba() matrix"""
+        classes = self.classes
+        best = probabilities.argmax(axis=1)
+        return [
+            Verdict(classes[i], dict(zip(classes, row.tolist())), 'model')
+            for i, row in zip(best.tolist(), probabilities)
+        ]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+_executor = None
+
+# The engine a request started with; it keeps using it across a swap
+pinned_engine = contextvars.ContextVar('pinned_engine', default=None)
+
+
+def get_engine():
+    """Return the engine pinned for this request, else the process-wide one"""
+    global _engine
+    pinned = pinned_engine.get()
+    if pinned is not None:
+        return pinned
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = ClassifierEngine(settings.CLASSIFIER_MODEL_PATH)
+    return _engine
+
+
+def set_engine(engine):
+    """Serve engine from now on; requests already running keep theirs"""
+    global _engine
+    _engine = engine
+
+
+def get_executor():
+    """Bounded thread pool that runs model inference off the event loop"""
+    global _executor
+    if _executor is None:
+        with _engine_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.MODEL_EXECUTOR_WORKERS,
+                    thread_name_prefix='classifier',
+                )
+    return _executor
+
+
+def classify_many(texts):
+    """
+    Model verdicts for texts: ClassifierEngine.classify_many, or the
+    process pool when CLASSIFIER_POOL_WORKERS enables it (api/pool.py)
+    """
+    from .pool import get_pool
+
+    engine = get_engine()
+    pool = get_pool()
+    if pool is None:
+        return engine.classify_many(texts)
+    return pool.classify_many(texts, engine)
+
+
+async def aclassify_many(texts):
+    """Run classify_many in the executor and await it"""
+    loop = asyncio.get_running_loop()
+    # The executor thread sees this request's pinned engine
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), context.run, classify_many, texts)
+
+
+def preload():
+    """
+    Load the model before workers fork (gunicorn preload_app).
+    Failures are logged rather than raised so the keyword and AI paths
+    keep working when the model file is missing.
+    """
+    from .artifacts import get_watcher
+
+    watcher = get_watcher()
+    if watcher is not None:
+        # Start on the registry's active versions rather than swapping later
+        watcher.check()
+    try:
+        get_engine().load()
+    except Exception as e:
+        logger.error("Could not preload classifier model: %s", e)
@@ -0,0 +1,255 @@
+# api/evaluation.py
+# Offline evaluation of the classifiers on labeled messages: quality
+# (precision/recall per flag), speed (latency, throughput) and estimated
+# LLM cost, on the same held-out split for every classifier, so cascade
+# thresholds and lexicon changes can be compared on data.
+#
+# Messages are classified one at a time, as a request would be, without
+# the verdict cache. Keyword and model evaluation is CPU-bound and runs in
+# child processes; the methods that call the LLM wait on the network and
+# run on threads instead.
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import NamedTuple
+
+from django.conf import settings
+
+from .benchmark import summarize
+
+FLAGS = ('red', 'yellow', 'green')
+METHODS = ('keywords', 'model', 'cascade', 'ai')
+# Methods that call the LLM; evaluated on threads
+LLM_METHODS = ('cascade', 'ai')
+
+# Token estimate for one classification call: about four characters per
+# token, a few tokens of chat framing per message and a one-word reply
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_TOKENS = 2
+
+
+class Outcome(NamedTuple):
+    """One classified message: the flag (None if the classifier failed) and what it took"""
+    flag: str
+    seconds: float
+    green: float = None  # the model's green probability, when the model ran
+    llm: bool = False  # whether the LLM was (or, failing, would have been) called
+
+
+def holdout_split(path='api/clean_dataset.csv', fraction=0.2, seed=0):
+    """
+    The held-out (texts, labels) of `train_model --holdout fraction`: the
+    same rows for the same fraction and seed, so a model trained that way
+    is scored on messages it has not seen. fraction=1 returns every row.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(path)
+    df.dropna(subset=['text'], inplace=True)
+    if fraction >= 1:
+        return df['text'].tolist(), df['label'].tolist()
+    from sklearn.model_selection import train_test_split
+
+    _, texts, _, labels = train_test_split(
+        df['text'], df['label'], test_size=fraction, stratify=df['label'], random_state=seed
+    )
+    return texts.tolist(), labels.tolist()
+
+
+def load_lexicon(path):
+    """A KeywordMatcher for a candidate lexicon file (see api.classifier.load_lexicon)"""
+    from .classifier import load_lexicon
+
+    return load_lexicon(path, lexicon_name(path)).matcher
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def llm_cost(texts):
+    """Estimated USD for one classification call per text, at the OPENAI_*_COST_PER_MTOK prices"""
+    from .llm import classification_messages
+
+    input_tokens = output_tokens = 0
+    for text in texts:
+        messages = classification_messages(text)
+        input_tokens += sum(estimate_tokens(m['content']) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+        output_tokens += REPLY_TOKENS
+    return (input_tokens * settings.OPENAI_INPUT_COST_PER_MTOK
+            + output_tokens * settings.OPENAI_OUTPUT_COST_PER_MTOK) / 1e6
+
+
+def keyword_classifier(matcher):
+    """classify(text) -> Outcome for a KeywordMatcher"""
+    return partial(_keywords, matcher)
+
+
+def _keywords(matcher, text):
+    return Outcome(matcher.classify(text), 0.0)
+
+
+def _model(text):
+    from .engine import get_engine
+
+    verdict = get_engine().classify(text)
+    return Outcome(verdict.flag, 0.0, verdict.scores['green'])
+
+
+def _ai(text):
+    from .batching import classify_with_llm
+
+    try:
+        flag = classify_with_llm(text)
+    except Exception:
+        flag = None
+    return Outcome(flag, 0.0, llm=True)
+
+
+def _cascade(text):
+    from .cascade import CascadeUnavailable, classify_cascade
+
+    try:
+        verdict = classify_cascade(text)
+    except CascadeUnavailable:
+        return Outcome(None, 0.0, llm=True)
+    # A degraded model verdict means the LLM call failed
+    escalated = verdict.tier == 'ai' or (verdict.tier == 'model' and verdict.degraded)
+    green = verdict.scores.get('green') if verdict.scores else None
+    return Outcome(verdict.flag, 0.0, green, escalated)
+
+
+# Classifiers by method name, registered in the parent. Children started
+# without fork get the one they run passed to register() (so it must pickle).
+_classifiers = {}
+
+
+def register(name, classify):
+    """Make classify(text) -> Outcome available as method `name`"""
+    _classifiers[name] = classify
+
+
+def register_defaults():
+    from .classifier import get_lexicon
+
+    register('keywords', keyword_classifier(get_lexicon().matcher))
+    register('model', _model)
+    register('cascade', _cascade)
+    register('ai', _ai)
+
+
+def _run(name, texts):
+    classify = _classifiers[name]
+    outcomes = []
+    for text in texts:
+        started = time.perf_counter()
+        outcome = classify(text)
+        outcomes.append(outcome._replace(seconds=time.perf_counter() - started))
+    return outcomes
+
+
+def run(name, texts, workers=1, threads=False):
+    """
+    Classify texts with method `name` on `workers` processes (or threads)
+    and return (outcomes in input order, elapsed seconds)
+    """
+    from .pool import start_method
+
+    from .normalize import _normalize_memo
+
+    # Every method starts cold: no normalization memoized by the last one
+    _normalize_memo.cache_clear()
+    started = time.perf_counter()
+    if workers <= 1:
+        outcomes = _run(name, texts)
+    else:
+        size = math.ceil(len(texts) / (workers * 4)) or 1
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        if threads:
+            executor = ThreadPoolExecutor(max_workers=workers)
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context(start_method()),
+                initializer=register, initargs=(name, _classifiers[name]),
+            )
+        with executor:
+            outcomes = [o for chunk in executor.map(_run, [name] * len(chunks), chunks) for o in chunk]
+    return outcomes, time.perf_counter() - started
+
+
+def flag_metrics(labels, flags):
+    """Accuracy and per-flag precision, recall, F1 and support; a failed (None) flag counts as wrong"""
+    results = {'accuracy': round(sum(l == f for l, f in zip(labels, flags)) / len(labels), 4) if labels else None}
+    for flag in FLAGS:
+        true_positives = sum(l == flag and f == flag for l, f in zip(labels, flags))
+        predicted = sum(f == flag for f in flags)
+        actual = sum(l == flag for l in labels)
+        precision = true_positives / predicted if predicted else 0.0
+        recall = true_positives / actual if actual else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        results[flag] = {'precision': round(precision, 4), 'recall': round(recall, 4),
+                         'f1': round(f1, 4), 'support': actual}
+    return results
+
+
+def report(name, texts, labels, outcomes, elapsed):
+    """Quality, latency and LLM cost of one method's outcomes"""
+    flags = [o.flag for o in outcomes]
+    escalated = [text for text, o in zip(texts, outcomes) if o.llm]
+    cost = llm_cost(escalated)
+    return {
+        'method': name,
+        **flag_metrics(labels, flags),
+        'latency': summarize([o.seconds for o in outcomes], flags.count(None), elapsed),
+        'llm_calls': len(escalated),
+        'llm_cost_usd': round(cost, 6),
+        'llm_cost_per_1k_usd': round(cost * 1000 / len(texts), 6) if texts else None,
+    }
+
+
+def sweep_cascade(texts, labels, keyword_flags, model_outcomes, ai_flags, lows, highs, keyword_hit_flags=None):
+    """
+    Replay the cascade for every (green_low, green_high) threshold pair
+    from per-message results of the keyword, model and LLM tiers, without
+    classifying anything again. Returns one row per pair: accuracy, red
+    recall, yellow precision, the fraction escalated to the LLM and its
+    estimated cost per 1000 messages.
+    """
+    hit_flags = settings.CASCADE_KEYWORD_FLAGS if keyword_hit_flags is None else keyword_hit_flags
+    costs = [llm_cost([text]) for text in texts]
+    rows = []
+    for low in lows:
+        for high in highs:
+            if low >= high:
+                continue
+            flags, cost, escalated = [], 0.0, 0
+            for i, keyword_flag in enumerate(keyword_flags):
+                model = model_outcomes[i]
+                if keyword_flag in hit_flags:
+                    flags.append(keyword_flag)
+                elif model.green is not None and low <= model.green < high:
+                    escalated += 1
+                    cost += costs[i]
+                    # An LLM failure leaves the model's verdict, as in the cascade
+                    flags.append(ai_flags[i] or model.flag)
+                else:
+                    flags.append(model.flag)
+            metrics = flag_metrics(labels, flags)
+            rows.append({
+                'green_low': low,
+                'green_high': high,
+                'accuracy': metrics['accuracy'],
+                'red_recall': metrics['red']['recall'],
+                'yellow_precision': metrics['yellow']['precision'],
+                'escalated': round(escalated / len(texts), 4),
+                'llm_cost_per_1k_usd': round(cost * 1000 / len(texts), 6),
+            })
+    return rows
+
+
+def lexicon_name(path):
+    return f"keywords:{Path(path).stem}"
@@ -0,0 +1,175 @@
+# api/fakes.py
+# Offline stand-ins for OpenAI and Firestore, shared by the tests and the
+# benchmarks: a local HTTP server speaking the chat completions API and an
+# in-memory subset of the Firestore client.
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+
+def encrypt_message(plain_text, chat_id):
+    """Mirror of api.crypto.decrypt_message, as the frontend encrypts"""
+    key = hashlib.sha256(chat_id.encode()).digest()
+    iv = os.urandom(16)
+    cipher = AES.new(key, AES.MODE_CBC, iv)
+    return base64.b64encode(iv + cipher.encrypt(pad(plain_text.encode(), AES.block_size))).decode()
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Answers /chat/completions with the server's canned reply or status"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(body)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.status != 200:
+            self.send_response(self.server.status)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{"error": {"message": "upstream failure"}}')
+            return
+        payload = json.dumps({
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": self.reply(body)},
+            }],
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def reply(self, body):
+        reply = self.server.reply
+        return reply(body) if callable(reply) else reply
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_openai(reply="GREEN", status=200, latency=0.0):
+    """
+    Serve FakeOpenAIHandler on a free local port from a daemon thread.
+    reply is a string or a function of the request body; latency is added
+    to every call, in seconds. Stop it with server.shutdown() and
+    server.server_close().
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.status = status
+    server.reply = reply
+    server.latency = latency
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeSnapshot:
+    def __init__(self, reference):
+        self.reference = reference
+        self.id = reference.id
+
+    def to_dict(self):
+        return dict(self.reference.data) if self.reference.data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path[-1]
+
+    @property
+    def data(self):
+        return self.db.docs.get(self.path)
+
+    def collection(self, name):
+        return FakeQuery(self.db, self.path + (name,))
+
+    def get(self):
+        return FakeSnapshot(self)
+
+    def update(self, fields):
+        self.db.docs.setdefault(self.path, {}).update(fields)
+
+
+class FakeQuery:
+    """In-memory subset of the Firestore query API used by Reclassifier"""
+
+    def __init__(self, db, path, limit=None, after=None):
+        self.db = db
+        self.path = path
+        self._limit = limit
+        self._after = after
+
+    def document(self, doc_id):
+        return FakeDocument(self.db, self.path + (doc_id,))
+
+    def list_documents(self):
+        ids = sorted({p[len(self.path)] for p in self.db.docs if p[:len(self.path)] == self.path})
+        return [self.document(doc_id) for doc_id in ids]
+
+    def order_by(self, field):
+        return self
+
+    def limit(self, count):
+        return FakeQuery(self.db, self.path, count, self._after)
+
+    def start_after(self, snapshot):
+        return FakeQuery(self.db, self.path, self._limit, snapshot.id)
+
+    def stream(self):
+        ids = sorted(p[-1] for p in self.db.docs if len(p) == len(self.path) + 1 and p[:-1] == self.path)
+        if self._after is not None:
+            ids = [doc_id for doc_id in ids if doc_id > self._after]
+        return [self.document(doc_id).get() for doc_id in ids[:self._limit]]
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def update(self, reference, fields):
+        self.writes.append((reference, fields))
+
+    def commit(self):
+        self.db.commits.append(len(self.writes))
+        for reference, fields in self.writes:
+            reference.update(fields)
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.docs = {}
+        self.commits = []
+
+    def collection(self, name):
+        return FakeQuery(self, (name,))
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def add_message(self, chat_id, message_id, text, flag='green'):
+        self.docs[('chats', chat_id)] = {}
+        self.docs[('chats', chat_id, 'messages', message_id)] = {
+            'text': encrypt_message(text, chat_id), 'flag': flag,
+        }
+
+    def flag(self, chat_id, message_id):
+        return self.docs[('chats', chat_id, 'messages', message_id)]['flag']
@@ -0,0 +1,61 @@
+# api/firebase.py
+# Lazily initialized Firebase Admin app and Firestore client.
+#
+# firebase_admin pulls in grpc and google-cloud-firestore, which together
+# take longer to import than the rest of the app. Only the legacy /classify/
+# endpoint and the reclassify_chats command talk to Firestore, so the SDK is
+# imported and initialized on first use instead of in settings.py.
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_app = None
+_db = None
+_lock = threading.Lock()
+
+
+def get_firebase_app():
+    """Initialize the Firebase Admin SDK once per process and return the app"""
+    global _app
+    if _app is None:
+        with _lock:
+            if _app is None:
+                import firebase_admin
+                from firebase_admin import credentials
+
+                # Reuse an app someone else already initialized (dev server reloads, shell)
+                if firebase_admin._apps:
+                    _app = firebase_admin.get_app()
+                else:
+                    cred = credentials.Certificate(settings.SERVICE_ACCOUNT_KEY_PATH)
+                    _app = firebase_admin.initialize_app(cred)
+                    logger.info("Firebase Admin SDK initialized")
+    return _app
+
+
+def get_firestore():
+    """
+    Return the process-wide Firestore client. With FIRESTORE_EMULATOR_HOST
+    set it talks to the emulator, with no service account needed.
+    """
+    global _db
+    if _db is None and os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        with _lock:
+            if _db is None:
+                from google.cloud import firestore
+
+                # Anonymous credentials; project from GOOGLE_CLOUD_PROJECT
+                _db = firestore.Client()
+                logger.info("Using the Firestore emulator at %s", os.environ['FIRESTORE_EMULATOR_HOST'])
+    if _db is None:
+        app = get_firebase_app()
+        with _lock:
+            if _db is None:
+                from firebase_admin import firestore
+
+                _db = firestore.client(app)
+    return _db
@@ -0,0 +1,69 @@
+# api/inflight.py
+# In-flight request coalescing: identical concurrent requests share one
+# computation instead of each calling OpenAI or writing to Firestore.
+#
+# Coalescing is per process. Across workers, identical texts are still
+# answered once per cache lifetime when VERDICT_CACHE_URL shares the
+# verdict cache.
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from .metrics import COALESCED
+
+
+class Coalescer:
+    """
+    run(key, fn): the first caller runs fn(); callers that arrive with the
+    same key while it runs wait for it and get the same result or exception.
+    arun(key, make_coroutine) does the same for coroutines on one event loop.
+    Keys only live while their call is in flight.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}  # key -> Future
+        self._tasks = {}  # (loop, key) -> asyncio.Task
+        self._lock = threading.Lock()
+
+    def run(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            COALESCED.inc(name=self.name)
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def arun(self, key, make_coroutine):
+        task_key = (asyncio.get_running_loop(), key)
+        task = self._tasks.get(task_key)
+        if task is None:
+            task = self._tasks[task_key] = asyncio.ensure_future(make_coroutine())
+            task.add_done_callback(lambda _: self._tasks.pop(task_key, None))
+        else:
+            COALESCED.inc(name=self.name)
+        # A waiter that is cancelled (client went away) must not cancel the
+        # call the others are waiting on
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._calls) + len(self._tasks)
+
+
+# Verdicts for one (method, version, normalized text): one classification
+verdict_calls = Coalescer('verdicts')
+# Legacy /classify/ for one (chatId, messageId, text): one Firestore write
+message_calls = Coalescer('messages')
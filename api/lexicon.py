@@ -0,0 +1,40 @@
+# api/lexicon.py
+# The single red/yellow keyword lexicon shared by every keyword classifier.
+# Terms are matched against normalized text at the start of a word (see
+# api/normalize.py and api/matcher.py): "kill" matches "killed" but not
+# "skill". Case, accents, look-alike letters and leetspeak don't matter.
+#
+# This is the built-in version. With CLASSIFIER_REGISTRY_DIR set, newer
+# versions are published as JSON and swapped in at runtime (api/artifacts.py).
+
+# Keywords that indicate a threat, harassment or abuse
+RED_FLAGS = (
+    # Threats and violence
+    "threat", "hack", "kill", "kill you", "murder", "attack",
+    "expose you", "doxx you", "hate you",
+    # Insults and profanity
+    "fuck", "fuck you", "shit", "bitch", "asshole", "cunt",
+    "idiot", "stupid",
+    # Urdu/Hindi transliterations
+    "kutte", "kameene", "chutiya", "madarchod",
+)
+
+# Keywords that indicate potential spam or phishing
+YELLOW_FLAGS = (
+    "prize", "winner", "won", "congratulations", "congratulations you won",
+    "claim", "lottery", "free money", "investment", "urgent",
+    "verify account", "verify your account", "click this link",
+    # Urdu/Hindi transliterations
+    "inaam jeeta",
+)
+
+# Terms that also match inside longer words, for profanity that is mostly
+# seen in compounds ("bullshit", "motherfucker", "@someasshole")
+SUBWORD_FLAGS = (
+    "fuck", "shit", "bitch", "asshole", "cunt",
+)
+
+# Terms that only match as a complete word ("won", not "wonderful")
+WHOLE_WORD_FLAGS = (
+    "won",
+)
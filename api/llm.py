@@ -0,0 +1,346 @@
+# api/llm.py
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import LLM_CALLS, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+AI_MODEL = "gpt-4o-mini"
+
+AI_SYSTEM_PROMPT = """You are a strict content moderation assistant for a secure messaging app.
+
+Classify messages into three categories:
+
+🔴 RED (Dangerous/Harmful) - FLAG IMMEDIATELY:
+- ANY insults or aggressive language directed at someone
+- Examples: "fuck you", "you're stupid", "bitch", "asshole", "idiot"
+- Threats of violence or harm
+- Harassment or bullying
+- Hate speech or slurs
+- Discriminatory language
+
+🟡 YELLOW (Suspicious) - INVESTIGATE:
+- Scam attempts ("you won", "claim prize")
+- Phishing or fraud indicators
+- Requests for sensitive information
+- Spam or commercial content
+
+🟢 GREEN (Safe) - ALLOW:
+- Normal conversation ("hello", "hi", "how are you")
+- Non-directed exclamations ("oh shit!", "damn")
+- Friendly chat
+
+RULES:
+1. "fuck you" = RED | "oh fuck" = GREEN
+2. Insults directed at person = RED
+3. Simple words like "gay", "hello", "hi" = GREEN
+4. When unsure, default to GREEN unless clearly hostile
+
+RESPOND WITH ONLY: RED, YELLOW, or GREEN."""
+
+# Changes whenever the model or prompt does; part of every AI verdict cache key.
+AI_VERSION = hashlib.sha256(f"{AI_MODEL}\n{AI_SYSTEM_PROMPT}".encode()).hexdigest()[:12]
+
+
+class LLMUnavailable(Exception):
+    """The LLM can't be called right now (no key, circuit open, saturated)"""
+
+
+def configured_api_key():
+    """The OpenAI key from the environment: OPENAI_API_KEY, else AI_API_KEY"""
+    return os.environ.get('OPENAI_API_KEY') or os.environ.get('AI_API_KEY')
+
+
+def classification_messages(text):
+    """Chat messages asking the model to classify a single text"""
+    return [
+        {"role": "system", "content": AI_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Classify: {text}"}
+    ]
+
+
+def parse_flag(content):
+    """Map a model reply (RED / YELLOW / anything else) to a flag"""
+    classification = (content or "").strip().upper()
+    if classification == "RED":
+        return "red"
+    elif classification == "YELLOW":
+        return "yellow"
+    return "green"
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    Closed: calls go through. After failure_threshold consecutive failures
+    (errors, or calls slower than slow_call_seconds) it opens and rejects
+    calls for reset_seconds. Then it is half-open: a single trial call is let
+    through, and its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0, slow_call_seconds=None,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_seconds:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """Return True if a call may proceed now"""
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record(self, ok, elapsed=0.0):
+        """Record the outcome of a call that allow() let through"""
+        if ok and self.slow_call_seconds is not None and elapsed > self.slow_call_seconds:
+            ok = False
+        with self._lock:
+            self._trial_in_flight = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("OpenAI circuit opened after %d failures", self.failures)
+                self.opened_at = self.clock()
+
+
+class LLMClient:
+    """
+    Process-wide OpenAI client.
+
+    One OpenAI client (and so one keep-alive httpx connection pool) is reused
+    for every call. Each call has a deadline, at most max_concurrency calls
+    are in flight at once, and a CircuitBreaker stops calling the upstream
+    after repeated failures or slow calls so callers can fall back to a local
+    classifier.
+    """
+
+    def __init__(self, api_key=None, base_url=None, timeout=None, max_concurrency=None,
+                 max_retries=None, breaker=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout if timeout is not None else settings.OPENAI_TIMEOUT
+        self.max_concurrency = max_concurrency or settings.OPENAI_MAX_CONCURRENCY
+        self.max_retries = max_retries if max_retries is not None else settings.OPENAI_MAX_RETRIES
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=settings.OPENAI_BREAKER_FAILURES,
+            reset_seconds=settings.OPENAI_BREAKER_RESET_SECONDS,
+            slow_call_seconds=settings.OPENAI_SLOW_CALL_SECONDS,
+        )
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._client = None
+        self._lock = threading.Lock()
+        # Async clients and semaphores are bound to the event loop they're
+        # made on: {loop: (AsyncOpenAI, Semaphore, task closing the client)}
+        self._aclients = {}
+
+    def _resolve_api_key(self):
+        return self.api_key or configured_api_key()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx
+                    from openai import OpenAI
+
+                    self._client = OpenAI(
+                        http_client=httpx.Client(timeout=self.timeout, limits=self._limits()),
+                        **self._client_options(),
+                    )
+        return self._client
+
+    def _client_options(self):
+        api_key = self._resolve_api_key()
+        if not api_key:
+            raise LLMUnavailable("No OpenAI API key found")
+        return {
+            "api_key": api_key,
+            "base_url": self.base_url or settings.OPENAI_BASE_URL or None,
+            "timeout": self.timeout,
+            "max_retries": self.max_retries,
+        }
+
+    def _limits(self):
+        import httpx
+
+        return httpx.Limits(
+            max_connections=self.max_concurrency,
+            max_keepalive_connections=self.max_concurrency,
+        )
+
+    def _async_state(self):
+        """
+        (AsyncOpenAI client, semaphore) for the running event loop.
+
+        Under an ASGI server a worker runs a single loop, so one client and
+        its connection pool serve every request. Under gunicorn's sync
+        workers asgiref runs each async view on a loop of its own, so a
+        client only lasts one request and connections aren't pooled across
+        requests; the client is closed when its loop shuts down.
+        """
+        loop = asyncio.get_running_loop()
+        state = self._aclients.get(loop)
+        if state is None:
+            import httpx
+            from openai import AsyncOpenAI
+
+            client = AsyncOpenAI(
+                http_client=httpx.AsyncClient(timeout=self.timeout, limits=self._limits()),
+                **self._client_options(),
+            )
+            closer = loop.create_task(self._close_with_loop(loop, client))
+            state = self._aclients[loop] = (client, asyncio.Semaphore(self.max_concurrency), closer)
+        return state[:2]
+
+    async def _close_with_loop(self, loop, client):
+        # asyncio.run() cancels pending tasks before closing the loop, which
+        # ends this wait while the loop can still close the connections
+        try:
+            await loop.create_future()
+        finally:
+            self._aclients.pop(loop, None)
+            await client.close()
+
+    def _record(self, ok, started):
+        elapsed = time.monotonic() - started
+        self.breaker.record(ok, elapsed)
+        STAGE_SECONDS.observe(elapsed, stage='llm')
+        LLM_CALLS.inc(result='ok' if ok else 'error')
+
+    def complete(self, messages, max_tokens=10):
+        """
+        Run one chat completion and return the reply text.
+        Raises LLMUnavailable without calling upstream when the circuit is
+        open or no concurrency slot frees up within the timeout.
+        """
+        client = self.client
+        if self.breaker.state == CircuitBreaker.OPEN:
+            raise LLMUnavailable("OpenAI circuit is open")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise LLMUnavailable("Too many concurrent OpenAI calls")
+        try:
+            if not self.breaker.allow():
+                raise LLMUnavailable("OpenAI circuit is open")
+            started = time.monotonic()
+            try:
+                response = client.chat.completions.create(
+                    model=AI_MODEL,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.1,
+                )
+                content = response.choices[0].message.content
+            except Exception:
+                self._record(False, started)
+                raise
+            self._record(True, started)
+            return content
+        finally:
+            self._slots.release()
+
+    async def acomplete(self, messages, max_tokens=10):
+        """Non-blocking complete() for the ASGI views"""
+        client, slots = self._async_state()
+        if self.breaker.state == CircuitBreaker.OPEN:
+            raise LLMUnavailable("OpenAI circuit is open")
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise LLMUnavailable("Too many concurrent OpenAI calls")
+        try:
+            if not self.breaker.allow():
+                raise LLMUnavailable("OpenAI circuit is open")
+            started = time.monotonic()
+            try:
+                response = await client.chat.completions.create(
+                    model=AI_MODEL,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.1,
+                )
+                content = response.choices[0].message.content
+            except Exception:
+                self._record(False, started)
+                raise
+            self._record(True, started)
+            return content
+        finally:
+            slots.release()
+
+    def classify(self, text):
+        """Classify one text, returning 'red', 'yellow' or 'green'"""
+        content = self.complete(classification_messages(text))
+        logger.debug("GPT result: %s", content)
+        return parse_flag(content)
+
+    async def aclassify(self, text):
+        """Async classify()"""
+        content = await self.acomplete(classification_messages(text))
+        logger.debug("GPT result: %s", content)
+        return parse_flag(content)
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    async def aclose(self):
+        """Close the running loop's async client"""
+        state = self._aclients.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            state[2].cancel()
+            await state[0].close()
+
+
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """Return the process-wide LLM client"""
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                _llm_client = LLMClient()
+    return _llm_client
@@ -0,0 +1,135 @@
+# api/management/commands/bench_api.py
+import json
+import logging
+import platform
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from api.benchmark import (
+    ClientSender, HTTPSender, git_commit, load_traffic, offline_backends, replay, save_traffic,
+    synthesize_traffic,
+)
+from api.views import CLASSIFICATION_METHODS
+
+QUIET_LOGGERS = ('api', 'httpx')
+
+COLUMNS = ('requests', 'errors', 'throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+class Command(BaseCommand):
+    help = ('Load test: replays classification traffic against /classify-text/, /classify/ and /classify-batch/ '
+            'and reports p50/p95/p99 latency and throughput per classifier method. Runs offline by default.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--traffic', default=None,
+                            help='Captured traffic to replay (JSON Lines of {"path", "body"}). '
+                                 'Defaults to requests synthesized from api/clean_dataset.csv.')
+        parser.add_argument('--save-traffic', default=None, help='Write the replayed traffic to this file.')
+        parser.add_argument('--requests', type=int, default=1000, help='Requests to synthesize.')
+        parser.add_argument('--batch-size', type=int, default=20, help='Texts per synthesized batch request.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--methods', default=','.join(CLASSIFICATION_METHODS),
+                            help='Comma-separated classifier methods to benchmark in-process.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client threads.')
+        parser.add_argument('--ai-latency-ms', type=float, default=50,
+                            help='Latency added by the fake OpenAI server.')
+        parser.add_argument('--url', default=None,
+                            help='Benchmark a running server at this base URL instead of in-process '
+                                 '(uses whatever method and backends the server is configured with).')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Keep the verdict cache between methods instead of clearing it.')
+        parser.add_argument('--output', default=None, help='Save results as JSON to this file.')
+        parser.add_argument('--compare', default=None, help='Previous results JSON to print deltas against.')
+
+    def handle(self, *args, **options):
+        traffic = self.get_traffic(options)
+        if options['save_traffic']:
+            save_traffic(options['save_traffic'], traffic)
+            self.stdout.write(f"Saved {len(traffic)} requests to {options['save_traffic']}")
+
+        results = {
+            'commit': git_commit(),
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'target': options['url'] or 'in-process',
+            'traffic': options['traffic'] or 'synthesized',
+            'requests': len(traffic),
+            'concurrency': options['concurrency'],
+            'ai_latency_ms': None if options['url'] else options['ai_latency_ms'],
+            'methods': {},
+        }
+
+        if options['url']:
+            self.stdout.write(f"Replaying {len(traffic)} requests against {options['url']}...")
+            summary = replay(HTTPSender(options['url']), traffic, options['concurrency'])
+            results['methods']['server'] = summary
+            self.print_summary('server', summary)
+        else:
+            methods = [m.strip() for m in options['methods'].split(',') if m.strip()]
+            unknown = set(methods) - set(CLASSIFICATION_METHODS)
+            if unknown:
+                raise CommandError(f"Unknown methods: {', '.join(sorted(unknown))}")
+            with ExitStack() as stack:
+                stack.enter_context(offline_backends(options['ai_latency_ms'] / 1000))
+                # Every in-process request comes from the same client address
+                stack.enter_context(override_settings(ALLOWED_HOSTS=['testserver'], CHAT_RATE_LIMIT_PER_SECOND=0,
+                                                      CLIENT_RATE_LIMIT_PER_SECOND=0))
+                # Per-request INFO logs would dominate the measurement
+                for name in QUIET_LOGGERS:
+                    logger = logging.getLogger(name)
+                    stack.callback(logger.setLevel, logger.level)
+                    logger.setLevel(logging.ERROR)
+
+                from api.engine import preload
+                preload()
+                for method in methods:
+                    if not options['warm_cache']:
+                        caches['verdicts'].clear()
+                    with override_settings(CLASSIFICATION_METHOD=method):
+                        summary = replay(ClientSender(), traffic, options['concurrency'])
+                    results['methods'][method] = summary
+                    self.print_summary(method, summary)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"✅ Results saved to {options['output']}"))
+        if options['compare']:
+            self.print_comparison(options['compare'], results)
+
+    def get_traffic(self, options):
+        if options['traffic']:
+            return load_traffic(options['traffic'])
+        import pandas as pd
+
+        texts = pd.read_csv('api/clean_dataset.csv')['text'].dropna()
+        texts = texts[texts.str.len() <= 1000].sample(min(len(texts), 5000), random_state=options['seed']).tolist()
+        return synthesize_traffic(texts, options['requests'], batch_size=options['batch_size'], seed=options['seed'])
+
+    def print_summary(self, method, summary):
+        self.stdout.write(self.style.WARNING(f"\n{method}"))
+        self.stdout.write(f"{'endpoint':>18}" + ''.join(f"{column:>16}" for column in COLUMNS))
+        for path, stats in sorted(summary.items(), key=lambda item: item[0] == 'all'):
+            self.stdout.write(f"{path:>18}" + ''.join(f"{self._cell(stats[column]):>16}" for column in COLUMNS))
+
+    def print_comparison(self, path, results):
+        with open(path) as f:
+            previous = json.load(f)
+        self.stdout.write(self.style.WARNING(f"\nChange vs. {path} ({previous.get('commit')})"))
+        for method, summary in results['methods'].items():
+            for endpoint, stats in summary.items():
+                old = previous.get('methods', {}).get(method, {}).get(endpoint)
+                if not old:
+                    continue
+                deltas = []
+                for column in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                    if old.get(column) and stats.get(column) is not None:
+                        deltas.append(f"{column} {(stats[column] / old[column] - 1) * 100:+.1f}%")
+                self.stdout.write(f"{method:>10} {endpoint:>16}: {', '.join(deltas)}")
+
+    def _cell(self, value):
+        return '-' if value is None else f"{value:,}"
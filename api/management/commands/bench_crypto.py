@@ -0,0 +1,51 @@
+# api/management/commands/bench_crypto.py
+import base64
+import os
+import time
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+from django.core.management.base import BaseCommand
+
+from api.crypto import _block_cipher, chat_key, decrypt_many, decrypt_message
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark: per-message decrypt_message vs. bulk decrypt_many throughput.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=20000, help='Messages per run.')
+        parser.add_argument('--length', type=int, default=120, help='Plaintext length in characters.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per variant; the best is reported.')
+
+    def handle(self, *args, **options):
+        chat_id = 'bench-chat'
+        key = chat_key(chat_id)
+        plain = ('x' * options['length']).encode()
+        ciphertexts = []
+        for _ in range(options['messages']):
+            iv = os.urandom(16)
+            ciphertexts.append(base64.b64encode(iv + AES.new(key, AES.MODE_CBC, iv).encrypt(pad(plain, 16))).decode())
+
+        def single():
+            return [decrypt_message(text, chat_id) for text in ciphertexts]
+
+        def bulk():
+            return decrypt_many(chat_id, ciphertexts)
+
+        results = {}
+        for name, run in (('decrypt_message', single), ('decrypt_many', bulk)):
+            best = min(self._time(run) for _ in range(options['repeat']))
+            results[name] = best
+            self.stdout.write(f"{name:>16}: {options['messages'] / best:>12,.0f} msgs/s ({best * 1000:.1f} ms)")
+
+        speedup = results['decrypt_message'] / results['decrypt_many']
+        self.stdout.write(self.style.SUCCESS(f"decrypt_many is {speedup:.2f}x decrypt_message"))
+
+    def _time(self, run):
+        # Start cold so both variants pay for key derivation
+        chat_key.cache_clear()
+        _block_cipher.cache_clear()
+        started = time.perf_counter()
+        run()
+        return time.perf_counter() - started
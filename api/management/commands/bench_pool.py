@@ -0,0 +1,90 @@
+# api/management/commands/bench_pool.py
+import json
+import os
+import platform
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import git_commit
+from api.engine import get_engine
+from api.pool import ClassifierPool
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the classifier process pool: scores the same texts in-process and with 1, 2, 4, ... '
+            'processes, and reports throughput and speedup per process count.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--texts', type=int, default=50000,
+                            help='Texts to score per run (api/clean_dataset.csv, repeated as needed).')
+        parser.add_argument('--workers', default=None,
+                            help='Comma-separated process counts (default: powers of two up to the core count).')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Texts per task sent to a process.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per configuration; the fastest is kept.')
+        parser.add_argument('--output', default=None, help='Save results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        import pandas as pd
+
+        cores = os.cpu_count() or 1
+        if options['workers']:
+            counts = [int(n) for n in options['workers'].split(',') if n.strip()]
+        else:
+            counts = [1 << i for i in range(cores.bit_length()) if 1 << i <= cores]
+            if counts[-1] != cores:
+                counts.append(cores)
+        if any(n < 1 for n in counts):
+            raise CommandError("--workers must be positive")
+
+        texts = pd.read_csv('api/clean_dataset.csv')['text'].dropna().tolist()
+        texts = (texts * (options['texts'] // len(texts) + 1))[:options['texts']]
+        engine = get_engine()
+        engine.load()
+
+        def best_of(classify_many):
+            # The first run warms the normalization memo and page cache
+            classify_many(texts[:1000])
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                verdicts = classify_many(texts)
+                timings.append(time.perf_counter() - started)
+            return min(timings), verdicts
+
+        baseline, expected = best_of(engine.classify_many)
+        results = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'cores': cores,
+            'texts': len(texts),
+            'in_process_seconds': round(baseline, 4),
+            'pool': [],
+        }
+        self.stdout.write(f"Scoring {len(texts)} texts on {cores} cores")
+        self.stdout.write(f"{'processes':>10}{'seconds':>10}{'texts/s':>12}{'speedup':>10}{'efficiency':>12}")
+        self.stdout.write(f"{'in-process':>10}{baseline:>10.3f}{len(texts) / baseline:>12,.0f}{1:>10.2f}{'':>12}")
+
+        for workers in counts:
+            pool = ClassifierPool(engine, workers, min_batch=0, chunk_size=options['chunk_size'])
+            try:
+                pool.start()
+                seconds, verdicts = best_of(pool.classify_many)
+            finally:
+                pool.close()
+            if [v.flag for v in verdicts] != [v.flag for v in expected]:
+                raise CommandError(f"Verdicts from {workers} processes differ from in-process scoring")
+            speedup = baseline / seconds
+            results['pool'].append({
+                'workers': workers,
+                'seconds': round(seconds, 4),
+                'texts_per_second': round(len(texts) / seconds, 1),
+                'speedup': round(speedup, 3),
+            })
+            self.stdout.write(f"{workers:>10}{seconds:>10.3f}{len(texts) / seconds:>12,.0f}"
+                              f"{speedup:>10.2f}{speedup / workers:>11.0%}")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"✅ Results saved to {options['output']}"))
@@ -0,0 +1,41 @@
+# api/management/commands/bench_startup.py
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.startup import LAZY_MODULES, profile_startup
+
+
+class Command(BaseCommand):
+    help = ('Startup benchmark: imports the app in fresh interpreters with `python -X importtime`, '
+            'reports the slowest imports and fails if lazy stacks load eagerly or startup is too slow.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters to start; the median is reported.')
+        parser.add_argument('--top', type=int, default=15, help='Slowest top-level imports to list.')
+        parser.add_argument('--max-ms', type=float, default=None,
+                            help='Fail if the median startup time exceeds this many milliseconds.')
+
+    def handle(self, *args, **options):
+        profiles = [profile_startup() for _ in range(options['repeat'])]
+        median = statistics.median(profile.seconds for profile in profiles) * 1000
+        imports = statistics.median(sum(s for s, _ in profile.modules.values()) for profile in profiles) / 1000
+
+        # Cumulative time of top-level packages, from the last run
+        packages = {}
+        for name, (_, cumulative) in profiles[-1].modules.items():
+            root = name.split('.')[0]
+            packages[root] = max(packages.get(root, 0), cumulative)
+        self.stdout.write("Slowest packages (cumulative import time):")
+        for name, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f"{name:>24}: {cumulative / 1000:8.1f} ms")
+
+        self.stdout.write(f"\nStartup: {median:.0f} ms median wall time, {imports:.0f} ms importing "
+                          f"{len(profiles[-1].modules)} modules ({options['repeat']} runs)")
+
+        eager = sorted({name for profile in profiles for name in profile.eager})
+        if eager:
+            raise CommandError(f"Imported at startup but should be lazy: {', '.join(eager)}")
+        self.stdout.write(self.style.SUCCESS(f"✅ None of {', '.join(LAZY_MODULES)} imported at startup"))
+        if options['max_ms'] is not None and median > options['max_ms']:
+            raise CommandError(f"Median startup {median:.0f} ms exceeds --max-ms {options['max_ms']:.0f}")
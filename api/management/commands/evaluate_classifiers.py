@@ -0,0 +1,157 @@
+# api/management/commands/evaluate_classifiers.py
+import json
+import logging
+import os
+from contextlib import ExitStack
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import engine as engine_module
+from api import evaluation
+from api.benchmark import git_commit, offline_backends
+from api.llm import configured_api_key
+
+QUIET_LOGGERS = ('httpx',)
+
+
+def _thresholds(value):
+    return [float(v) for v in value.split(',') if v.strip()]
+
+
+class Command(BaseCommand):
+    help = ('Evaluate the classifiers on a held-out split of api/clean_dataset.csv: precision/recall per flag, '
+            'latency, throughput and estimated LLM cost per method. With keywords, model and ai all evaluated, '
+            'also replays the cascade over a grid of CASCADE_GREEN_LOW/HIGH thresholds.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--methods', default='keywords,model,cascade',
+                            help=f"Comma-separated methods to evaluate, from {', '.join(evaluation.METHODS)}. "
+                                 "cascade and ai call OpenAI (OPENAI_API_KEY or AI_API_KEY, or --offline).")
+        parser.add_argument('--lexicon', metavar='JSON', action='append', default=[],
+                            help='Also evaluate the keyword classifier with a candidate lexicon: a JSON file with '
+                                 '"red", "yellow" and optional "subword" and "whole_word" lists (repeatable).')
+        parser.add_argument('--dataset', default='api/clean_dataset.csv', help='Labeled text,label CSV.')
+        parser.add_argument('--holdout', type=float, default=0.2,
+                            help='Fraction held out, split as `train_model --holdout` does (1: every row).')
+        parser.add_argument('--limit', type=int, default=None, help='Evaluate at most this many held-out texts.')
+        parser.add_argument('--model', default=None,
+                            help='Model to evaluate instead of CLASSIFIER_MODEL_PATH, e.g. one trained with '
+                                 '`train_model --holdout` so the split is unseen.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes for the keyword and model methods.')
+        parser.add_argument('--llm-concurrency', type=int, default=settings.OPENAI_MAX_CONCURRENCY,
+                            help='Threads for the methods that call OpenAI.')
+        parser.add_argument('--offline', action='store_true',
+                            help='Answer OpenAI calls with a local fake that replies with the keyword classifier: '
+                                 'measures the harness and the cascade plumbing, not GPT quality.')
+        parser.add_argument('--ai-latency', type=float, default=0.0, help='Seconds added to each fake OpenAI call.')
+        parser.add_argument('--green-low', type=_thresholds, default=[0.0, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5],
+                            help='Comma-separated CASCADE_GREEN_LOW values for the threshold sweep.')
+        parser.add_argument('--green-high', type=_thresholds, default=[0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.01],
+                            help='Comma-separated CASCADE_GREEN_HIGH values for the threshold sweep.')
+        parser.add_argument('--output', default=None, help='Save results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        methods = [m.strip() for m in options['methods'].split(',') if m.strip()]
+        unknown = set(methods) - set(evaluation.METHODS)
+        if unknown:
+            raise CommandError(f"Unknown methods: {', '.join(sorted(unknown))}")
+        if (set(methods) & set(evaluation.LLM_METHODS) and not options['offline']
+                and not configured_api_key()):
+            raise CommandError("cascade and ai need OPENAI_API_KEY or AI_API_KEY, or --offline")
+        if options['workers'] < 1 or options['llm_concurrency'] < 1:
+            raise CommandError("--workers and --llm-concurrency must be positive")
+
+        texts, labels = evaluation.holdout_split(options['dataset'], options['holdout'])
+        if options['limit']:
+            texts, labels = texts[:options['limit']], labels[:options['limit']]
+        self.stdout.write(f"Evaluating {len(texts)} held-out texts from {options['dataset']}")
+
+        evaluation.register_defaults()
+        for path in options['lexicon']:
+            name = evaluation.lexicon_name(path)
+            evaluation.register(name, evaluation.keyword_classifier(evaluation.load_lexicon(path)))
+            methods.append(name)
+
+        with ExitStack() as stack:
+            if options['model']:
+                stack.enter_context(mock.patch.object(
+                    engine_module, '_engine', engine_module.ClassifierEngine(options['model'])
+                ))
+            if set(methods) & {'model', 'cascade'}:
+                # Loaded once here; forked children share it
+                engine_module.get_engine().load()
+            if options['offline']:
+                stack.enter_context(offline_backends(ai_latency=options['ai_latency']))
+            # One INFO line per OpenAI request would bury the report
+            for name in QUIET_LOGGERS:
+                logger = logging.getLogger(name)
+                stack.callback(logger.setLevel, logger.level)
+                logger.setLevel(logging.WARNING)
+            results = self.evaluate(methods, texts, labels, options)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"✅ Results saved to {options['output']}"))
+
+    def evaluate(self, methods, texts, labels, options):
+        outcomes, reports = {}, []
+        self.stdout.write(f"{'method':<20}{'accuracy':>9}{'red P/R':>13}{'yellow P/R':>13}{'green P/R':>13}"
+                          f"{'p50 ms':>9}{'p95 ms':>9}{'texts/s':>10}{'LLM calls':>11}{'$/1k':>10}")
+        for name in methods:
+            threads = name in evaluation.LLM_METHODS
+            workers = options['llm_concurrency'] if threads else options['workers']
+            outcomes[name], elapsed = evaluation.run(name, texts, workers, threads=threads)
+            result = evaluation.report(name, texts, labels, outcomes[name], elapsed)
+            reports.append(result)
+            self.write_row(result)
+
+        results = {
+            'commit': git_commit(),
+            'dataset': options['dataset'],
+            'holdout': options['holdout'],
+            'texts': len(texts),
+            'model': str(engine_module.get_engine().model_path),
+            'offline': options['offline'],
+            'cascade_thresholds': [settings.CASCADE_GREEN_LOW, settings.CASCADE_GREEN_HIGH],
+            'methods': reports,
+        }
+        if {'keywords', 'model', 'ai'} <= outcomes.keys():
+            sweep = evaluation.sweep_cascade(
+                texts, labels, [o.flag for o in outcomes['keywords']], outcomes['model'],
+                [o.flag for o in outcomes['ai']], options['green_low'], options['green_high'],
+            )
+            results['cascade_sweep'] = sweep
+            self.write_sweep(sweep)
+        return results
+
+    def write_row(self, result):
+        def pr(flag):
+            return f"{result[flag]['precision']:.2f}/{result[flag]['recall']:.2f}"
+
+        latency = result['latency']
+        self.stdout.write(
+            f"{result['method']:<20}{result['accuracy']:>9.4f}{pr('red'):>13}{pr('yellow'):>13}{pr('green'):>13}"
+            f"{latency['p50_ms']:>9.3f}{latency['p95_ms']:>9.3f}{latency['throughput_rps']:>10,.0f}"
+            f"{result['llm_calls']:>11}{result['llm_cost_per_1k_usd']:>10.4f}"
+        )
+        if latency['errors']:
+            self.stdout.write(self.style.WARNING(f"  {latency['errors']} {result['method']} calls failed"))
+
+    def write_sweep(self, sweep, top=10):
+        current = (settings.CASCADE_GREEN_LOW, settings.CASCADE_GREEN_HIGH)
+        self.stdout.write(f"\nCascade thresholds, best {top} by accuracy (* current):")
+        self.stdout.write(f"{'green_low':>10}{'green_high':>11}{'accuracy':>10}{'red R':>8}{'yellow P':>10}"
+                          f"{'escalated':>11}{'$/1k':>10}")
+        ranked = sorted(sweep, key=lambda row: (-row['accuracy'], row['escalated']))
+        shown = ranked[:top] + [row for row in ranked[top:] if (row['green_low'], row['green_high']) == current]
+        for row in shown:
+            marker = '*' if (row['green_low'], row['green_high']) == current else ' '
+            self.stdout.write(
+                f"{marker}{row['green_low']:>9.2f}{row['green_high']:>11.2f}{row['accuracy']:>10.4f}"
+                f"{row['red_recall']:>8.2f}{row['yellow_precision']:>10.2f}{row['escalated']:>10.1%}"
+                f"{row['llm_cost_per_1k_usd']:>10.4f}"
+            )
@@ -1,11 +1,28 @@
 # api/management/commands/prepare_data.py
 from django.core.management.base import BaseCommand
 import pandas as pd
+from api.datasets import DatasetWriter, iter_labeled_csv, iter_labeled_data, iter_sms_spam
 
 class Command(BaseCommand):
     help = 'Loads and processes datasets to create a clean_dataset.csv for training.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--stream', action='store_true',
+                            help='Read sources in chunks, de-duplicate and shuffle out of core, '
+                                 'and write .npy shards instead of clean_dataset.csv.')
+        parser.add_argument('--output', default='api/dataset',
+                            help='Shard directory for --stream (default: api/dataset).')
+        parser.add_argument('--extra', action='append', default=[],
+                            help='Extra CSV with text,label columns, e.g. production-flagged messages (repeatable).')
+        parser.add_argument('--chunksize', type=int, default=10000, help='Rows read per chunk with --stream.')
+        parser.add_argument('--buckets', type=int, default=16,
+                            help='Shuffle buckets / output shards with --stream; peak memory is about one bucket.')
+        parser.add_argument('--seed', type=int, default=None, help='Shuffle seed with --stream.')
+
     def handle(self, *args, **kwargs):
+        if kwargs.get('stream'):
+            return self.handle_stream(**kwargs)
+
         all_data = []
         self.stdout.write("Starting data preparation...")
 
@@ -39,4 +56,36 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS("\n🎉 --- Success! --- 🎉"))
         self.stdout.write(f"Created clean_dataset.csv with {len(final_df)} total records.")
         self.stdout.write("Label distribution:")
-        self.stdout.write(str(final_df['label'].value_counts()))
\ No newline at end of file
+        self.stdout.write(str(final_df['label'].value_counts()))
+
+    def handle_stream(self, output, extra, chunksize, buckets, seed, **kwargs):
+        self.stdout.write("Starting streaming data preparation...")
+        writer = DatasetWriter(output, buckets=buckets, seed=seed)
+
+        sources = [
+            ('SMSSpamCollection', iter_sms_spam('SMSSpamCollection', chunksize)),
+            ('labeled_data.csv', iter_labeled_data('labeled_data.csv', chunksize)),
+        ] + [(path, iter_labeled_csv(path, chunksize)) for path in extra]
+
+        for name, rows in sources:
+            before = writer.stats['read']
+            try:
+                writer.add(rows)
+            except FileNotFoundError:
+                self.stdout.write(self.style.WARNING(f"⚠️ {name} file not found. Skipping."))
+                continue
+            self.stdout.write(self.style.SUCCESS(f"✅ Streamed {writer.stats['read'] - before} records from {name}."))
+
+        manifest = writer.finish()
+        if not manifest['rows']:
+            self.stdout.write(self.style.ERROR("🔥 No data processed. Exiting."))
+            return
+
+        self.stdout.write(self.style.SUCCESS("\n🎉 --- Success! --- 🎉"))
+        self.stdout.write(
+            f"Wrote {manifest['rows']} records in {len(manifest['shards'])} shards to {output} "
+            f"({writer.stats['duplicates']} duplicates and {writer.stats['invalid']} invalid rows dropped)."
+        )
+        self.stdout.write("Label distribution:")
+        for label, count in manifest['label_counts'].items():
+            self.stdout.write(f"{label:<8}{count}")
@@ -0,0 +1,71 @@
+# api/management/commands/publish_classifier.py
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.artifacts import BUILTIN, KINDS, ArtifactRegistry
+from api.lexicon import RED_FLAGS, SUBWORD_FLAGS, WHOLE_WORD_FLAGS, YELLOW_FLAGS
+
+
+class Command(BaseCommand):
+    help = ('Publish a lexicon and/or model version to the classifier registry (CLASSIFIER_REGISTRY_DIR) and make '
+            'it active; running workers swap it in within CLASSIFIER_REGISTRY_POLL_SECONDS, without a restart.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--registry', default=settings.CLASSIFIER_REGISTRY_DIR,
+                            help='Registry directory (default: CLASSIFIER_REGISTRY_DIR).')
+        parser.add_argument('--lexicon', metavar='JSON', default=None,
+                            help='Lexicon file: {"red": [...], "yellow": [...], "subword": [...], "whole_word": [...]}.')
+        parser.add_argument('--model', metavar='PATH', default=None,
+                            help='Model to publish: a joblib file or a `train_model --export` directory.')
+        parser.add_argument('--name', default=None, help='Version name for what is published (default: a timestamp).')
+        parser.add_argument('--no-activate', action='store_true', help='Publish without making it active.')
+        for kind in KINDS:
+            parser.add_argument(f'--activate-{kind}', metavar='VERSION', default=None,
+                                help=f"Make an already published {kind} version active ('{BUILTIN}': the built-in one).")
+        parser.add_argument('--list', action='store_true', help='List published and active versions.')
+        parser.add_argument('--export-builtin-lexicon', metavar='JSON', default=None,
+                            help='Write api/lexicon.py as a lexicon file to start a new version from.')
+
+    def handle(self, *args, **options):
+        if options['export_builtin_lexicon']:
+            with open(options['export_builtin_lexicon'], 'w', encoding='utf-8') as f:
+                json.dump({'red': RED_FLAGS, 'yellow': YELLOW_FLAGS, 'subword': SUBWORD_FLAGS,
+                           'whole_word': WHOLE_WORD_FLAGS}, f, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f"✅ Built-in lexicon written to {options['export_builtin_lexicon']}"))
+            return
+        if not options['registry']:
+            raise CommandError("Set CLASSIFIER_REGISTRY_DIR or pass --registry")
+        registry = ArtifactRegistry(options['registry'])
+
+        version = options['name'] or time.strftime('%Y%m%d-%H%M%S')
+        activate = {}
+        try:
+            if options['lexicon']:
+                path = registry.publish_lexicon(options['lexicon'], version)
+                self.stdout.write(f"Published lexicon {version} to {path}")
+                activate['lexicon'] = version
+            if options['model']:
+                path = registry.publish_model(options['model'], version)
+                self.stdout.write(f"Published model {version} to {path}")
+                activate['model'] = version
+            if options['no_activate']:
+                activate = {}
+            for kind in KINDS:
+                chosen = options[f'activate_{kind}']
+                if chosen:
+                    activate[kind] = None if chosen == BUILTIN else chosen
+            if activate:
+                active = registry.activate(**activate)
+                self.stdout.write(self.style.SUCCESS(f"✅ Active: {json.dumps(active)}"))
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(str(e))
+
+        if options['list'] or not (activate or options['lexicon'] or options['model']):
+            active = registry.active()
+            for kind in KINDS:
+                versions = registry.versions(kind)
+                current = active.get(kind, BUILTIN)
+                self.stdout.write(f"{kind}: {', '.join(versions) or '-'} (active: {current})")
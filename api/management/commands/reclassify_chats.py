@@ -0,0 +1,68 @@
+# api/management/commands/reclassify_chats.py
+import os
+
+from django.core.management.base import BaseCommand
+
+from api.firebase import get_firestore
+from api.reclassify import Checkpoint, Reclassifier, get_batch_classifier
+
+
+class Command(BaseCommand):
+    help = 'Re-classifies stored chat messages and writes updated flags back to Firestore.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chat', action='append', dest='chats',
+                            help='Chat id to rescan (repeatable). Defaults to every chat.')
+        parser.add_argument('--method', default='model', choices=['keywords', 'model', 'cascade', 'ai'],
+                            help='Classifier to apply (default: model).')
+        parser.add_argument('--page-size', type=int, default=500,
+                            help='Messages fetched, classified and written per page.')
+        parser.add_argument('--text-field', default='text',
+                            help='Message field holding the encrypted text.')
+        parser.add_argument('--checkpoint', default='reclassify_checkpoint.json',
+                            help='File used to resume an interrupted run; removed when a run over '
+                                 'every chat completes.')
+        parser.add_argument('--reset', action='store_true',
+                            help='Ignore any existing checkpoint and start over.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Classify and count changes without writing them. Scans every '
+                                 'chat and leaves the checkpoint alone.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes scoring each page with --method model (default: one per core; '
+                                 '0 scores in this process).')
+
+    def handle(self, *args, **options):
+        checkpoint = Checkpoint(None if options['dry_run'] else options['checkpoint'])
+        if options['reset']:
+            checkpoint.clear()
+        elif checkpoint.cursors or checkpoint.done:
+            self.stdout.write(f"Resuming from {options['checkpoint']} ({len(checkpoint.done)} chats done)")
+
+        pool = None
+        if options['method'] == 'model' and options['workers']:
+            from api.engine import get_engine
+            from api.pool import ClassifierPool
+
+            pool = ClassifierPool(get_engine(), options['workers'], min_batch=0)
+
+        reclassifier = Reclassifier(
+            get_firestore(),
+            get_batch_classifier(options['method'], pool),
+            page_size=options['page_size'],
+            text_field=options['text_field'],
+            checkpoint=checkpoint,
+            dry_run=options['dry_run'],
+        )
+
+        self.stdout.write(f"Re-classifying messages with {options['method']}...")
+        try:
+            stats = reclassifier.run(options['chats'])
+        finally:
+            if pool is not None:
+                pool.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {stats['chats']} chats, {stats['messages']} messages scanned, "
+            f"{stats['updated']} flags {'would change' if options['dry_run'] else 'updated'}, "
+            f"{stats['failed']} could not be decrypted."
+        ))
@@ -5,29 +5,154 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.pipeline import make_pipeline
 import joblib
+import os
+import time
+from api.datasets import LABEL_IDS, iter_batches, iter_labeled_csv, iter_shards, read_labels, read_manifest
+from api.compact import export_model
+from api.normalize import fold
+from api.training import DEFAULT_N_FEATURES, train_incremental
 
 class Command(BaseCommand):
     help = 'Trains the ML model on the clean_dataset.csv and saves it.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', default=None,
+                            help='Train from a shard directory written by `prepare_data --stream` '
+                                 'instead of api/clean_dataset.csv.')
+        parser.add_argument('--output', default='api/message_classifier.joblib',
+                            help='Where to save the trained model.')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Train a fixed-width HashingVectorizer + MultinomialNB model out of core, '
+                                 'streaming mini-batches from --dataset (or api/clean_dataset.csv).')
+        parser.add_argument('--warm-start', metavar='CSV', action='append', default=[],
+                            help='Update the existing --output model with newly labeled messages from a '
+                                 'text,label CSV instead of retraining (repeatable; implies --incremental).')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Mini-batch size for --incremental.')
+        parser.add_argument('--n-features', type=int, default=DEFAULT_N_FEATURES,
+                            help='Hashing vectorizer width for --incremental.')
+        parser.add_argument('--jobs', type=int, default=-1, help='Cores used by --incremental and --holdout (-1: all).')
+        parser.add_argument('--holdout', type=float, default=0,
+                            help='Hold out this fraction of api/clean_dataset.csv, train on the rest and report '
+                                 'precision/recall on it (scored across --jobs processes).')
+        parser.add_argument('--export', metavar='DIR', default=None,
+                            help='Also write the model as flat, mmap-able numpy arrays to DIR for fast '
+                                 'cold starts (point CLASSIFIER_MODEL_PATH at DIR to serve it).')
+        parser.add_argument('--export-only', action='store_true',
+                            help='Skip training and only export the existing --output model to --export.')
+
+    def load_shards(self, dataset):
+        """Texts as a lazy generator over the shards, labels as one small array"""
+        manifest = read_manifest(dataset)
+        labels = read_labels(dataset)
+        texts = (text for shard_texts, _ in iter_shards(dataset) for text in shard_texts)
+        self.stdout.write(f"Streaming {manifest['rows']} records from {len(manifest['shards'])} shards...")
+        return texts, labels
+
+    def csv_batches(self, path, batch_size):
+        """Mini-batches of (texts, labels) read from a text,label CSV in chunks"""
+        return self._chunks(iter_labeled_csv(path, chunksize=batch_size), batch_size)
+
+    def _chunks(self, rows, size):
+        texts, labels = [], []
+        for text, label in rows:
+            if isinstance(text, str) and label in LABEL_IDS:
+                texts.append(fold(text))
+                labels.append(label)
+            if len(texts) == size:
+                yield texts, labels
+                texts, labels = [], []
+        if texts:
+            yield texts, labels
+
+    def export(self, model, path):
+        path = export_model(model, path)
+        size_kb = sum(f.stat().st_size for f in path.iterdir()) / 1024
+        self.stdout.write(self.style.SUCCESS(f"✅ Compact model exported to '{path}' ({size_kb:.0f} KB)"))
+
+    def evaluate(self, path, texts, labels, jobs):
+        """Score held-out texts with the saved model on a process pool"""
+        from sklearn.metrics import classification_report
+
+        from api.engine import ClassifierEngine
+        from api.pool import ClassifierPool
+
+        pool = ClassifierPool(ClassifierEngine(path), os.cpu_count() if jobs < 1 else jobs, min_batch=0)
+        try:
+            started = time.perf_counter()
+            verdicts = pool.classify_many(texts)
+            elapsed = time.perf_counter() - started
+        finally:
+            pool.close()
+        self.stdout.write(classification_report(labels, [verdict.flag for verdict in verdicts], digits=3,
+                                                zero_division=0))
+        self.stdout.write(f"Scored {len(texts)} held-out texts in {elapsed:.2f}s on {pool.workers} processes")
+
+    def handle_incremental(self, **kwargs):
+        model = None
+        if kwargs['warm_start']:
+            model = joblib.load(kwargs['output'])
+            batches = (batch for path in kwargs['warm_start'] for batch in self.csv_batches(path, kwargs['batch_size']))
+            self.stdout.write(f"Warm-starting {kwargs['output']} from {', '.join(kwargs['warm_start'])}...")
+        elif kwargs.get('dataset'):
+            batches = iter_batches(kwargs['dataset'], kwargs['batch_size'])
+        else:
+            batches = self.csv_batches('api/clean_dataset.csv', kwargs['batch_size'])
+
+        self.stdout.write(self.style.WARNING("🤖 Training the AI model incrementally..."))
+        model, rows = train_incremental(batches, model=model, n_features=kwargs['n_features'], n_jobs=kwargs['jobs'])
+        joblib.dump(model, kwargs['output'])
+
+        size_kb = os.path.getsize(kwargs['output']) / 1024
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Model trained on {rows} records and saved as '{kwargs['output']}' ({size_kb:.0f} KB)"
+        ))
+        if kwargs['export']:
+            self.export(model, kwargs['export'])
+
     def handle(self, *args, **kwargs):
         try:
-            self.stdout.write("Loading clean dataset...")
-            df = pd.read_csv('api/clean_dataset.csv')
-            df.dropna(subset=['text'], inplace=True)
+            if kwargs['export_only']:
+                if not kwargs['export']:
+                    self.stdout.write(self.style.ERROR("🔥 Error: --export-only needs --export DIR."))
+                    return
+                return self.export(joblib.load(kwargs['output']), kwargs['export'])
+
+            if kwargs['incremental'] or kwargs['warm_start']:
+                return self.handle_incremental(**kwargs)
+
+            if kwargs.get('dataset'):
+                if kwargs['holdout']:
+                    self.stdout.write(self.style.ERROR("🔥 Error: --holdout only works with api/clean_dataset.csv."))
+                    return
+                X, y = self.load_shards(kwargs['dataset'])
+            else:
+                self.stdout.write("Loading clean dataset...")
+                df = pd.read_csv('api/clean_dataset.csv')
+                df.dropna(subset=['text'], inplace=True)
+
+                X = df['text'].map(fold)
+                y = df['label']
+                if kwargs['holdout']:
+                    from sklearn.model_selection import train_test_split
 
-            X = df['text']
-            y = df['label']
+                    X, X_test, y, y_test = train_test_split(
+                        X, y, test_size=kwargs['holdout'], stratify=y, random_state=0
+                    )
 
             model = make_pipeline(TfidfVectorizer(), MultinomialNB())
 
             self.stdout.write(self.style.WARNING("🤖 Training the AI model... (This may take a moment)"))
             model.fit(X, y)
 
-            joblib.dump(model, 'api/message_classifier.joblib')
+            joblib.dump(model, kwargs['output'])
 
-            self.stdout.write(self.style.SUCCESS("✅ Model trained and saved successfully as 'message_classifier.joblib'"))
+            self.stdout.write(self.style.SUCCESS(f"✅ Model trained and saved successfully as '{kwargs['output']}'"))
+            if kwargs['holdout']:
+                self.evaluate(kwargs['output'], X_test.tolist(), y_test.tolist(), kwargs['jobs'])
+            if kwargs['export']:
+                self.export(model, kwargs['export'])
 
-        except FileNotFoundError:
-            self.stdout.write(self.style.ERROR("🔥 Error: 'api/clean_dataset.csv' not found. Please run the 'prepare_data' command first."))
+        except FileNotFoundError as e:
+            self.stdout.write(self.style.ERROR(f"🔥 Error: '{e.filename}' not found. Please run the 'prepare_data' command first."))
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"An unexpected error occurred: {e}"))
\ No newline at end of file
@@ -0,0 +1,189 @@
+# api/matcher.py
+from collections import deque
+from typing import NamedTuple
+
+from .normalize import KeywordNormalizer, fold, keyword_form, normalize
+
+RED = 'red'
+YELLOW = 'yellow'
+GREEN = 'green'
+
+
+class KeywordMatch(NamedTuple):
+    flag: str
+    red: tuple
+    yellow: tuple
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over the red and yellow lexicons.
+
+    The automaton is compiled once; match() then finds every red and yellow
+    term in a single pass over the text, independent of the lexicon size.
+    Failure links are folded into the transition table at build time, so the
+    scan is one dict lookup per character.
+
+    Text and terms are both matched in their normalized keyword form (see
+    api/normalize.py), where a space marks a word boundary. A term matches
+    only at the start of a word ("kill" in "killed", not in "skill").
+    subword_terms also match inside longer words ("shit" in "bullshit") and
+    whole_word_terms only match a complete word ("won", not "wonderful").
+    """
+
+    def __init__(self, red_terms, yellow_terms, subword_terms=(), whole_word_terms=()):
+        self.terms = []
+        # What the automaton matches: the term with its boundary spaces
+        self.patterns = []
+        self.severities = []
+        # Per state: {char: next_state}, only for non-root targets
+        self._delta = [{}]
+        # Per state: indices of terms ending here (including via fail links)
+        self._outputs = [()]
+
+        subword = {self.normalize_term(term) for term in subword_terms}
+        whole_word = {self.normalize_term(term) for term in whole_word_terms}
+        seen = set()
+        for severity, terms in ((RED, red_terms), (YELLOW, yellow_terms)):
+            for term in terms:
+                term = self.normalize_term(term)
+                if not term or term in seen:
+                    continue
+                seen.add(term)
+                if term in subword:
+                    pattern = term
+                elif term in whole_word:
+                    pattern = f' {term} '
+                else:
+                    pattern = ' ' + term
+                self._add(term, pattern, severity)
+        self._compile()
+
+    def __len__(self):
+        return len(self.terms)
+
+    @staticmethod
+    def normalize_term(term):
+        return keyword_form(fold(term)).strip()
+
+    def _add(self, term, pattern, severity):
+        state = 0
+        for ch in pattern:
+            nxt = self._delta[state].get(ch)
+            if nxt is None:
+                nxt = len(self._delta)
+                self._delta.append({})
+                self._outputs.append(())
+                self._delta[state][ch] = nxt
+            state = nxt
+        self._outputs[state] += (len(self.terms),)
+        self.terms.append(term)
+        self.patterns.append(pattern)
+        self.severities.append(severity)
+
+    def _compile(self):
+        fail = [0] * len(self._delta)
+        # Snapshot of the trie edges before fail transitions are folded in
+        goto = [dict(edges) for edges in self._delta]
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self._outputs[state] += self._outputs[fail[state]]
+            # Inherit the failure state's transitions we don't override
+            if state:
+                for ch, target in self._delta[fail[state]].items():
+                    self._delta[state].setdefault(ch, target)
+            for ch, child in goto[state].items():
+                if state:
+                    fail[child] = self._delta[fail[state]].get(ch, 0)
+                queue.append(child)
+        # Sort each output so red terms (added first) are reported first
+        self._outputs = [tuple(sorted(out)) for out in self._outputs]
+        self._red_states = frozenset(
+            state for state, out in enumerate(self._outputs)
+            if any(self.severities[i] == RED for i in out)
+        )
+
+    def match(self, text, stop_on_red=True):
+        """
+        Scan text once and return a KeywordMatch with the resulting flag and
+        the red/yellow terms found. With stop_on_red the scan ends at the
+        first red hit, since nothing after it can change the flag.
+        """
+        red, yellow = [], []
+        if text:
+            self._scan(0, normalize(text).keywords, red, yellow, stop_on_red)
+        return self._result(red, yellow)
+
+    def _scan(self, state, text, red, yellow, stop_on_red):
+        """Advance the automaton from state over text; returns the end state"""
+        delta, outputs, red_states = self._delta, self._outputs, self._red_states
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if state:
+                out = outputs[state]
+                if out:
+                    for i in out:
+                        found = red if self.severities[i] == RED else yellow
+                        if self.terms[i] not in found:
+                            found.append(self.terms[i])
+                    if stop_on_red and state in red_states:
+                        break
+        return state
+
+    @staticmethod
+    def _result(red, yellow):
+        if red:
+            flag = RED
+        elif yellow:
+            flag = YELLOW
+        else:
+            flag = GREEN
+        return KeywordMatch(flag, tuple(red), tuple(yellow))
+
+    def classify(self, text):
+        """Return just the flag for text"""
+        return self.match(text).flag
+
+    def stream(self):
+        """Start an incremental scan; see KeywordStream"""
+        return KeywordStream(self)
+
+
+class KeywordStream:
+    """
+    Incremental scan of text that arrives in chunks.
+
+    The automaton state is carried from one feed() to the next, so a term
+    split across a chunk boundary is still found and each character is
+    scanned exactly once. Chunks are normalized as they arrive; the end of
+    a chunk that can still change (a word cut in half) is held back until
+    the next one, and the last chunk is fed with final=True. Once a red
+    term is seen the flag can't change and further chunks are only counted.
+    """
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.normalizer = KeywordNormalizer()
+        self.state = 0
+        self.red = []
+        self.yellow = []
+        self.length = 0
+
+    def feed(self, chunk, final=False):
+        """Scan the next chunk and return the flag so far"""
+        if (chunk or final) and not self.red:
+            text = self.normalizer.feed(chunk, final)
+            self.state = self.matcher._scan(self.state, text, self.red, self.yellow, True)
+        self.length += len(chunk)
+        return self.flag
+
+    @property
+    def flag(self):
+        if self.red:
+            return RED
+        return YELLOW if self.yellow else GREEN
+
+    def result(self):
+        """KeywordMatch for everything fed so far"""
+        return self.matcher._result(self.red, self.yellow)
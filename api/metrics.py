@@ -0,0 +1,294 @@
+# api/metrics.py
+# In-process latency histograms and counters, served in the Prometheus text
+# format on /metrics.
+#
+# Metrics are kept per worker process. Every series carries a worker="<pid>"
+# label, so scrapes that land on different gunicorn workers never merge two
+# workers' counters into one series; sum() over worker in queries.
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; spans keyword scans (~10 µs) up to slow LLM calls
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(pairs):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, list(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """Latency histogram: per label set, bucket counts plus sum and count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        """
+        The series for one label set. Hot paths should hold on to it:
+        observing through it skips building the label key.
+        """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, _Series(self.buckets))
+        return series
+
+    def observe(self, value, **labels):
+        self.labels(**labels).observe(value)
+
+    def time(self, **labels):
+        """Context manager that observes the duration of its block"""
+        return _Timer(self.labels(**labels))
+
+    def count(self, **labels):
+        return self.labels(**labels).count
+
+    def samples(self):
+        with self._lock:
+            items = list(self._series.items())
+        for key, series in items:
+            with series.lock:
+                counts, total, count = list(series.counts), series.total, series.count
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket', pairs + [('le', le)], cumulative
+            yield f'{self.name}_sum', pairs, total
+            yield f'{self.name}_count', pairs, count
+
+
+class _Series:
+    __slots__ = ('buckets', 'counts', 'total', 'count', 'lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+
+class _Timer:
+    __slots__ = ('series', 'started')
+
+    def __init__(self, series):
+        self.series = series
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.series.observe(time.perf_counter() - self.started)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """
+        collect() is called on every scrape and returns a list of
+        (name, kind, documentation, [(labels dict, value), ...]) for values
+        that are read rather than recorded, such as cache hit counts.
+        """
+        self.collectors.append(collect)
+        return collect
+
+    def render(self):
+        worker = [('worker', os.getpid())]
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, pairs, value in metric.samples():
+                lines.append(f'{name}{_labels(worker + pairs)} {_number(value)}')
+        for collect in self.collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                logger.warning("Metrics collector %s failed: %s", getattr(collect, '__name__', collect), e)
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_labels(worker + list(labels.items()))} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'classifier_stage_seconds',
+    'Time spent in one stage of a request: parse, keywords, model, llm, cache, decrypt or firestore.',
+    ('stage',),
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    'classifier_request_seconds',
+    'End-to-end latency of classification requests.',
+    ('endpoint', 'method', 'status'),
+))
+VERDICTS = registry.register(Counter(
+    'classifier_verdicts_total',
+    'Verdicts returned, by configured method, flag and the tier that answered.',
+    ('method', 'flag', 'tier'),
+))
+LLM_CALLS = registry.register(Counter(
+    'classifier_llm_calls_total',
+    'OpenAI chat completions made, by result (ok or error).',
+    ('result',),
+))
+FALLBACKS = registry.register(Counter(
+    'classifier_fallbacks_total',
+    'Classifications that fell back to keywords because the configured method failed.',
+    ('method',),
+))
+RATE_LIMITED = registry.register(Counter(
+    'classifier_rate_limited_total',
+    'Requests rejected with 429, by endpoint and the kind of key (chat or client) that ran out.',
+    ('endpoint', 'kind'),
+))
+COALESCED = registry.register(Counter(
+    'classifier_coalesced_total',
+    'Requests that waited for an identical in-flight request instead of computing their own.',
+    ('name',),
+))
+ARTIFACT_SWAPS = registry.register(Counter(
+    'classifier_artifact_swaps_total',
+    'Lexicon and model versions swapped in from the registry, by kind and result (ok or error).',
+    ('kind', 'result'),
+))
+FLAG_WRITES = registry.register(Counter(
+    'classifier_flag_writes_total',
+    'Message flag updates written to Firestore, by result: ok, retried (batch failed, put back), '
+    'spooled (gave up, saved for replay), dropped (gave up and could not spool) or inline (queue full or closed).',
+    ('result',),
+))
+FLAG_FLUSH_SECONDS = registry.register(Histogram(
+    'classifier_flag_flush_seconds',
+    'Time to commit one batch of flag updates to Firestore.',
+))
+FLAG_WRITE_LAG_SECONDS = registry.register(Histogram(
+    'classifier_flag_write_lag_seconds',
+    'Time from queueing a flag update to its commit.',
+))
+
+
+_stages = {}
+
+
+def stage(name):
+    """Time a block as one request stage: `with stage('model'): ...`"""
+    series = _stages.get(name)
+    if series is None:
+        series = _stages[name] = STAGE_SECONDS.labels(stage=name)
+    return _Timer(series)
+
+
+def count_verdicts(method, verdicts):
+    for verdict in verdicts:
+        VERDICTS.inc(method=method, flag=verdict.flag, tier=verdict.tier)
+
+
+def observe_request(endpoint, method, status, elapsed):
+    """Record one request; a sampled fraction is also logged at INFO"""
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=method, status=status)
+    rate = settings.REQUEST_LOG_SAMPLE_RATE
+    if rate and random.random() < rate:
+        logger.info("%s method=%s status=%s %.1f ms", endpoint, method, status, elapsed * 1000)
+
+
+def instrumented(endpoint, get_method):
+    """
+    Decorate a (sync or async) view method to record its latency and status
+    under endpoint, labeled with the classification method get_method()
+    returns.
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                response = await view(*args, **kwargs)
+                observe_request(endpoint, get_method(), response.status_code, time.perf_counter() - started)
+                return response
+        else:
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                response = view(*args, **kwargs)
+                observe_request(endpoint, get_method(), response.status_code, time.perf_counter() - started)
+                return response
+        return wrapper
+    return decorator
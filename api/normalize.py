@@ -0,0 +1,216 @@
+# api/normalize.py
+# Text normalization shared by the keyword, model and cache-key paths.
+#
+# normalize(text) returns two forms of a message:
+#
+#   text      NFKC-folded, casefolded, zero-width characters removed and
+#             whitespace collapsed. The model classifies this form and the
+#             verdict cache keys on it, so every verdict is a function of it.
+#   keywords  text with look-alikes mapped back to letters (accents,
+#             Cyrillic/Greek homoglyphs, leetspeak), apostrophes dropped
+#             ("won't" -> "wont"), every other non-alphanumeric
+#             character turned into a space, and runs of
+#             three or more single letters joined ("f u c k" -> "fuck").
+#             It is padded with a space at both ends, so a space in this
+#             form always marks a word boundary; the keyword automaton
+#             matches terms against it (see api/matcher.py).
+#
+# All per-character mappings are str.translate tables built once at import.
+# The hot path is one translate per table plus a split/join.
+import string
+import unicodedata
+from functools import lru_cache
+from typing import NamedTuple
+
+# Bump when a change here can change a verdict; it is part of the verdict
+# cache keys
+NORMALIZATION_VERSION = 2
+
+# Invisible characters used to split words without showing a gap
+_ZERO_WIDTH = {0x00AD, 0x034F, 0x180E, 0x200B, 0x200C, 0x200D, 0x2060, 0x2061, 0x2062, 0x2063, 0x2064, 0xFEFF}
+
+# Letters that look like Latin ones but NFKC leaves alone
+_HOMOGLYPHS = {
+    # Cyrillic
+    'а': 'a', 'в': 'b', 'е': 'e', 'ё': 'e', 'к': 'k', 'м': 'm', 'н': 'h', 'о': 'o', 'р': 'p',
+    'с': 'c', 'т': 't', 'у': 'y', 'х': 'x', 'ѕ': 's', 'і': 'i', 'ї': 'i', 'ј': 'j', 'һ': 'h',
+    'ԁ': 'd', 'ԛ': 'q', 'ԝ': 'w', 'ү': 'y', 'ӏ': 'l',
+    # Greek
+    'α': 'a', 'β': 'b', 'γ': 'y', 'ε': 'e', 'η': 'n', 'ι': 'i', 'κ': 'k', 'ν': 'v', 'ο': 'o',
+    'ρ': 'p', 'τ': 't', 'υ': 'u', 'χ': 'x', 'ω': 'w',
+    # Latin look-alikes
+    'ı': 'i', 'ł': 'l', 'ø': 'o', 'đ': 'd', 'ħ': 'h', 'ŧ': 't', 'ß': 'ss', 'æ': 'ae', 'œ': 'oe',
+}
+
+# Apostrophes join a contraction into one word rather than splitting it
+# ("won't" must not match the whole word "won")
+_APOSTROPHES = "'\u2019\u02bc"
+
+# Digits and symbols standing in for letters
+_LEET = {
+    '0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b', '9': 'g',
+    '@': 'a', '$': 's', '!': 'i', '|': 'l', '€': 'e', '£': 'l',
+}
+
+
+def _keyword_table():
+    """
+    Per-character map from folded text towards the keyword alphabet:
+    look-alike letters -> ASCII letters, apostrophes dropped, other
+    punctuation -> ' '. Digits and leetspeak symbols are kept;
+    keyword_words() decides per word.
+    """
+    table = {}
+    # Latin-1, Latin Extended-A/B, combining marks, Latin Extended Additional
+    for cp in (*range(0x80, 0x370), *range(0x1E00, 0x1F00)):
+        ch = chr(cp)
+        decomposed = unicodedata.normalize('NFD', ch)
+        if unicodedata.category(ch) == 'Mn':
+            # Combining marks left over after folding ("k̈ill")
+            table[cp] = None
+        elif len(decomposed) > 1 and decomposed[0].isascii() and decomposed[0].isalpha():
+            # Accented Latin letters -> base letter ("kïll")
+            table[cp] = decomposed[0].lower()
+    table.update((ord(k), v) for k, v in _HOMOGLYPHS.items())
+    for ch in string.printable:
+        if ch in string.ascii_uppercase:
+            table[ord(ch)] = ch.lower()
+        elif ch not in string.ascii_lowercase and ch not in string.digits and ch not in _LEET:
+            table[ord(ch)] = ' '
+    table.update(dict.fromkeys(map(ord, _APOSTROPHES)))
+    return table
+
+
+_FOLD = dict.fromkeys(_ZERO_WIDTH)
+_KEYWORDS = _keyword_table()
+_LEET_TABLE = str.maketrans(_LEET)
+# Symbols that are punctuation, not letters, at the edges of a word ("you!!")
+_EDGE_PUNCTUATION = '!|'
+
+
+class Normalized(NamedTuple):
+    text: str
+    keywords: str
+
+
+def fold(text):
+    """NFKC, casefold, drop zero-width characters and collapse whitespace"""
+    if not text.isascii():
+        text = unicodedata.normalize('NFKC', text).translate(_FOLD)
+    return ' '.join(text.casefold().split())
+
+
+def keyword_chars(folded):
+    """Map folded text towards the keyword alphabet; whitespace is not collapsed"""
+    return folded.translate(_KEYWORDS)
+
+
+def fold_chunk(chunk):
+    """fold() for one piece of a longer text: whitespace is kept as is"""
+    if not chunk.isascii():
+        chunk = unicodedata.normalize('NFKC', chunk).translate(_FOLD)
+    return chunk.casefold()
+
+
+def _deobfuscate(word):
+    """Read digits and symbols inside a word as letters ("k1ll", "cl@im")"""
+    word = word.strip(_EDGE_PUNCTUATION)
+    if word.isdigit() or not any(ch.isalpha() for ch in word):
+        # A number or a run of symbols, not a disguised word
+        return ''.join(ch for ch in word if ch.isdigit())
+    return word.translate(_LEET_TABLE)
+
+
+def keyword_word(word):
+    """One word from keyword_chars(...).split() in keyword form; '' drops it"""
+    return word if word.isalpha() else _deobfuscate(word)
+
+
+def keyword_words(words):
+    """
+    Yield the keyword form of each word from keyword_chars(...).split():
+    leetspeak decoded, and runs of three or more single letters joined
+    into one word ("f u c k" -> "fuck"). Shorter runs ("a", "u r") are kept.
+    """
+    run = []
+    for word in words:
+        if not word.isalpha():
+            word = _deobfuscate(word)
+            if not word:
+                continue
+        if len(word) == 1 and word.isalpha():
+            run.append(word)
+            continue
+        if run:
+            yield from _flush(run)
+            run = []
+        yield word
+    if run:
+        yield from _flush(run)
+
+
+def _flush(run):
+    if len(run) >= 3:
+        return [''.join(run)]
+    return run
+
+
+def keyword_form(folded):
+    """The keyword form of already-folded text (see module docstring)"""
+    return ' ' + ' '.join(keyword_words(keyword_chars(folded).split())) + ' '
+
+
+class KeywordNormalizer:
+    """
+    keyword_form() for text that arrives in chunks.
+
+    feed() returns the keyword form of the words that are complete. A word
+    cut off at the end of a chunk, and trailing single letters that may
+    still be joined with the next ones, are held back until a later chunk
+    or the final one. The pieces returned add up to keyword_form() of the
+    whole text.
+    """
+
+    def __init__(self):
+        self.pending = ''
+
+    def feed(self, chunk, final=False):
+        text = self.pending + keyword_chars(fold_chunk(chunk))
+        words = text.split()
+        if final:
+            self.pending = ''
+        else:
+            held = words.pop() if text and not text[-1].isspace() else ''
+            cut = len(words)
+            while cut and len(keyword_word(words[cut - 1])) <= 1:
+                cut -= 1
+            self.pending = ' '.join(words[cut:] + [held])
+            words = words[:cut]
+        return ''.join(' ' + word for word in keyword_words(words)) + (' ' if final else '')
+
+
+# Texts beyond this length are normalized without memoization, to bound
+# the memory held by the cache below
+MEMO_MAX_CHARS = 2000
+
+
+@lru_cache(maxsize=1024)
+def _normalize_memo(text):
+    folded = fold(text)
+    return Normalized(folded, keyword_form(folded))
+
+
+def normalize(text):
+    """
+    Return the Normalized forms of text.
+
+    The keyword, model and cache-key paths each call this for the same
+    message, so short texts are memoized: the work runs once per message
+    and later calls cost a dict lookup (str caches its own hash).
+    """
+    if not text:
+        return Normalized('', '  ')
+    if len(text) > MEMO_MAX_CHARS:
+        folded = fold(text)
+        return Normalized(folded, keyword_form(folded))
+    return _normalize_memo(text)
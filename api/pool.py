@@ -0,0 +1,251 @@
+# api/pool.py
+# Process pool for CPU-bound model scoring.
+#
+# TF-IDF + NB scoring holds the GIL, so threads in one worker take turns.
+# ClassifierPool forks child processes after loading the model in the
+# parent: each child holds the model (shared copy-on-write, as gunicorn
+# workers share it) and scores one chunk of a batch at a time.
+#
+# Forking is only safe while the parent runs a single thread: a child
+# inherits every lock as it was, and one held by another thread (logging,
+# httpx, the flag writer) would stay held in the child forever. gunicorn
+# starts the pool in post_worker_init, before any other thread exists.
+# Pools started later (on a request, or by a model swap on the artifact
+# watcher's thread) use the 'forkserver' start method instead; their
+# children load the model from its file, which the page cache still shares.
+#
+# Texts travel to the children in one shared-memory block per call, laid
+# out like the dataset shards in api/datasets.py: int64 start offsets (one
+# extra marking the end) followed by the UTF-8 bytes of every text end to
+# end. Each child writes its rows of probabilities into a second block.
+# Only block names and index ranges are pickled.
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from django.conf import settings
+
+from .metrics import stage
+from .normalize import normalize
+
+logger = logging.getLogger(__name__)
+
+# Set in each child by _init_child
+_child_engine = None
+
+
+def _init_child(engine):
+    global _child_engine
+    _child_engine = engine
+    # Already loaded when forked; forkserver children load it here
+    engine.load()
+    if sys.version_info < (3, 13):
+        # The parent creates and unlinks every block; children only attach.
+        # Before 3.13 (SharedMemory(track=False)) attaching registers the
+        # block with the resource tracker the children share with the parent,
+        # which then reports it as leaked at exit.
+        from multiprocessing import resource_tracker
+
+        register = resource_tracker.register
+
+        def register_unless_shared_memory(name, rtype):
+            if rtype != 'shared_memory':
+                register(name, rtype)
+
+        resource_tracker.register = register_unless_shared_memory
+
+
+def _attach(name):
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    return SharedMemory(name=name)
+
+
+def _ready():
+    return os.getpid()
+
+
+def start_method():
+    """'fork' while this is the process's only thread, else 'forkserver'"""
+    return 'fork' if threading.active_count() == 1 else 'forkserver'
+
+
+def pack_texts(texts):
+    """Copy texts into a new SharedMemory block; the caller unlinks it"""
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    header = offsets.nbytes
+    block = SharedMemory(create=True, size=max(1, header + int(offsets[-1])))
+    block.buf[:header] = offsets.tobytes()
+    block.buf[header:header + int(offsets[-1])] = b''.join(encoded)
+    return block
+
+
+def unpack_texts(buf, count, start, stop):
+    """Texts start..stop of a block written by pack_texts holding count texts"""
+    offsets = np.frombuffer(buf, dtype=np.int64, count=count + 1)
+    header = offsets.nbytes
+    bounds = (offsets[start:stop + 1] + header).tolist()
+    del offsets  # release the buffer export before the block is closed
+    return [bytes(buf[a:b]).decode('utf-8') for a, b in zip(bounds, bounds[1:])]
+
+
+def _score_chunk(texts_name, count, probabilities_name, n_classes, start, stop):
+    """Child: score texts start..stop and write their rows of probabilities"""
+    texts_block = _attach(texts_name)
+    probabilities_block = _attach(probabilities_name)
+    try:
+        texts = unpack_texts(texts_block.buf, count, start, stop)
+        rows = _child_engine.predict_proba([normalize(text).text for text in texts])
+        out = np.ndarray((count, n_classes), dtype=np.float64, buffer=probabilities_block.buf)
+        out[start:stop] = rows
+        del out
+    finally:
+        texts_block.close()
+        probabilities_block.close()
+    return stop - start
+
+
+class ClassifierPool:
+    """
+    Scores batches with a ClassifierEngine across `workers` child processes.
+
+    Batches smaller than min_batch are scored in-process, where the copy
+    into shared memory and the round trip would cost more than they save.
+    A batch is split into at most chunk_size texts per task, and into at
+    least one task per worker.
+    """
+
+    def __init__(self, engine, workers=None, min_batch=None, chunk_size=None):
+        self.engine = engine
+        self.workers = workers or os.cpu_count() or 1
+        self.min_batch = settings.CLASSIFIER_POOL_MIN_BATCH if min_batch is None else min_batch
+        self.chunk_size = chunk_size or settings.CLASSIFIER_POOL_CHUNK_SIZE
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Load the model, then fork the children; safe to call from several threads"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self.engine.load()
+                    method = start_method()
+                    executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context(method),
+                        initializer=_init_child,
+                        initargs=(self.engine,),
+                    )
+                    # Start every child (forkserver ones only start on
+                    # demand) and have it load the model before serving
+                    for future in [executor.submit(_ready) for _ in range(self.workers)]:
+                        future.result()
+                    self._executor = executor
+                    logger.info("Classifier pool started with %d processes (%s)", self.workers, method)
+        return self._executor
+
+    def _current(self):
+        """The engine and the executor whose children hold it, read together"""
+        while True:
+            executor = self.start()
+            with self._lock:
+                if self._executor is executor:
+                    return self.engine, executor
+
+    def predict_proba(self, texts, engine=None):
+        """
+        Return an (n_texts, n_classes) probability matrix, scored in the
+        children. If engine is given and the pool has been swapped to
+        another one since, the texts are scored in-process with engine.
+        """
+        current, executor = self._current()
+        engine = engine or current
+        count = len(texts)
+        n_classes = len(engine.classes)
+        if not count:
+            return np.empty((0, n_classes))
+        if engine is not current:
+            return engine.predict_proba([normalize(text).text for text in texts])
+        size = min(self.chunk_size, math.ceil(count / self.workers))
+        texts_block = pack_texts(texts)
+        probabilities_block = SharedMemory(create=True, size=count * n_classes * 8)
+        try:
+            with stage('model'):
+                try:
+                    futures = [
+                        executor.submit(_score_chunk, texts_block.name, count, probabilities_block.name,
+                                        n_classes, start, min(start + size, count))
+                        for start in range(0, count, size)
+                    ]
+                except RuntimeError:
+                    # swap() shut these children down after _current() returned them
+                    return engine.predict_proba([normalize(text).text for text in texts])
+                for future in futures:
+                    future.result()
+            return np.ndarray((count, n_classes), dtype=np.float64, buffer=probabilities_block.buf).copy()
+        finally:
+            for block in (texts_block, probabilities_block):
+                block.close()
+                block.unlink()
+
+    def classify_many(self, texts, engine=None):
+        """
+        Same result as ClassifierEngine.classify_many, using the children for
+        large batches. engine defaults to the pool's; a request pinned to an
+        older one is scored with it.
+        """
+        engine = engine or self.engine
+        if len(texts) < self.min_batch:
+            return engine.classify_many(texts)
+        return engine.verdicts(self.predict_proba(texts, engine))
+
+    def swap(self, engine):
+        """
+        Score with engine from now on. Children holding the old model finish
+        the tasks already sent to them and exit; new children are started
+        for engine if the pool was running (through the forkserver, as this
+        runs on the artifact watcher's thread).
+        """
+        engine.load()
+        with self._lock:
+            old, self._executor = self._executor, None
+            self.engine = engine
+        if old is not None:
+            self.start()
+            old.shutdown(wait=True)
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the process-wide ClassifierPool, or None when
+    CLASSIFIER_POOL_WORKERS is 0. Started on first use; gunicorn starts it in
+    each worker right after the fork (see gunicorn.conf.py).
+    """
+    global _pool
+    if not settings.CLASSIFIER_POOL_WORKERS:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from .engine import get_engine
+
+                _pool = ClassifierPool(get_engine(), settings.CLASSIFIER_POOL_WORKERS)
+    return _pool
@@ -0,0 +1,149 @@
+# api/ratelimit.py
+# Token-bucket rate limiting for the classify endpoints, keyed by chat
+# (/classify/) or by client address (the text endpoints).
+#
+# Buckets live in process memory by default, so each worker enforces the
+# limits on its own. With RATE_LIMIT_CACHE_URL set, the 'ratelimit' cache
+# alias (Redis) holds them and every worker shares one limit per key.
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+from .metrics import RATE_LIMITED
+
+
+class LocalRateLimiter:
+    """
+    Token buckets in process memory: `rate` tokens per second refill a
+    bucket of at most `burst`, and each request takes `cost` (default one). Idle buckets
+    beyond max_keys are dropped, least recently used first; a dropped
+    bucket comes back full, which is what it would have refilled to.
+    """
+
+    shared = False
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def allow(self, key, rate, burst, cost=1):
+        """Take cost tokens for key; returns (allowed, seconds until they are available)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+
+class CacheRateLimiter:
+    """
+    Limits shared by every worker through a Django cache alias. Redis has no
+    atomic read-modify-write for a bucket through the cache API, so each
+    bucket is approximated by fixed windows of burst / rate seconds that
+    admit `burst` tokens, counted with the atomic incr().
+    """
+
+    shared = True
+
+    def __init__(self, alias='ratelimit'):
+        self.alias = alias
+
+    def allow(self, key, rate, burst, cost=1):
+        window = burst / rate
+        now = time.time()
+        start = math.floor(now / window)
+        cache_key = f"ratelimit:{key}:{start}"
+        backend = caches[self.alias]
+        # add() is a no-op if the window already exists; incr() is atomic
+        backend.add(cache_key, 0, timeout=math.ceil(window) + 1)
+        try:
+            count = backend.incr(cache_key, cost)
+        except ValueError:
+            # Expired between add() and incr()
+            backend.add(cache_key, cost, timeout=math.ceil(window) + 1)
+            count = cost
+        allowed = count <= burst
+        return allowed, 0.0 if allowed else (start + 1) * window - now
+
+
+# Settings holding (requests per second, burst) for each kind of key
+LIMITS = {
+    'chat': ('CHAT_RATE_LIMIT_PER_SECOND', 'CHAT_RATE_LIMIT_BURST'),
+    'client': ('CLIENT_RATE_LIMIT_PER_SECOND', 'CLIENT_RATE_LIMIT_BURST'),
+}
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide limiter: shared through the cache if configured"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = CacheRateLimiter() if 'ratelimit' in settings.CACHES else LocalRateLimiter()
+    return _limiter
+
+
+def client_address(request):
+    """The client's address: REMOTE_ADDR, or the first hop of RATE_LIMIT_CLIENT_HEADER behind a proxy"""
+    header = settings.RATE_LIMIT_CLIENT_HEADER
+    if header:
+        forwarded = request.headers.get(header)
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+def scope_client_address(scope):
+    """client_address() for an ASGI scope"""
+    header = settings.RATE_LIMIT_CLIENT_HEADER
+    if header:
+        forwarded = dict(scope.get('headers') or ()).get(header.lower().encode('latin-1'))
+        if forwarded:
+            return forwarded.decode('latin-1').split(',')[0].strip()
+    client = scope.get('client')
+    return client[0] if client else None
+
+
+def throttle(endpoint, kind, ident, cost=1):
+    """
+    Take cost tokens from ident's bucket. Returns a 429 JsonResponse with
+    Retry-After if it is short, else None. kind picks the limits in LIMITS;
+    a rate of 0 turns that kind of limit off. cost is capped at the burst,
+    so a full bucket admits any request.
+    """
+    rate_setting, burst_setting = LIMITS[kind]
+    rate = getattr(settings, rate_setting)
+    if not rate or not ident:
+        return None
+    burst = getattr(settings, burst_setting)
+    allowed, retry_after = get_rate_limiter().allow(f"{kind}:{ident}", rate, burst, min(cost, burst))
+    if allowed:
+        return None
+    RATE_LIMITED.inc(endpoint=endpoint, kind=kind)
+    response = JsonResponse({"error": "Too many requests"}, status=429)
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+async def athrottle(endpoint, kind, ident, cost=1):
+    """throttle() for async views; the shared backend's round trip runs in a thread"""
+    if not get_rate_limiter().shared:
+        return throttle(endpoint, kind, ident, cost)
+    from asgiref.sync import sync_to_async
+
+    return await sync_to_async(throttle)(endpoint, kind, ident, cost)
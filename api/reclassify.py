@@ -0,0 +1,166 @@
+# api/reclassify.py
+import json
+import logging
+import os
+from pathlib import Path
+
+from .classifier import Verdict, classify_text
+from .crypto import decrypt_many
+from .metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_WRITES = 500
+
+
+def get_batch_classifier(method, pool=None):
+    """
+    Return a function mapping a list of texts to a list of Verdicts. With a
+    ClassifierPool, the model scores pages across its processes.
+    """
+    if method == 'model':
+        from .engine import classify_many
+
+        return pool.classify_many if pool is not None else classify_many
+    if method == 'cascade':
+        from .cascade import classify_cascade_many
+
+        return classify_cascade_many
+    if method == 'ai':
+        from .batching import classify_many_with_llm
+
+        def classify_many_ai(texts):
+            flags = classify_many_with_llm(texts)
+            return [
+                Verdict(flag, None, 'ai') if flag else Verdict(classify_text(text), None, 'keywords')
+                for text, flag in zip(texts, flags)
+            ]
+        return classify_many_ai
+    return lambda texts: [Verdict(classify_text(text), None, 'keywords') for text in texts]
+
+
+class Checkpoint:
+    """
+    Progress of a re-classification run, saved as JSON after every page:
+    the last processed message id per chat and the chats already finished.
+    It only exists while a run is unfinished; a completed run clears it.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path) if path else None
+        self.cursors = {}
+        self.done = set()
+        if self.path and self.path.exists():
+            data = json.loads(self.path.read_text())
+            self.cursors = data.get('cursors', {})
+            self.done = set(data.get('done', []))
+
+    def advance(self, chat_id, message_id):
+        self.cursors[chat_id] = message_id
+        self.save()
+
+    def finish(self, chat_id):
+        self.cursors.pop(chat_id, None)
+        self.done.add(chat_id)
+        self.save()
+
+    def clear(self):
+        """Forget all progress, so the next run starts from the first chat"""
+        self.cursors, self.done = {}, set()
+        if self.path:
+            self.path.unlink(missing_ok=True)
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+        tmp.write_text(json.dumps({'cursors': self.cursors, 'done': sorted(self.done)}))
+        os.replace(tmp, self.path)
+
+
+class Reclassifier:
+    """
+    Re-scans chats/{chatId}/messages and rewrites message flags.
+
+    Messages are paged in document-id order with start_after cursors, so a
+    run can resume from its checkpoint. A dry run neither reads nor saves
+    one, and only a run over every chat clears it. Each page is decrypted, classified
+    with one vectorized call, and only changed flags are written back in
+    WriteBatch chunks of up to 500.
+    """
+
+    def __init__(self, db, classify_many, page_size=500, text_field='text',
+                 checkpoint=None, dry_run=False):
+        self.db = db
+        self.classify_many = classify_many
+        self.page_size = page_size
+        self.text_field = text_field
+        self.checkpoint = checkpoint if checkpoint and not dry_run else Checkpoint(None)
+        self.dry_run = dry_run
+        self.stats = {'chats': 0, 'messages': 0, 'updated': 0, 'failed': 0}
+
+    def chat_ids(self):
+        return [doc.id for doc in self.db.collection('chats').list_documents()]
+
+    def run(self, chat_ids=None):
+        for chat_id in chat_ids or self.chat_ids():
+            if chat_id in self.checkpoint.done:
+                continue
+            self.reclassify_chat(chat_id)
+        if chat_ids is None:
+            # Nothing left to resume: the next run (after a lexicon or model
+            # change, say) rescans every chat
+            self.checkpoint.clear()
+        return self.stats
+
+    def reclassify_chat(self, chat_id):
+        messages = self.db.collection('chats').document(chat_id).collection('messages')
+        cursor_id = self.checkpoint.cursors.get(chat_id)
+        cursor = messages.document(cursor_id).get() if cursor_id else None
+
+        while True:
+            query = messages.order_by('__name__').limit(self.page_size)
+            if cursor is not None:
+                query = query.start_after(cursor)
+            with stage('firestore'):
+                page = list(query.stream())
+            if not page:
+                break
+            self.process_page(chat_id, page)
+            cursor = page[-1]
+            self.checkpoint.advance(chat_id, cursor.id)
+            if len(page) < self.page_size:
+                break
+
+        self.checkpoint.finish(chat_id)
+        self.stats['chats'] += 1
+
+    def process_page(self, chat_id, page):
+        documents = [(snapshot, snapshot.to_dict() or {}) for snapshot in page]
+        decrypted = decrypt_many(chat_id, [data.get(self.text_field) or '' for _, data in documents])
+        snapshots, texts = [], []
+        for (snapshot, data), result in zip(documents, decrypted):
+            if not result.ok or not data.get(self.text_field):
+                self.stats['failed'] += 1
+                continue
+            snapshots.append((snapshot, data.get('flag')))
+            texts.append(result.text)
+        self.stats['messages'] += len(page)
+        if not texts:
+            return
+
+        updates = [
+            (snapshot.reference, verdict.flag)
+            for (snapshot, old_flag), verdict in zip(snapshots, self.classify_many(texts))
+            if verdict.flag != old_flag
+        ]
+        self.stats['updated'] += len(updates)
+        if self.dry_run:
+            return
+        for start in range(0, len(updates), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for reference, flag in updates[start:start + MAX_BATCH_WRITES]:
+                batch.update(reference, {'flag': flag})
+            with stage('firestore'):
+                batch.commit()
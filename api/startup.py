@@ -0,0 +1,65 @@
+# api/startup.py
+# Measures what a worker imports on startup, with `python -X importtime`.
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# Stacks that must only be imported on first use, never while a worker boots
+LAZY_MODULES = (
+    'firebase_admin',
+    'google.cloud.firestore',
+    'grpc',
+    'openai',
+    'httpx',
+    'sklearn',
+    'scipy',
+    'pandas',
+    'joblib',
+)
+
+# Loads settings, apps and the URLconf (and so every view module), which is
+# what a worker does before serving, minus preloading the model.
+STARTUP_SCRIPT = """
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+"""
+
+
+class ImportProfile(NamedTuple):
+    """Result of one startup run: wall time, per-module times and lazy stacks that got loaded"""
+    seconds: float
+    modules: dict  # module -> (self_us, cumulative_us)
+    eager: list
+
+
+def parse_importtime(stderr):
+    """Parse `-X importtime` output into {module: (self_us, cumulative_us)}"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def profile_startup(settings_module=None, python=sys.executable):
+    """Import the app in a fresh interpreter and return its ImportProfile"""
+    env = dict(os.environ)
+    env['DJANGO_SETTINGS_MODULE'] = settings_module or env.get('DJANGO_SETTINGS_MODULE', 'backend_django.settings')
+    started = time.perf_counter()
+    result = subprocess.run(
+        [python, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    seconds = time.perf_counter() - started
+    modules = parse_importtime(result.stderr)
+    eager = [name for name in LAZY_MODULES if name in modules]
+    return ImportProfile(seconds, modules, eager)
@@ -0,0 +1,170 @@
+# api/streaming.py
+# Streaming classification over ASGI: POST /stream/classify-text/ with a
+# chunked text/plain body; the response is NDJSON, one verdict per line.
+#
+# Django's ASGI handler reads the whole request body before calling a view,
+# so this endpoint is a small ASGI app mounted in front of Django
+# (backend_django/asgi.py) that sees each body chunk as it arrives. Chunks
+# are fed to one KeywordStream, which keeps the automaton state between
+# chunks, so nothing is rescanned. A line is sent whenever the keyword flag
+# changes; a red term ends the stream at once with a final verdict. When the
+# body ends without a red term, the configured classifier (model, cascade or
+# AI) classifies the full text for the final line.
+#
+# The client limit applies per line: opening a stream takes a token, which
+# pays for the final verdict, and each interim line takes another. A stream
+# refused at the start gets a plain 429; one that runs out mid-way ends with
+# an error line.
+import codecs
+import json
+import logging
+import time
+
+from django.conf import settings
+
+from .artifacts import active_versions, pinned
+from .classifier import Verdict, get_lexicon
+from .metrics import count_verdicts, observe_request, stage
+from .ratelimit import athrottle, scope_client_address
+
+logger = logging.getLogger(__name__)
+
+STREAM_PATH = '/stream/classify-text/'
+CONTENT_TYPE = b'application/x-ndjson'
+
+
+def verdict_event(verdict, length, final):
+    event = {"event": "verdict", "final": final, "length": length, "flag": verdict.flag, "tier": verdict.tier}
+    if verdict.scores is not None:
+        event["scores"] = verdict.scores
+    if verdict.degraded:
+        event["degraded"] = True
+    if final:
+        event["versions"] = active_versions()
+    return event
+
+
+def cors_headers(scope):
+    """Access-Control headers for allowed origins (corsheaders only covers Django views)"""
+    origin = dict(scope.get('headers') or ()).get(b'origin')
+    if origin is None or origin.decode('latin-1') not in settings.CORS_ALLOWED_ORIGINS:
+        return []
+    headers = [(b'access-control-allow-origin', origin), (b'vary', b'Origin')]
+    if settings.CORS_ALLOW_CREDENTIALS:
+        headers.append((b'access-control-allow-credentials', b'true'))
+    return headers
+
+
+class StreamClassifyApp:
+    """ASGI app serving STREAM_PATH; everything else goes to the wrapped app"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != STREAM_PATH:
+            return await self.app(scope, receive, send)
+        if scope['method'] == 'OPTIONS':
+            return await self.respond(send, 204, cors_headers(scope) + [
+                (b'access-control-allow-methods', b'POST, OPTIONS'),
+                (b'access-control-allow-headers', b'content-type'),
+                (b'access-control-max-age', b'86400'),
+            ])
+        if scope['method'] != 'POST':
+            return await self.respond(send, 405, [(b'allow', b'POST, OPTIONS')])
+
+        from .views import get_classification_method
+
+        method = get_classification_method()
+        started = time.perf_counter()
+        # Django's middleware doesn't run here, so pin the lexicon and model
+        # for the stream as PinArtifactsMiddleware does for a request
+        with pinned():
+            status = await self.classify_stream(scope, receive, send, method)
+        observe_request('stream-classify-text', method, status, time.perf_counter() - started)
+
+    async def respond(self, send, status, headers=(), body=b''):
+        await send({'type': 'http.response.start', 'status': status, 'headers': list(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def classify_stream(self, scope, receive, send, method):
+        """Returns the status recorded in metrics (499 if the client went away)"""
+        started = False
+        max_chars = settings.STREAM_CLASSIFY_MAX_CHARS
+
+        async def emit(event, more=True, status=200):
+            # The response starts with the first line, so errors found before
+            # any verdict was sent still get a real status code
+            nonlocal started
+            if not started:
+                started = True
+                await send({
+                    'type': 'http.response.start',
+                    'status': status,
+                    'headers': cors_headers(scope) + [
+                        (b'content-type', CONTENT_TYPE),
+                        (b'cache-control', b'no-cache'),
+                        # Don't let nginx-style proxies hold lines back
+                        (b'x-accel-buffering', b'no'),
+                    ],
+                })
+            await send({
+                'type': 'http.response.body',
+                'body': json.dumps(event).encode() + b'\n',
+                'more_body': more,
+            })
+            return status
+
+        client = scope_client_address(scope)
+        limited = await athrottle('stream-classify-text', 'client', client)
+        if limited:
+            await self.respond(send, 429, cors_headers(scope) + [
+                (b'content-type', limited['Content-Type'].encode()),
+                (b'retry-after', limited['Retry-After'].encode()),
+            ], limited.content)
+            return 429
+
+        content_length = dict(scope.get('headers') or ()).get(b'content-length')
+        if content_length and content_length.isdigit() and int(content_length) > 4 * max_chars:
+            return await emit({"event": "error", "error": f"Text too long (max {max_chars} characters)"},
+                              more=False, status=413)
+
+        stream = get_lexicon().matcher.stream()
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        # Kept only for the final classification by the configured method
+        parts = [] if method != 'keywords' else None
+        flag = stream.flag
+        more = True
+        while more:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return 499
+            more = message.get('more_body', False)
+            chunk = decoder.decode(message.get('body', b''), final=not more)
+            if stream.length + len(chunk) > max_chars:
+                return await emit({"event": "error", "error": f"Text too long (max {max_chars} characters)"},
+                                  more=False, status=413)
+            if parts is not None:
+                parts.append(chunk)
+            with stage('keywords'):
+                new_flag = stream.feed(chunk, final=not more)
+            if new_flag == 'red':
+                verdict = Verdict('red', None, 'keywords')
+                count_verdicts(method, [verdict])
+                return await emit(verdict_event(verdict, stream.length, True), more=False)
+            if new_flag != flag:
+                flag = new_flag
+                if await athrottle('stream-classify-text', 'client', client):
+                    return await emit({"event": "error", "error": "Too many requests"}, more=False, status=429)
+                await emit(verdict_event(Verdict(flag, None, 'keywords'), stream.length, False))
+
+        if not stream.length:
+            return await emit({"event": "error", "error": "Missing text"}, more=False, status=400)
+        if parts is None:
+            verdict = Verdict(flag, None, 'keywords')
+        else:
+            from .async_views import aclassify
+
+            verdict = await aclassify(''.join(parts), method)
+        count_verdicts(method, [verdict])
+        return await emit(verdict_event(verdict, stream.length, True), more=False)
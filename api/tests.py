@@ -1,3 +1,1170 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import os
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+
+from .artifacts import ArtifactRegistry, ArtifactWatcher, active_versions, pinned
+from .benchmark import ClientSender, offline_backends, percentile, replay, synthesize_traffic
+from .batching import MicroBatcher, parse_batch_flags
+from .cache import VerdictCache, normalize_for_key
+from .classifier import BUILTIN_LEXICON, Verdict, classify_text, get_lexicon, set_lexicon
+from .compact import CompactModel, export_model, murmurhash3_32
+from .crypto import DECRYPTION_FAILED, decrypt_many, decrypt_message
+from .evaluation import Outcome, flag_metrics, keyword_classifier, llm_cost, register, run, sweep_cascade
+from .fakes import FakeFirestore, encrypt_message, start_fake_openai
+from .inflight import Coalescer
+from .llm import CircuitBreaker, LLMClient, LLMUnavailable
+from .matcher import KeywordMatcher
+from .metrics import COALESCED, VERDICTS, Histogram, Registry
+from .normalize import normalize
+from .pool import ClassifierPool, pack_texts, start_method, unpack_texts
+from .ratelimit import LocalRateLimiter
+from .reclassify import Checkpoint, Reclassifier, get_batch_classifier
+from .startup import profile_startup
+from .streaming import STREAM_PATH, StreamClassifyApp
+from .writebehind import FlagWriter
+
+
+class FakeOpenAIServerMixin:
+    """Runs a local fake OpenAI HTTP server for the duration of each test"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = start_fake_openai()
+        self.base_url = self.server.base_url
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def make_client(self, **kwargs):
+        kwargs.setdefault('breaker', CircuitBreaker(failure_threshold=2, reset_seconds=60))
+        client = LLMClient(api_key='test', base_url=self.base_url, timeout=2,
+                           max_concurrency=4, max_retries=0, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+
+class LLMClientTests(FakeOpenAIServerMixin, SimpleTestCase):
+    def test_classify_parses_reply(self):
+        self.server.reply = "RED"
+        client = self.make_client()
+        self.assertEqual(client.classify("you idiot"), "red")
+        self.assertEqual(self.server.requests[0]["messages"][1]["content"], "Classify: you idiot")
+
+    def test_client_is_reused_across_calls(self):
+        client = self.make_client()
+        client.classify("hi")
+        first = client.client
+        client.classify("hello")
+        self.assertIs(client.client, first)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        self.server.status = 500
+        client = self.make_client()
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                client.classify("hi")
+        self.assertEqual(client.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(LLMUnavailable):
+            client.classify("hi")
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_half_open_trial_closes_circuit(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=10, clock=lambda: now[0])
+        self.server.status = 500
+        client = self.make_client(breaker=breaker)
+        with self.assertRaises(Exception):
+            client.classify("hi")
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        now[0] = 11.0
+        self.server.status = 200
+        self.assertEqual(client.classify("hi"), "green")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_async_classify_runs_concurrently(self):
+        self.server.reply = "YELLOW"
+        client = self.make_client()
+
+        async def run():
+            try:
+                return await asyncio.gather(*(client.aclassify(f"msg {i}") for i in range(8)))
+            finally:
+                await client.aclose()
+
+        self.assertEqual(asyncio.run(run()), ["yellow"] * 8)
+        self.assertEqual(len(self.server.requests), 8)
+
+    def test_async_client_is_closed_with_its_loop(self):
+        # As under gunicorn's sync workers: every async call on a new loop
+        client = self.make_client()
+
+        async def call():
+            self.assertEqual(await client.aclassify("hi"), "green")
+            return client._async_state()[0]
+
+        first, second = asyncio.run(call()), asyncio.run(call())
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed())
+        self.assertTrue(second.is_closed())
+        self.assertEqual(client._aclients, {})
+
+
+class MicroBatcherTests(FakeOpenAIServerMixin, SimpleTestCase):
+    def test_concurrent_requests_share_one_call(self):
+        self.server.reply = "1: RED\n2: GREEN\n3: YELLOW"
+        batcher = MicroBatcher(client=self.make_client(), max_items=3, max_wait=1.0)
+        futures = [batcher.submit(text) for text in ("die", "hi", "prize")]
+        self.assertEqual([f.result(timeout=5) for f in futures], ["red", "green", "yellow"])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_unparseable_reply_falls_back_to_single_calls(self):
+        def reply(body):
+            return "GREEN" if body["messages"][1]["content"].startswith("Classify:") else "no idea"
+
+        self.server.reply = reply
+        batcher = MicroBatcher(client=self.make_client(), max_items=2, max_wait=1.0)
+        results = []
+        threads = [
+            threading.Thread(target=lambda t=text: results.append(batcher.classify(t)))
+            for text in ("a", "b")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["green", "green"])
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_parse_batch_flags_requires_every_item(self):
+        self.assertEqual(parse_batch_flags("2) green\n1. Red", 2), ["red", "green"])
+        with self.assertRaises(Exception):
+            parse_batch_flags("1: RED", 2)
+
+
+class DecryptTests(SimpleTestCase):
+    def test_decrypt_many_matches_decrypt_message(self):
+        ciphertexts = [encrypt_message(text, 'chat') for text in ('hi', 'x' * 100, 'ünïcode ✓', '')]
+        results = decrypt_many('chat', ciphertexts)
+        self.assertEqual([r.text for r in results], [decrypt_message(c, 'chat') for c in ciphertexts])
+        self.assertTrue(all(r.ok for r in results))
+
+    def test_decrypt_many_decodes_base64_like_decrypt_message(self):
+        ciphertext = encrypt_message('x' * 100, 'chat')
+        wrapped = '\n'.join(ciphertext[i:i + 76] for i in range(0, len(ciphertext), 76)) + '\n'
+        self.assertEqual(decrypt_message(wrapped, 'chat'), 'x' * 100)
+        self.assertEqual(decrypt_many('chat', [wrapped]), [('x' * 100, None)])
+
+    def test_decrypt_many_reports_failures(self):
+        results = decrypt_many('chat', ['not base64!', base64.b64encode(b'x' * 20).decode()])
+        self.assertEqual([r.ok for r in results], [False, False])
+        self.assertTrue(all(r.error for r in results))
+        with self.assertLogs('api.crypto', 'WARNING'):
+            self.assertEqual(decrypt_message('not base64!', 'chat'), DECRYPTION_FAILED)
+
+
+@override_settings(CASCADE_KEYWORD_FLAGS=('red', 'yellow'), CASCADE_GREEN_LOW=0.2, CASCADE_GREEN_HIGH=0.8)
+class CascadeTests(SimpleTestCase):
+    SURE = Verdict('green', {'green': 0.95, 'red': 0.03, 'yellow': 0.02}, 'model')
+    UNSURE = Verdict('green', {'green': 0.5, 'red': 0.3, 'yellow': 0.2}, 'model')
+
+    def tiers(self, model, llm):
+        """Patch the model and LLM tiers; model/llm are return values or exceptions"""
+        from . import cascade
+
+        def fake(result):
+            return {'side_effect': result} if isinstance(result, Exception) else {'return_value': result}
+
+        self.model = self.enterContext(mock.patch.object(cascade, 'classify_many', **fake(model)))
+        self.llm = self.enterContext(mock.patch.object(cascade, 'classify_many_with_llm', **fake(llm)))
+
+    def test_keyword_hit_short_circuits(self):
+        from .cascade import classify_cascade_many
+
+        self.tiers([], [])
+        verdicts = classify_cascade_many(["i will kill you", "you won a prize"])
+        self.assertEqual(verdicts, [Verdict('red', None, 'keywords'), Verdict('yellow', None, 'keywords')])
+        self.model.assert_not_called()
+        self.llm.assert_not_called()
+
+    def test_only_uncertain_texts_reach_the_llm(self):
+        from .cascade import classify_cascade_many
+
+        self.tiers([self.UNSURE, self.SURE], ['red'])
+        verdicts = classify_cascade_many(["i will kill you", "meet me later", "see you at lunch"])
+        self.model.assert_called_once_with(["meet me later", "see you at lunch"])
+        self.llm.assert_called_once_with(["meet me later"])
+        self.assertEqual(verdicts[1], Verdict('red', self.UNSURE.scores, 'ai'))
+        self.assertEqual(verdicts[2], self.SURE)
+
+    def test_llm_failure_keeps_a_degraded_model_verdict(self):
+        from .cascade import classify_cascade_many
+
+        self.tiers([self.UNSURE], [None])
+        self.assertEqual(classify_cascade_many(["meet me later"]), [self.UNSURE._replace(degraded=True)])
+
+    def test_model_failure_escalates_to_the_llm(self):
+        from .cascade import CascadeUnavailable, classify_cascade_many
+
+        self.tiers(RuntimeError("model missing"), ['yellow'])
+        self.assertEqual(classify_cascade_many(["meet me later"]), [Verdict('yellow', None, 'ai', degraded=True)])
+        self.llm.assert_called_once_with(["meet me later"])
+
+        # With the LLM down too there is no cascade verdict at all
+        self.llm.return_value = [None]
+        with self.assertRaises(CascadeUnavailable):
+            classify_cascade_many(["meet me later"])
+
+    def test_async_llm_failure_keeps_a_degraded_model_verdict(self):
+        from . import cascade
+
+        self.enterContext(mock.patch.object(cascade, 'aclassify_many', mock.AsyncMock(return_value=[self.UNSURE])))
+        self.enterContext(mock.patch.object(cascade, 'aclassify_with_llm',
+                                            mock.AsyncMock(side_effect=RuntimeError("timeout"))))
+        verdicts = asyncio.run(cascade.aclassify_cascade_many(["meet me later"]))
+        self.assertEqual(verdicts, [self.UNSURE._replace(degraded=True)])
+
+    @override_settings(CLASSIFICATION_METHOD='cascade')
+    def test_degraded_verdicts_are_not_cached(self):
+        from django.core.cache import caches
+        from django.test import Client
+
+        caches['verdicts'].clear()
+        self.tiers([self.UNSURE], [None])
+        with offline_backends():
+            client = Client()
+            responses = [client.post('/classify-text/', {'text': 'meet me later'}, content_type='application/json')
+                         for _ in range(2)]
+            self.assertEqual(responses[0].json()['degraded'], True)
+            self.assertEqual(self.model.call_count, 2)
+
+            # Once the LLM is back its answer is cached
+            self.llm.return_value = ['yellow']
+            for _ in range(2):
+                response = client.post('/classify-text/', {'text': 'meet me later'}, content_type='application/json')
+                self.assertEqual((response.json()['flag'], response.json()['tier']), ('yellow', 'ai'))
+                self.assertNotIn('degraded', response.json())
+            self.assertEqual(self.model.call_count, 3)
+
+
+class ReclassifierTests(SimpleTestCase):
+    def setUp(self):
+        self.db = FakeFirestore()
+        self.db.add_message('chat-a', 'm1', 'hello there')
+        self.db.add_message('chat-a', 'm2', 'I will kill you')
+        self.db.add_message('chat-a', 'm3', 'claim your prize')
+        self.db.add_message('chat-b', 'm1', 'you idiot')
+        self.db.docs[('chats', 'chat-b', 'messages', 'm2')] = {'text': 'not-base64!', 'flag': 'green'}
+
+    def test_rescans_every_chat_and_writes_changed_flags(self):
+        stats = Reclassifier(self.db, get_batch_classifier('keywords'), page_size=2).run()
+        self.assertEqual(stats, {'chats': 2, 'messages': 5, 'updated': 3, 'failed': 1})
+        self.assertEqual(self.db.flag('chat-a', 'm2'), 'red')
+        self.assertEqual(self.db.flag('chat-a', 'm3'), 'yellow')
+        self.assertEqual(self.db.flag('chat-b', 'm1'), 'red')
+        self.assertEqual(self.db.flag('chat-b', 'm2'), 'green')
+
+    def test_resumes_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'checkpoint.json')
+            checkpoint = Checkpoint(path)
+            checkpoint.advance('chat-a', 'm2')
+            checkpoint.finish('chat-b')
+
+            reclassifier = Reclassifier(self.db, get_batch_classifier('keywords'),
+                                        checkpoint=Checkpoint(path))
+            stats = reclassifier.run()
+
+            self.assertEqual(stats['messages'], 1)
+            self.assertEqual(self.db.flag('chat-a', 'm2'), 'green')
+            self.assertEqual(self.db.flag('chat-a', 'm3'), 'yellow')
+            self.assertFalse(os.path.exists(path))
+
+    def test_a_finished_run_leaves_nothing_to_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'checkpoint.json')
+            first = Reclassifier(self.db, get_batch_classifier('keywords'), checkpoint=Checkpoint(path)).run()
+            self.assertEqual(first['chats'], 2)
+            self.assertFalse(os.path.exists(path))
+
+            # The next run, e.g. after a lexicon change, rescans everything
+            self.db.add_message('chat-a', 'm4', 'I will kill you')
+            second = Reclassifier(self.db, get_batch_classifier('keywords'), checkpoint=Checkpoint(path)).run()
+            self.assertEqual(second, {'chats': 2, 'messages': 6, 'updated': 1, 'failed': 1})
+            self.assertEqual(self.db.flag('chat-a', 'm4'), 'red')
+
+    def test_dry_runs_and_subsets_keep_the_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'checkpoint.json')
+            Checkpoint(path).advance('chat-a', 'm2')
+
+            dry = Reclassifier(self.db, get_batch_classifier('keywords'), checkpoint=Checkpoint(path),
+                               dry_run=True).run()
+            self.assertEqual(dry['messages'], 5)
+            self.assertEqual(self.db.flag('chat-a', 'm3'), 'green')
+            self.assertEqual(Checkpoint(path).cursors, {'chat-a': 'm2'})
+
+            Reclassifier(self.db, get_batch_classifier('keywords'), checkpoint=Checkpoint(path)).run(['chat-b'])
+            checkpoint = Checkpoint(path)
+            self.assertEqual((checkpoint.cursors, checkpoint.done), ({'chat-a': 'm2'}, {'chat-b'}))
+
+
+class FailingFirestore(FakeFirestore):
+    """FakeFirestore whose next `failures` commits raise"""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def batch(self):
+        batch = super().batch()
+        commit = batch.commit
+
+        def failing_commit():
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError("unavailable")
+            commit()
+        batch.commit = failing_commit
+        return batch
+
+
+class WriteBehindTests(SimpleTestCase):
+    def writer(self, db, **kwargs):
+        kwargs.setdefault('backoff_seconds', 0.001)
+        writer = FlagWriter(lambda: db, **kwargs)
+        self.addCleanup(writer.close, 1)
+        return writer
+
+    def test_batches_and_keeps_the_newest_flag(self):
+        db = FakeFirestore()
+        writer = self.writer(db, batch_size=3, flush_seconds=0.5)
+        self.assertTrue(writer.enqueue('chat', 'm1', 'yellow'))
+        writer.enqueue('chat', 'm1', 'red')
+        writer.enqueue('chat', 'm2', 'green')
+        writer.enqueue('chat', 'm3', 'green')
+        self.assertTrue(writer.flush(5))
+        self.assertEqual(db.commits, [3])
+        self.assertEqual(db.flag('chat', 'm1'), 'red')
+        self.assertEqual(len(writer), 0)
+
+    def test_retries_a_failed_batch(self):
+        db = FailingFirestore(failures=2)
+        writer = self.writer(db, flush_seconds=0)
+        writer.enqueue('chat', 'm1', 'red')
+        self.assertTrue(writer.flush(5))
+        self.assertEqual(db.commits, [1])
+        self.assertEqual(db.flag('chat', 'm1'), 'red')
+
+    def test_spools_an_update_that_keeps_failing(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            spool = os.path.join(tmp, 'spool.jsonl')
+            db = FailingFirestore(failures=100)
+            writer = self.writer(db, flush_seconds=0, max_attempts=2, spool_path=spool)
+            writer.enqueue('chat', 'm1', 'red')
+            self.assertTrue(writer.flush(5))
+            self.assertEqual(db.docs, {})
+            with open(spool) as f:
+                self.assertEqual([json.loads(line) for line in f], [{'chat': 'chat', 'message': 'm1', 'flag': 'red'}])
+
+            # The next process replays it
+            db = FakeFirestore()
+            writer = self.writer(db, flush_seconds=0, spool_path=spool)
+            self.assertEqual(writer.replay_spool(), 1)
+            self.assertTrue(writer.flush(5))
+            self.assertEqual(db.flag('chat', 'm1'), 'red')
+            self.assertEqual(os.listdir(tmp), [])
+            self.assertEqual(writer.replay_spool(), 0)
+
+    def test_replay_queues_everything_and_picks_up_dead_replays(self):
+        import subprocess
+        import sys
+
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        with tempfile.TemporaryDirectory() as tmp:
+            spool = os.path.join(tmp, 'spool.jsonl')
+
+            def spooled(path, *messages):
+                with open(path, 'w') as f:
+                    f.writelines(json.dumps({'chat': 'chat', 'message': m, 'flag': 'red'}) + '\n' for m in messages)
+
+            spooled(spool, 'm1', 'm2', 'm3')
+            spooled(f'{spool}.{dead.pid}.replay', 'm4')
+            live = f'{spool}.{os.getppid()}.replay'
+            spooled(live, 'm5')
+
+            # Inline writes would fail: replay must queue past max_pending
+            db = FailingFirestore(failures=100)
+            writer = self.writer(db, flush_seconds=0, max_pending=1, backoff_seconds=0.5, spool_path=spool)
+            self.assertEqual(writer.replay_spool(), 4)
+            self.assertEqual(os.listdir(tmp), [os.path.basename(live)])
+            db.failures = 0
+            self.assertTrue(writer.flush(5))
+            self.assertEqual({m: db.flag('chat', m) for m in ('m1', 'm2', 'm3', 'm4')},
+                             dict.fromkeys(('m1', 'm2', 'm3', 'm4'), 'red'))
+
+    def test_spools_what_close_could_not_drain(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            spool = os.path.join(tmp, 'spool.jsonl')
+            db = FailingFirestore(failures=100)
+            # Still backing off after the first failure when close() gives up
+            writer = self.writer(db, flush_seconds=0, backoff_seconds=0.5, spool_path=spool)
+            writer.enqueue('chat', 'm1', 'red')
+            writer.enqueue('chat', 'm2', 'yellow')
+            self.assertEqual(writer.close(0.05), 2)
+            db.failures = 0
+            replayed = self.writer(db, flush_seconds=0, spool_path=spool)
+            self.assertEqual(replayed.replay_spool(), 2)
+            self.assertTrue(replayed.flush(5))
+            self.assertEqual((db.flag('chat', 'm1'), db.flag('chat', 'm2')), ('red', 'yellow'))
+
+    def test_writes_inline_when_full_or_closed(self):
+        db = FakeFirestore()
+        writer = self.writer(db, max_pending=1, flush_seconds=60)
+        self.assertTrue(writer.enqueue('chat', 'm1', 'red'))
+        self.assertFalse(writer.enqueue('chat', 'm2', 'yellow'))
+        self.assertEqual(db.flag('chat', 'm2'), 'yellow')
+        self.assertNotIn(('chats', 'chat', 'messages', 'm1'), db.docs)
+
+        # close() drains what is queued, then later writes go inline
+        self.assertEqual(writer.close(5), 0)
+        self.assertEqual(db.flag('chat', 'm1'), 'red')
+        self.assertFalse(writer.enqueue('chat', 'm3', 'green'))
+        self.assertEqual(db.flag('chat', 'm3'), 'green')
+
+
+class PrepareDataTests(SimpleTestCase):
+    def test_stream_shards_round_trip(self):
+        import numpy as np
+        from django.core.management import call_command
+
+        from .datasets import iter_shards, read_labels, read_manifest
+
+        sms = [('ham', f"see you at {hour} tomorrow") for hour in range(12)] + \
+              [('spam', f"you won prize number {n}, claim now") for n in range(8)]
+        extra = [("I will kill you", 'red'), ("ünïcödé text ✓", 'green'), ("SEE YOU AT 1 TOMORROW", 'green'),
+                 ("", 'green'), ("unknown label", 'blue')]
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'SMSSpamCollection'), 'w', encoding='utf-8') as f:
+                f.writelines(f"{label}\t{text}\n" for label, text in sms)
+            with open(os.path.join(tmp, 'extra.csv'), 'w', encoding='utf-8') as f:
+                f.write("text,label\n" + "".join(f'"{text}",{label}\n' for text, label in extra))
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            self.addCleanup(os.chdir, cwd)
+            call_command('prepare_data', stream=True, output='dataset', extra=['extra.csv'], chunksize=4,
+                         buckets=3, seed=0, stdout=io.StringIO())
+
+            manifest = read_manifest('dataset')
+            # The case-folded duplicate, the empty text and the unknown label are dropped
+            self.assertEqual(manifest['rows'], len(sms) + 2)
+            self.assertEqual(manifest['label_counts'], {'green': 13, 'red': 1, 'yellow': 8})
+            self.assertEqual(len(manifest['shards']), 3)
+
+            rows = []
+            for shard, (texts, labels) in zip(manifest['shards'], iter_shards('dataset')):
+                offsets = np.load(os.path.join('dataset', f"{shard['name']}.offsets.npy"))
+                data = np.load(os.path.join('dataset', f"{shard['name']}.text.npy"))
+                self.assertEqual(len(offsets), shard['rows'] + 1)
+                self.assertEqual((offsets[0], offsets[-1]), (0, len(data)))
+                self.assertEqual(len(texts), shard['rows'])
+                rows += zip(texts, labels.tolist())
+            expected = {(text, {'ham': 'green', 'spam': 'yellow'}[label]) for label, text in sms}
+            expected |= {("i will kill you", 'red'), ("ünïcödé text ✓", 'green')}
+            self.assertEqual(set(rows), expected)
+            self.assertEqual(read_labels('dataset').tolist(), [label for _, label in rows])
+
+
+class CompactModelTests(SimpleTestCase):
+    TRAIN = [
+        ("i will kill you", 'red'), ("you are worthless trash", 'red'),
+        ("send me your password now", 'yellow'), ("click this link to win money", 'yellow'),
+        ("see you at lunch tomorrow", 'green'), ("thanks for the notes", 'green'),
+        ("happy birthday my friend", 'green'), ("call me when you are free", 'green'),
+    ]
+    TEXTS = [
+        "I will KILL you tomorrow", "win money now, click", "lunch with a friend",
+        "", "!!!", "completely unseen words ünïcödé", "thanks thanks thanks",
+    ]
+
+    def assert_parity(self, pipeline):
+        texts, labels = zip(*self.TRAIN)
+        pipeline.fit(list(texts), list(labels))
+        with tempfile.TemporaryDirectory() as tmp:
+            compact = CompactModel(export_model(pipeline, os.path.join(tmp, 'model')))
+            self.assertEqual(list(compact.classes_), list(pipeline.classes_))
+            expected = pipeline.predict_proba(self.TEXTS)
+            actual = compact.predict_proba(self.TEXTS)
+            self.assertEqual(actual.shape, expected.shape)
+            self.assertLess(abs(actual - expected).max(), 1e-5)
+            self.assertEqual(list(compact.predict(self.TEXTS)), list(pipeline.predict(self.TEXTS)))
+
+    def test_tfidf_parity(self):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.naive_bayes import MultinomialNB
+        from sklearn.pipeline import make_pipeline
+
+        self.assert_parity(make_pipeline(TfidfVectorizer(), MultinomialNB()))
+
+    def test_hashing_parity(self):
+        from .training import make_hashing_pipeline
+
+        self.assert_parity(make_hashing_pipeline(n_features=2 ** 10))
+
+    def test_export_swaps_a_link_to_the_new_version(self):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.naive_bayes import MultinomialNB
+        from sklearn.pipeline import make_pipeline
+
+        texts, labels = zip(*self.TRAIN)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model')
+            os.makedirs(path)  # an export from before versioned directories
+            first = make_pipeline(TfidfVectorizer(), MultinomialNB()).fit(texts, labels)
+            export_model(first, path)
+            before = CompactModel(path)
+            for _ in range(2):
+                second = make_pipeline(TfidfVectorizer(), MultinomialNB()).fit(texts[2:], labels[2:])
+                export_model(second, path)
+
+            self.assertTrue(os.path.islink(path))
+            self.assertEqual(len(os.listdir(tmp)), 3)  # the link, the current and the previous version
+            self.assertEqual(list(CompactModel(path).classes_), ['green', 'yellow'])
+            self.assertEqual(list(before.classes_), ['green', 'red', 'yellow'])
+
+    def test_murmurhash_matches_sklearn(self):
+        from sklearn.utils import murmurhash3_32 as sklearn_murmurhash3_32
+
+        for token in ['', 'a', 'ab', 'abc', 'abcd', 'hello', 'ünïcödé', 'x' * 37]:
+            self.assertEqual(murmurhash3_32(token.encode('utf-8')), sklearn_murmurhash3_32(token, 0))
+
+
+def save_model(path, labels=None):
+    """Fit a small TF-IDF + NB pipeline on CompactModelTests.TRAIN, dump it to path and return it"""
+    import joblib
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.pipeline import make_pipeline
+
+    texts, train_labels = zip(*CompactModelTests.TRAIN)
+    pipeline = make_pipeline(TfidfVectorizer(), MultinomialNB()).fit(list(texts), list(labels or train_labels))
+    joblib.dump(pipeline, path)
+    return pipeline
+
+
+class IncrementalTrainingTests(SimpleTestCase):
+    def test_batches_match_one_fit(self):
+        from .training import make_hashing_pipeline, train_incremental
+
+        texts, labels = map(list, zip(*CompactModelTests.TRAIN))
+        full = make_hashing_pipeline(n_features=2 ** 10).fit(texts, labels)
+        batches = [(texts[i:i + 3], labels[i:i + 3]) for i in range(0, len(texts), 3)]
+        model, rows = train_incremental(batches, n_features=2 ** 10, n_jobs=1)
+        self.assertEqual(rows, len(texts))
+        self.assertEqual(list(model.classes_), list(full.classes_))
+        self.assertLess(abs(model.predict_proba(CompactModelTests.TEXTS)
+                            - full.predict_proba(CompactModelTests.TEXTS)).max(), 1e-9)
+
+        # Warm-starting on the rest continues where the first batches stopped
+        first, _ = train_incremental(batches[:1], n_features=2 ** 10, n_jobs=1)
+        resumed, _ = train_incremental(batches[1:], model=first, n_jobs=1)
+        self.assertLess(abs(resumed.predict_proba(CompactModelTests.TEXTS)
+                            - full.predict_proba(CompactModelTests.TEXTS)).max(), 1e-9)
+
+
+class ClassifierEngineTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.pipeline = save_model(os.path.join(self.tmp, 'model.joblib'))
+
+    def test_matches_the_pipeline(self):
+        from .engine import ClassifierEngine
+
+        engine = ClassifierEngine(os.path.join(self.tmp, 'model.joblib'))
+        self.assertFalse(engine.loaded)
+        texts = CompactModelTests.TEXTS
+        verdicts = engine.classify_many(texts)
+        self.assertTrue(engine.loaded)
+
+        # The model sees normalized text, as in training
+        normalized = [normalize(text).text for text in texts]
+        classes = [str(label) for label in self.pipeline.classes_]
+        self.assertEqual([verdict.flag for verdict in verdicts], list(self.pipeline.predict(normalized)))
+        for verdict, row in zip(verdicts, self.pipeline.predict_proba(normalized)):
+            self.assertEqual(verdict.tier, 'model')
+            self.assertEqual(list(verdict.scores), classes)
+            for label, probability in zip(classes, row):
+                self.assertAlmostEqual(verdict.scores[label], probability)
+            # The flag is the most probable class; there is no other cut-off
+            self.assertEqual(verdict.scores[verdict.flag], max(verdict.scores.values()))
+        self.assertEqual(engine.classify(texts[0]), verdicts[0])
+        self.assertEqual(engine.classify_many([]), [])
+
+    @override_settings(CLASSIFICATION_METHOD='model')
+    def test_missing_model(self):
+        from django.test import Client
+
+        from . import engine as engine_module
+        from .engine import ClassifierEngine
+
+        engine = ClassifierEngine(os.path.join(self.tmp, 'missing.joblib'))
+        self.assertEqual(engine.version, 'missing')
+        with self.assertRaises(FileNotFoundError):
+            engine.load()
+        self.assertFalse(engine.loaded)
+
+        # /classify-text/ falls back to keywords
+        with offline_backends(), mock.patch.object(engine_module, '_engine', engine):
+            response = Client().post('/classify-text/', {'text': 'i will kill you'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['flag'], response.json()['tier']), ('red', 'keywords'))
+
+
+class ClassifyBatchTests(SimpleTestCase):
+    def setUp(self):
+        from django.core.cache import caches
+
+        from . import engine as engine_module
+        from .engine import ClassifierEngine
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.engine = ClassifierEngine(os.path.join(tmp.name, 'model.joblib'))
+        save_model(self.engine.model_path)
+        self.enterContext(mock.patch.object(engine_module, '_engine', self.engine))
+        caches['verdicts'].clear()
+        self.enterContext(offline_backends())
+
+    def post(self, body):
+        from django.test import Client
+
+        return Client().post('/classify-batch/', body, content_type='application/json')
+
+    # An empty uncertainty band: the model answers whatever the keywords don't
+    @override_settings(CLASSIFICATION_METHOD='cascade', CASCADE_GREEN_LOW=0.0, CASCADE_GREEN_HIGH=0.0)
+    def test_results_keep_input_order(self):
+        texts = ["see you at lunch tomorrow", "i will kill you", "click this link to win money",
+                 "thanks for the notes", "you won a prize"]
+        response = self.post({'texts': texts})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['count'], len(texts))
+        self.assertEqual([result['index'] for result in body['results']], list(range(len(texts))))
+        self.assertEqual([result['tier'] for result in body['results']],
+                         ['model', 'keywords', 'keywords', 'model', 'keywords'])
+        self.assertEqual(body['results'][1]['flag'], 'red')
+        self.assertEqual(body['results'][2]['flag'], 'yellow')
+        for i in (0, 3):
+            expected = self.engine.classify(texts[i])
+            self.assertEqual(body['results'][i]['flag'], expected.flag)
+            self.assertEqual(body['results'][i]['scores'], expected.scores)
+
+    @override_settings(CLASSIFICATION_METHOD='model', CLASSIFY_BATCH_MAX_ITEMS=2)
+    def test_batch_size_limit(self):
+        self.assertEqual(self.post({'texts': ['a', 'b']}).status_code, 200)
+        response = self.post({'texts': ['a', 'b', 'c']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], "Too many texts (max 2)")
+
+    @override_settings(CLASSIFICATION_METHOD='model')
+    def test_invalid_payloads(self):
+        for body in ({}, {'texts': []}, {'texts': 'hello'}, {'texts': ['hello', 3]}, {'texts': None},
+                     ['hello'], 'hello', 3):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+
+    @override_settings(CLASSIFICATION_METHOD='ai')
+    def test_ai_batch_calls_the_llm_once_for_the_misses(self):
+        texts = ["see you at lunch tomorrow", "thanks for the notes"]
+        with mock.patch('api.views.classify_many_with_llm', return_value=['yellow', None]) as llm:
+            body = self.post({'texts': texts}).json()
+        llm.assert_called_once_with(texts)
+        self.assertEqual([(result['flag'], result['tier']) for result in body['results']],
+                         [('yellow', 'ai'), (classify_text(texts[1]), 'keywords')])
+        self.assertTrue(body['results'][1]['degraded'])
+
+        # Only the AI's answer was cached; the fallback is asked again
+        with mock.patch('api.views.classify_many_with_llm', return_value=['red']) as llm:
+            body = self.post({'texts': texts}).json()
+        llm.assert_called_once_with(texts[1:])
+        self.assertEqual([result['flag'] for result in body['results']], ['yellow', 'red'])
+
+    @override_settings(CLASSIFICATION_METHOD='keywords', CLIENT_RATE_LIMIT_PER_SECOND=0.001,
+                       CLIENT_RATE_LIMIT_BURST=5)
+    def test_batch_takes_a_token_per_text(self):
+        from . import ratelimit
+
+        with mock.patch.object(ratelimit, '_limiter', LocalRateLimiter()):
+            self.assertEqual(self.post({'texts': ['a', 'b', 'c']}).status_code, 200)
+            self.assertEqual(self.post({'texts': ['a', 'b', 'c']}).status_code, 429)
+            self.assertEqual(self.post({'texts': ['a', 'b']}).status_code, 200)
+
+
+class ClassifierPoolTests(SimpleTestCase):
+    def test_pack_texts_round_trip(self):
+        texts = ['hello', '', 'ünïcödé ✓', 'x' * 1000]
+        block = pack_texts(texts)
+        try:
+            self.assertEqual(unpack_texts(block.buf, len(texts), 0, len(texts)), texts)
+            self.assertEqual(unpack_texts(block.buf, len(texts), 1, 3), texts[1:3])
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_forks_only_while_single_threaded(self):
+        with mock.patch('threading.active_count', return_value=1):
+            self.assertEqual(start_method(), 'fork')
+        with mock.patch('threading.active_count', return_value=3):
+            self.assertEqual(start_method(), 'forkserver')
+
+    def test_pool_matches_in_process_scoring(self):
+        import joblib
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.naive_bayes import MultinomialNB
+        from sklearn.pipeline import make_pipeline
+
+        from .engine import ClassifierEngine
+
+        texts, labels = zip(*CompactModelTests.TRAIN)
+        pipeline = make_pipeline(TfidfVectorizer(), MultinomialNB()).fit(list(texts), list(labels))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.joblib')
+            joblib.dump(pipeline, path)
+            engine = ClassifierEngine(path)
+            pool = ClassifierPool(engine, workers=2, min_batch=0, chunk_size=3)
+            self.addCleanup(pool.close)
+            batch = CompactModelTests.TEXTS * 3
+            self.assertEqual(pool.classify_many(batch), engine.classify_many(batch))
+            self.assertEqual(pool.classify_many([]), [])
+
+            # A swapped-in model gets new children; a request pinned to the
+            # old one is still scored with it
+            swapped = os.path.join(tmp, 'swapped.joblib')
+            joblib.dump(make_pipeline(TfidfVectorizer(), MultinomialNB()).fit(list(texts), list(reversed(labels))),
+                        swapped)
+            new_engine = ClassifierEngine(swapped, 'v2')
+            # Swapped from another thread, as the artifact watcher does, so
+            # the new children must not be forked
+            watcher = threading.Thread(target=pool.swap, args=(new_engine,))
+            watcher.start()
+            watcher.join()
+            self.assertEqual(pool._executor._mp_context.get_start_method(), 'forkserver')
+            self.assertIs(pool.engine, new_engine)
+            self.assertEqual(pool.classify_many(batch), new_engine.classify_many(batch))
+            self.assertEqual(pool.classify_many(batch, engine), engine.classify_many(batch))
+            pool.close()
+
+
+class ArtifactTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(set_lexicon, BUILTIN_LEXICON)
+        self.registry = ArtifactRegistry(directory.name)
+        self.watcher = ArtifactWatcher(self.registry, interval=60)
+        lexicon = os.path.join(directory.name, 'bananas.json')
+        with open(lexicon, 'w') as f:
+            json.dump({'red': ['banana'], 'yellow': ['apple']}, f)
+        self.registry.publish_lexicon(lexicon, 'v1')
+
+    def test_activated_lexicon_is_swapped_in(self):
+        self.assertFalse(self.watcher.check())
+        self.assertEqual(classify_text("a banana"), 'green')
+        self.registry.activate(lexicon='v1')
+        self.assertTrue(self.watcher.check())
+        self.assertEqual(classify_text("a banana"), 'red')
+        self.assertEqual(active_versions()['lexicon'], 'v1')
+        self.assertFalse(self.watcher.check())
+
+        self.registry.activate(lexicon=None)
+        self.watcher.check()
+        self.assertIs(get_lexicon(), BUILTIN_LEXICON)
+
+    def test_pinned_request_keeps_its_lexicon(self):
+        with pinned():
+            self.registry.activate(lexicon='v1')
+            self.watcher.check()
+            self.assertEqual(classify_text("a banana"), 'green')
+        self.assertEqual(classify_text("a banana"), 'red')
+
+    def test_bad_version_keeps_the_current_one(self):
+        with open(self.registry.lexicon_path('v1').with_name('broken.json'), 'w') as f:
+            f.write('{"red": [')
+        with open(self.registry.active_path, 'w') as f:
+            json.dump({'lexicon': 'broken'}, f)
+        self.watcher.check()
+        self.assertIs(get_lexicon(), BUILTIN_LEXICON)
+        self.assertIn('lexicon', self.watcher.error)
+        with self.assertRaises(FileExistsError):
+            self.registry.publish_lexicon(self.registry.lexicon_path('v1'), 'v1')
+        with self.assertRaises(ValueError):
+            self.registry.activate(lexicon='../v1')
+
+    @override_settings(CLASSIFICATION_METHOD='keywords')
+    def test_versions_in_responses(self):
+        from django.test import Client
+
+        self.registry.activate(lexicon='v1')
+        self.watcher.check()
+        with offline_backends():
+            client = Client()
+            response = client.post('/classify-text/', {'text': 'a banana'}, content_type='application/json')
+            health = client.get('/').json()
+        self.assertEqual(response.json()['flag'], 'red')
+        self.assertEqual(response.json()['versions'], {'lexicon': 'v1', 'model': 'builtin'})
+        self.assertEqual(health['versions']['lexicon'], 'v1')
+        self.assertEqual(health['lexicon_version'], get_lexicon().version)
+
+
+class StartupTests(SimpleTestCase):
+    def test_heavy_stacks_are_imported_lazily(self):
+        # Firebase/grpc, OpenAI/httpx and the ML stack load on first use only
+        profile = profile_startup()
+        self.assertIn('api.views', profile.modules)
+        self.assertEqual(profile.eager, [])
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_percentile_interpolates(self):
+        values = [1.0, 2.0, 3.0, 4.0]
+        self.assertEqual(percentile(values, 50), 2.5)
+        self.assertEqual(percentile(values, 100), 4.0)
+        self.assertAlmostEqual(percentile(values, 99), 3.97)
+        self.assertIsNone(percentile([], 50))
+
+    @override_settings(CLASSIFICATION_METHOD='ai')
+    def test_replay_offline(self):
+        texts = ["i will kill you", "see you tomorrow", "send me your password"]
+        traffic = synthesize_traffic(texts, 12, batch_size=2, seed=1)
+        with offline_backends() as (server, db):
+            summary = replay(ClientSender(), traffic, concurrency=3)
+        self.assertEqual(summary['all']['requests'], 12)
+        self.assertEqual(summary['all']['errors'], 0)
+        self.assertLessEqual(summary['all']['p50_ms'], summary['all']['p99_ms'])
+        self.assertTrue(server.requests)
+        legacy = [r for r in traffic if r['path'] == '/classify/']
+        self.assertEqual(len(db.docs), len(legacy))
+
+
+class EvaluationTests(SimpleTestCase):
+    def test_flag_metrics(self):
+        labels = ['red', 'red', 'yellow', 'green']
+        metrics = flag_metrics(labels, ['red', 'green', 'yellow', None])
+        self.assertEqual(metrics['accuracy'], 0.5)
+        self.assertEqual(metrics['red'], {'precision': 1.0, 'recall': 0.5, 'f1': 0.6667, 'support': 2})
+        self.assertEqual(metrics['green']['precision'], 0.0)
+
+    def test_run_keeps_order_across_processes(self):
+        texts = ["i will kill you", "see you tomorrow", "claim your prize"] * 5
+        register('test-keywords', keyword_classifier(KeywordMatcher(["kill"], ["prize"])))
+        for method in ('fork', 'forkserver'):
+            with self.subTest(method=method), mock.patch('api.pool.start_method', return_value=method):
+                outcomes, elapsed = run('test-keywords', texts, workers=2)
+                self.assertEqual([o.flag for o in outcomes], ['red', 'green', 'yellow'] * 5)
+                self.assertTrue(all(o.seconds >= 0 for o in outcomes))
+
+    def test_sweep_replays_the_cascade(self):
+        texts = ["a", "b", "c"]
+        labels = ['red', 'yellow', 'green']
+        model = [Outcome('green', 0, 0.9), Outcome('green', 0, 0.5), Outcome('green', 0, 0.95)]
+        rows = sweep_cascade(texts, labels, ['red', 'green', 'green'], model, ['red', 'yellow', 'red'],
+                             lows=[0.2], highs=[0.6, 1.01], keyword_hit_flags=('red',))
+        by_high = {row['green_high']: row for row in rows}
+        # Only "b" is uncertain below 0.6; below 1.01 "c" is too, and the LLM gets it wrong
+        self.assertEqual(by_high[0.6]['accuracy'], 1.0)
+        self.assertEqual(by_high[0.6]['escalated'], round(1 / 3, 4))
+        self.assertEqual(by_high[1.01]['accuracy'], round(2 / 3, 4))
+        self.assertAlmostEqual(by_high[1.01]['llm_cost_per_1k_usd'], round(llm_cost(["b", "c"]) * 1000 / 3, 6))
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = Registry()
+        histogram = registry.register(Histogram('demo_seconds', 'Demo.', ('stage',), buckets=(0.01, 0.1)))
+        for value in (0.005, 0.05, 0.05, 5.0):
+            histogram.observe(value, stage='model')
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE demo_seconds histogram', lines)
+        worker = f'worker="{os.getpid()}"'
+        self.assertIn(f'demo_seconds_bucket{{{worker},stage="model",le="0.01"}} 1', lines)
+        self.assertIn(f'demo_seconds_bucket{{{worker},stage="model",le="0.1"}} 3', lines)
+        self.assertIn(f'demo_seconds_bucket{{{worker},stage="model",le="+Inf"}} 4', lines)
+        self.assertIn(f'demo_seconds_count{{{worker},stage="model"}} 4', lines)
+
+    @override_settings(CLASSIFICATION_METHOD='keywords', METRICS_TOKEN='secret')
+    def test_metrics_endpoint(self):
+        from django.test import Client
+
+        before = VERDICTS.value(method='keywords', flag='red', tier='keywords')
+        with offline_backends():
+            client = Client()
+            client.post('/classify-text/', {'text': 'i will kill you'}, content_type='application/json')
+            self.assertEqual(client.get('/metrics').status_code, 401)
+            response = client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(VERDICTS.value(method='keywords', flag='red', tier='keywords'), before + 1)
+        body = response.content.decode()
+        self.assertIn('classifier_stage_seconds_count{worker=', body)
+        self.assertIn('stage="keywords"', body)
+        self.assertIn('endpoint="classify-text",method="keywords",status="200"', body)
+
+
+class VerdictCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = VerdictCache()
+        self.cache.backend.clear()
+        self.verdict = Verdict('red', None, 'keywords')
+
+    def test_miss_then_hit(self):
+        self.assertIsNone(self.cache.get('i will kill you', 'keywords', 'v1'))
+        self.cache.set('i will kill you', 'keywords', 'v1', self.verdict)
+        self.assertEqual(self.cache.get('i will kill you', 'keywords', 'v1'), self.verdict)
+        self.assertEqual(self.cache.get_many(['other', 'i will kill you'], 'keywords', 'v1'), {1: self.verdict})
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 2))
+
+    def test_key_covers_method_and_version(self):
+        self.cache.set('i will kill you', 'keywords', 'v1', self.verdict)
+        self.assertIsNone(self.cache.get('i will kill you', 'model', 'v1'))
+        self.assertIsNone(self.cache.get('i will kill you', 'keywords', 'v2'))
+        keys = {self.cache.key('text', method, version) for method in ('keywords', 'model') for version in ('v1', 'v2')}
+        self.assertEqual(len(keys), 4)
+
+    def test_normalized_texts_share_an_entry(self):
+        self.cache.set('I will KILL you', 'keywords', 'v1', self.verdict)
+        self.assertEqual(self.cache.get('  i will\tkill   YOU ', 'keywords', 'v1'), self.verdict)
+        self.assertEqual(self.cache.key('Ｉ will kill you', 'keywords', 'v1'),
+                         self.cache.key('i will kill you', 'keywords', 'v1'))
+
+
+class NormalizeTests(SimpleTestCase):
+    def test_obfuscated_terms_match(self):
+        matcher = KeywordMatcher(['kill you', 'fuck'], ['claim'], subword_terms=['fuck'])
+        for text in ('K1ll y0u!!', 'k i l l you', 'kіll you', 'ｋｉｌｌ  you', 'k\u200bill you', 'kïll you',
+                     'f.u.c.k off', 'motherfucker'):
+            self.assertEqual(matcher.classify(text), 'red', text)
+        self.assertEqual(matcher.classify('cl@im your pr1ze'), 'yellow')
+
+    def test_terms_match_at_word_start(self):
+        matcher = KeywordMatcher(['kill'], ['won'], whole_word_terms=['won'])
+        self.assertEqual(matcher.classify('he killed it'), 'red')
+        self.assertEqual(matcher.classify('great skills'), 'green')
+        self.assertEqual(matcher.classify('a wonderful day'), 'green')
+        self.assertEqual(matcher.classify('you won!'), 'yellow')
+
+    def test_contractions_stay_one_word(self):
+        self.assertEqual(normalize("I won't go, don’t worry").keywords, ' i wont go dont worry ')
+        self.assertEqual(classify_text("I won't go"), 'green')
+        self.assertEqual(classify_text("you won’t believe it"), 'green')
+        self.assertEqual(classify_text("'you won' he said"), 'yellow')
+        self.assertEqual(classify_text("I'll kill you"), 'red')
+
+    def test_normalize_keeps_numbers_and_folds_text(self):
+        normalized = normalize('Call\u00a0911   NOW\u200b!')
+        self.assertEqual(normalized.text, 'call 911 now!')
+        self.assertEqual(normalized.keywords, ' call 911 now ')
+        self.assertEqual(normalize_for_key(' Call 911 NOW! '), normalize_for_key('call 911 now!'))
+
+
+class KeywordMatcherTests(SimpleTestCase):
+    def test_overlapping_terms_are_all_found(self):
+        matcher = KeywordMatcher(['kill', 'kill you', 'you idiot'], ['you'])
+        found = matcher.match('I will kill you idiot', stop_on_red=False)
+        self.assertEqual(found.flag, 'red')
+        self.assertEqual(set(found.red), {'kill', 'kill you', 'you idiot'})
+        self.assertEqual(found.yellow, ('you',))
+
+    def test_red_outranks_yellow(self):
+        matcher = KeywordMatcher(['hate you'], ['prize', 'claim'])
+        self.assertEqual(matcher.classify('claim your prize'), 'yellow')
+        self.assertEqual(matcher.classify('claim your prize, I hate you'), 'red')
+        self.assertEqual(matcher.classify('I hate you, claim your prize'), 'red')
+        # A term listed as both keeps its first (red) severity
+        self.assertEqual(KeywordMatcher(['spam'], ['spam']).classify('spam'), 'red')
+        self.assertEqual(matcher.classify('see you soon'), 'green')
+
+    def test_word_boundaries(self):
+        matcher = KeywordMatcher(['kill', 'shit', 'hack'], ['won'], subword_terms=['shit'], whole_word_terms=['won'])
+        # Terms match at the start of a word, so inflections are caught...
+        self.assertEqual(matcher.classify('he was killed'), 'red')
+        self.assertEqual(matcher.classify('skill issue'), 'green')
+        # ...and so are longer words that start with one. This is intended:
+        # the lexicon trades these for catching "killing", "hacked", etc.
+        self.assertEqual(matcher.classify('hackathon'), 'red')
+        self.assertEqual(matcher.classify('killer whale'), 'red')
+        # Subword terms also match inside a word, whole-word terms only alone
+        self.assertEqual(matcher.classify('bullshit'), 'red')
+        self.assertEqual(matcher.classify('you won'), 'yellow')
+        self.assertEqual(matcher.classify('wonderful work'), 'green')
+        self.assertEqual(matcher.classify('I won, again'), 'yellow')
+
+
+class KeywordStreamTests(SimpleTestCase):
+    def test_chunked_feed_matches_whole_text(self):
+        matcher = KeywordMatcher(['kill you'], ['click this link', 'verify'])
+        text = 'Please click this link to verify, or I will kill you'
+        for size in (1, 3, 7, len(text)):
+            stream = matcher.stream()
+            for i in range(0, len(text), size):
+                stream.feed(text[i:i + size], final=i + size >= len(text))
+            self.assertEqual(stream.result(), matcher.match(text))
+
+    def test_feed_reports_flag_as_terms_complete(self):
+        stream = KeywordMatcher(['kill you'], ['verify']).stream()
+        self.assertEqual(stream.feed('please ver'), 'green')
+        self.assertEqual(stream.feed('ify, I will ki'), 'yellow')
+        # "you" could still grow into "young" until the body ends
+        self.assertEqual(stream.feed('ll you'), 'yellow')
+        self.assertEqual(stream.feed('', final=True), 'red')
+
+
+@override_settings(CLASSIFICATION_METHOD='keywords')
+class StreamClassifyTests(SimpleTestCase):
+    def stream(self, chunks, path=STREAM_PATH, method='POST'):
+        """Run the ASGI app on a chunked body; returns (status, lines, chunks read)"""
+        messages = [{'type': 'http.request', 'body': chunk.encode(), 'more_body': i < len(chunks) - 1}
+                    for i, chunk in enumerate(chunks)]
+        read = []
+        sent = []
+
+        async def receive():
+            read.append(messages[len(read)])
+            return read[-1]
+
+        async def send(message):
+            sent.append(message)
+
+        async def inner(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 404, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        scope = {'type': 'http', 'path': path, 'method': method, 'headers': [], 'client': ('10.0.0.1', 50000)}
+        asyncio.run(StreamClassifyApp(inner)(scope, receive, send))
+        body = b''.join(m.get('body', b'') for m in sent if m['type'] == 'http.response.body')
+        lines = [json.loads(line) for line in body.splitlines()]
+        return sent[0]['status'], lines, len(read)
+
+    def test_red_term_ends_stream_early(self):
+        status, lines, read = self.stream(['please click th', 'is link, I will ki', 'll you', ' and more', ' text'])
+        self.assertEqual(status, 200)
+        self.assertEqual([(line['flag'], line['final']) for line in lines], [('yellow', False), ('red', True)])
+        self.assertEqual(read, 3)
+
+    def test_final_verdict_after_body_ends(self):
+        status, lines, read = self.stream(['hello ', 'there'])
+        self.assertEqual(status, 200)
+        self.assertEqual(lines, [{'event': 'verdict', 'final': True, 'length': 11, 'flag': 'green', 'tier': 'keywords',
+                                  'versions': {'lexicon': 'builtin', 'model': 'builtin'}}])
+
+    def test_empty_body_is_rejected(self):
+        status, lines, read = self.stream([''])
+        self.assertEqual(status, 400)
+        self.assertEqual(lines[0]['error'], 'Missing text')
+
+    @override_settings(CLIENT_RATE_LIMIT_PER_SECOND=0.001, CLIENT_RATE_LIMIT_BURST=3)
+    def test_client_limit_takes_a_token_per_line(self):
+        from . import ratelimit
+
+        with mock.patch.object(ratelimit, '_limiter', LocalRateLimiter()):
+            self.assertEqual(self.stream(['hello'])[0], 200)
+            # One token for the stream, one for the interim yellow line
+            status, lines, read = self.stream(['claim your prize, ', 'thanks'])
+            self.assertEqual((status, len(lines)), (200, 2))
+            self.assertEqual(self.stream(['hello'])[:2], (429, [{'error': 'Too many requests'}]))
+
+    def test_other_paths_reach_django(self):
+        self.assertEqual(self.stream([''], path='/classify-text/')[0], 404)
+        self.assertEqual(self.stream([''], method='GET')[0], 405)
+
+
+class RateLimitTests(SimpleTestCase):
+    def test_token_bucket_refills(self):
+        limiter = LocalRateLimiter()
+        with mock.patch('api.ratelimit.time.monotonic', return_value=100.0) as monotonic:
+            self.assertEqual(limiter.allow('chat:a', 1, 2), (True, 0.0))
+            self.assertEqual(limiter.allow('chat:a', 1, 2), (True, 0.0))
+            self.assertEqual(limiter.allow('chat:a', 1, 2), (False, 1.0))
+            self.assertTrue(limiter.allow('chat:b', 1, 2)[0])
+            monotonic.return_value = 100.5
+            self.assertEqual(limiter.allow('chat:a', 1, 2), (False, 0.5))
+            monotonic.return_value = 101.5
+            self.assertTrue(limiter.allow('chat:a', 1, 2)[0])
+
+    def test_cost_takes_several_tokens(self):
+        limiter = LocalRateLimiter()
+        with mock.patch('api.ratelimit.time.monotonic', return_value=100.0):
+            self.assertEqual(limiter.allow('client:a', 1, 5, cost=3), (True, 0.0))
+            self.assertEqual(limiter.allow('client:a', 1, 5, cost=3), (False, 1.0))
+            self.assertEqual(limiter.allow('client:a', 1, 5, cost=2), (True, 0.0))
+
+    @override_settings(CHAT_RATE_LIMIT_PER_SECOND=0.001, CHAT_RATE_LIMIT_BURST=2)
+    def test_classify_returns_429_per_chat(self):
+        from django.test import Client
+
+        with offline_backends():
+            client = Client()
+
+            def post(chat_id, message_id):
+                body = {'chatId': chat_id, 'messageId': message_id, 'encryptedText': 'abc'}
+                return client.post('/classify/', body, content_type='application/json')
+
+            statuses = [post('ratelimit-chat', f'm{i}').status_code for i in range(3)]
+            other = post('ratelimit-other-chat', 'm0')
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(other.status_code, 200)
+
+
+class CoalescerTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_run(self):
+        coalescer = Coalescer('test-threads')
+        release = threading.Event()
+        calls = []
+
+        def work():
+            calls.append(1)
+            release.wait(5)
+            return 'red'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(coalescer.run('key', work))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # Release the leader once the other four are waiting on it
+        for _ in range(500):
+            if COALESCED.value(name='test-threads') == 4:
+                break
+            release.wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['red'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(coalescer), 0)
+
+    def test_async_calls_share_one_run(self):
+        coalescer = Coalescer('test')
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'yellow'
+
+        async def main():
+            return await asyncio.gather(*(coalescer.arun('key', work) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(main()), ['yellow'] * 5)
+        self.assertEqual(len(calls), 1)
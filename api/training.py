@@ -0,0 +1,76 @@
+# api/training.py
+# Out-of-core training for the hashing-vectorizer + MultinomialNB model.
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import make_pipeline
+
+from .datasets import LABELS
+
+DEFAULT_N_FEATURES = 2 ** 16
+
+
+def make_hashing_pipeline(n_features=DEFAULT_N_FEATURES, alpha=0.1):
+    """
+    Fixed-width replacement for TfidfVectorizer: no vocabulary is learned or
+    pickled, so model size doesn't grow with the corpus. Features are raw,
+    non-negative term counts (alternate_sign=False, no norm), which is what
+    MultinomialNB models. On a held-out shard of our data this scored
+    better than the TF-IDF pipeline.
+    """
+    return make_pipeline(
+        HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None),
+        MultinomialNB(alpha=alpha),
+    )
+
+
+def count_batch(vectorizer, texts, labels):
+    """
+    MultinomialNB's sufficient statistics for one mini-batch: per-class
+    feature sums (n_classes x n_features) and per-class sample counts.
+    These are additive, so batches can be counted in parallel and summed.
+    """
+    X = vectorizer.transform(texts)
+    y = np.searchsorted(LABELS, np.asarray(labels))
+    Y = sp.csr_matrix((np.ones(len(y)), (y, np.arange(len(y)))), shape=(len(LABELS), len(y)))
+    return (Y @ X).toarray(), np.bincount(y, minlength=len(LABELS))
+
+
+def train_incremental(batches, model=None, n_features=DEFAULT_N_FEATURES, n_jobs=-1):
+    """
+    Train (or warm-start) a hashing pipeline from an iterable of
+    (texts, labels) mini-batches without holding the corpus in memory.
+
+    Batches are counted on n_jobs cores with joblib. The summed counts are
+    then folded into the model through MultinomialNB.partial_fit: each class
+    is passed as a single row of its mean feature vector, weighted by its
+    sample count, which adds exactly the batch's counts to the model's.
+    Passing an existing model continues training it from where it stopped.
+    """
+    from joblib import Parallel, delayed
+
+    model = model or make_hashing_pipeline(n_features)
+    vectorizer, nb = model.steps[0][1], model.steps[-1][1]
+    if not isinstance(vectorizer, HashingVectorizer):
+        raise ValueError("Incremental training needs a HashingVectorizer model")
+
+    feature_counts = np.zeros((len(LABELS), vectorizer.n_features))
+    class_counts = np.zeros(len(LABELS), dtype=np.int64)
+    results = Parallel(n_jobs=n_jobs, return_as='generator')(
+        delayed(count_batch)(vectorizer, texts, labels) for texts, labels in batches
+    )
+    for batch_features, batch_classes in results:
+        feature_counts += batch_features
+        class_counts += batch_classes
+
+    present = class_counts > 0
+    if not present.any():
+        raise ValueError("No training data")
+    nb.partial_fit(
+        feature_counts[present] / class_counts[present, None],
+        np.asarray(LABELS)[present],
+        classes=np.asarray(LABELS),
+        sample_weight=class_counts[present],
+    )
+    return model, int(class_counts.sum())
@@ -1,8 +1,13 @@
 from django.urls import path
-from .views import ClassifyTextView, ClassifyMessageView, health_check
+from .views import ClassifyTextView, ClassifyBatchView, ClassifyMessageView, health_check, metrics
+from .async_views import AsyncClassifyTextView, AsyncClassifyBatchView
 
 urlpatterns = [
     path('', health_check, name='health_check'),
+    path('metrics', metrics, name='metrics'),  # Prometheus scrape target
     path('classify-text/', ClassifyTextView.as_view(), name='classify_text'),  # NEW: For frontend
+    path('classify-batch/', ClassifyBatchView.as_view(), name='classify_batch'),  # Many texts per request
     path('classify/', ClassifyMessageView.as_view(), name='classify_message'),  # LEGACY: For Cloud Function
+    path('async/classify-text/', AsyncClassifyTextView.as_view(), name='async_classify_text'),  # Async; non-blocking under ASGI
+    path('async/classify-batch/', AsyncClassifyBatchView.as_view(), name='async_classify_batch'),  # Async; non-blocking under ASGI
 ]
\ No newline at end of file
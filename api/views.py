@@ -1,30 +1,156 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from firebase_admin import firestore
+from django.conf import settings
+from .artifacts import active_versions, get_watcher
+from .engine import classify_many, get_engine
+from .classifier import classify_text, get_lexicon, Verdict
+from .cascade import cascade_version, classify_cascade, classify_cascade_many
+from .cache import verdict_cache
+from .llm import AI_VERSION, get_llm_client
+from .batching import classify_many_with_llm, classify_with_llm
+from .inflight import message_calls, verdict_calls
+from .metrics import CONTENT_TYPE, FALLBACKS, count_verdicts, instrumented, registry, stage
+from .ratelimit import client_address, throttle
+from .writebehind import queue_depth, write_flag
 import os
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 
+CLASSIFICATION_METHODS = ('keywords', 'ai', 'model', 'cascade')
+
+
+def get_classification_method():
+    """Resolve the configured classifier: 'keywords', 'ai', 'model' or 'cascade'"""
+    if settings.CLASSIFICATION_METHOD in CLASSIFICATION_METHODS:
+        return settings.CLASSIFICATION_METHOD
+    use_ai = os.environ.get('USE_AI_CLASSIFICATION', 'false').lower() == 'true'
+    return 'ai' if use_ai else 'keywords'
+
+
+def classifier_version(method):
+    """Version tag for method, used to key cached verdicts"""
+    if method == 'ai':
+        return AI_VERSION
+    if method == 'model':
+        return get_engine().version
+    if method == 'cascade':
+        return cascade_version()
+    return get_lexicon().version
+
+
+def validate_texts(texts):
+    """Return an error message if texts isn't a valid batch, else None"""
+    if not isinstance(texts, list) or not texts:
+        return "Missing texts"
+    if not all(isinstance(text, str) for text in texts):
+        return "Every item in texts must be a string"
+    if len(texts) > settings.CLASSIFY_BATCH_MAX_ITEMS:
+        return f"Too many texts (max {settings.CLASSIFY_BATCH_MAX_ITEMS})"
+    return None
+
+
+def classify_many_with_ai(texts):
+    """
+    LLM verdicts for texts, coalesced through the batcher when enabled.
+    Texts the LLM fails on get a keyword verdict marked degraded, so it
+    isn't cached as the AI's answer.
+    """
+    verdicts = []
+    for text, flag in zip(texts, classify_many_with_llm(texts)):
+        if flag is None:
+            FALLBACKS.inc(method='ai')
+            verdicts.append(Verdict(classify_text(text), None, 'keywords', degraded=True))
+        else:
+            verdicts.append(Verdict(flag, None, 'ai'))
+    return verdicts
+
+
+def verdict_fields(verdict):
+    """Response fields for one Verdict: flag, the tier that answered, scores"""
+    fields = {"flag": verdict.flag, "tier": verdict.tier}
+    if verdict.scores is not None:
+        fields["scores"] = verdict.scores
+    if verdict.degraded:
+        fields["degraded"] = True
+    return fields
+
+
+def batch_response(method, verdicts):
+    """Build the /classify-batch/ response body from Verdicts"""
+    results = [
+        {"index": index, **verdict_fields(verdict)}
+        for index, verdict in enumerate(verdicts)
+    ]
+    return {
+        "status": "success",
+        "method": method,
+        "versions": active_versions(),
+        "count": len(results),
+        "results": results
+    }
+
+
 def health_check(request):
     """Health check endpoint"""
+    watcher = get_watcher()
     return JsonResponse({
         "status": "healthy", 
         "message": "Cipher Guardian API is running.",
-        "ai_enabled": os.environ.get('USE_AI_CLASSIFICATION', 'false') == 'true'
+        "ai_enabled": os.environ.get('USE_AI_CLASSIFICATION', 'false') == 'true',
+        "classification_method": get_classification_method(),
+        "model_loaded": get_engine().loaded,
+        "versions": active_versions(),
+        "lexicon_version": get_lexicon().version,
+        "model_version": get_engine().version,
+        "registry": watcher.status() if watcher else None,
+        "verdict_cache": verdict_cache.stats(),
+        "openai_circuit": get_llm_client().breaker.state,
     })
 
+
+def metrics(request):
+    """Prometheus metrics for this worker process"""
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return HttpResponse(status=401)
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
+
+
+@registry.add_collector
+def service_metrics():
+    cache = verdict_cache.stats()
+    return [
+        ('classifier_verdict_cache_total', 'counter', 'Verdict cache lookups by result.',
+         [({'result': result}, cache[result]) for result in ('hits', 'misses', 'errors')]),
+        ('classifier_model_loaded', 'gauge', '1 if the model is loaded in this worker.',
+         [({}, int(get_engine().loaded))]),
+        ('classifier_flag_queue_depth', 'gauge', 'Flag updates waiting to be written to Firestore.',
+         [({}, queue_depth())]),
+        ('classifier_openai_circuit', 'gauge', '1 for the current state of the OpenAI circuit breaker.',
+         [({'state': state}, int(state == get_llm_client().breaker.state))
+          for state in ('closed', 'open', 'half_open')]),
+    ]
+
+
 class ClassifyTextView(APIView):
     """
     NEW: Classify plain text BEFORE encryption
     This endpoint doesn't need chatId/messageId since it's called before saving to Firestore
     """
+    @instrumented('classify-text', get_classification_method)
     def post(self, request, *args, **kwargs):
-        data = request.data
+        with stage('parse'):
+            data = request.data
+        if not isinstance(data, dict):
+            return Response(
+                {"error": "Invalid JSON"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         plain_text = data.get('text')
 
         if not plain_text:
@@ -33,122 +159,147 @@ class ClassifyTextView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        limited = throttle('classify-text', 'client', client_address(request))
+        if limited:
+            return limited
+
         try:
-            use_ai = os.environ.get('USE_AI_CLASSIFICATION', 'false').lower() == 'true'
-            
-            if use_ai:
-                logger.info(f"Classifying text with AI: {plain_text[:50]}...")
-                flag = self.classify_with_ai(plain_text)
-            else:
-                logger.info(f"Classifying text with keywords: {plain_text[:50]}...")
-                flag = self.classify_with_keywords(plain_text)
-            
-            logger.info(f"Text classified as: {flag}")
-            
+            method = get_classification_method()
+            logger.debug("Classifying text with %s: %.50s...", method, plain_text)
+            verdict = self.classify(plain_text, method)
+            count_verdicts(method, [verdict])
+
+            logger.debug("Text classified as: %s (by %s)", verdict.flag, verdict.tier)
+
             return Response({
                 "status": "success", 
-                "flag": flag,
-                "method": "ai" if use_ai else "keywords"
+                "method": method,
+                "versions": active_versions(),
+                **verdict_fields(verdict)
             }, status=status.HTTP_200_OK)
 
         except Exception as e:
-            logger.error(f"Classification error: {str(e)}")
+            logger.error("Classification error: %s", e)
             return Response(
                 {"error": str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-    def classify_with_ai(self, text):
-        """Classify using OpenAI GPT-4o-mini"""
+    def classify(self, text, method):
+        """
+        Classify text with method behind the verdict cache.
+        Returns a Verdict; scores are only set when the model answered.
+        Concurrent cache misses for the same text share one classification.
+        If the AI or the model fails, falls back to keywords. The fallback
+        verdict is cached under the keyword version, not the failed method.
+        """
+        version = classifier_version(method)
+        verdict = verdict_cache.get(text, method, version)
+        if verdict is not None:
+            return verdict
+        return verdict_calls.run(
+            verdict_cache.key(text, method, version), lambda: self.compute(text, method, version)
+        )
+
+    def compute(self, text, method, version):
+        """Classify a cache miss and cache the verdict unless it is degraded"""
         try:
-            from openai import OpenAI
-            
-            api_key = os.environ.get('OPENAI_API_KEY') or os.environ.get('AI_API_KEY')
-            
-            if not api_key:
-                logger.error("No OpenAI API key found")
-                return self.classify_with_keywords(text)
-            
-            client = OpenAI(api_key=api_key)
-            
-            system_prompt = """You are a strict content moderation assistant for a secure messaging app.
-
-Classify messages into three categories:
-
-🔴 RED (Dangerous/Harmful) - FLAG IMMEDIATELY:
-- ANY insults or aggressive language directed at someone
-- Examples: "fuck you", "you're stupid", "bitch", "asshole", "idiot" 
-- Threats of violence or harm
-- Harassment or bullying
-- Hate speech or slurs
-- Discriminatory language
-
-🟡 YELLOW (Suspicious) - INVESTIGATE:
-- Scam attempts ("you won", "claim prize")
-- Phishing or fraud indicators
-- Requests for sensitive information
-- Spam or commercial content
-
-🟢 GREEN (Safe) - ALLOW:
-- Normal conversation ("hello", "hi", "how are you")
-- Non-directed exclamations ("oh shit!", "damn")
-- Friendly chat
-
-RULES:
-1. "fuck you" = RED | "oh fuck" = GREEN
-2. Insults directed at person = RED
-3. Simple words like "gay", "hello", "hi" = GREEN
-4. When unsure, default to GREEN unless clearly hostile
-
-RESPOND WITH ONLY: RED, YELLOW, or GREEN."""
-
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Classify: {text}"}
-                ],
-                max_tokens=10,
-                temperature=0.1,
-            )
-            
-            classification = response.choices[0].message.content.strip().upper()
-            logger.info(f"GPT result: {classification}")
-            
-            if classification == "RED":
-                return "red"
-            elif classification == "YELLOW":
-                return "yellow"
+            if method == 'ai':
+                verdict = Verdict(self.classify_with_ai(text), None, 'ai')
+            elif method == 'model':
+                verdict = get_engine().classify(text)
+            elif method == 'cascade':
+                verdict = classify_cascade(text)
             else:
-                return "green"
-                
+                verdict = Verdict(self.classify_with_keywords(text), None, 'keywords')
         except Exception as e:
-            logger.error(f"OpenAI error: {str(e)}")
-            return self.classify_with_keywords(text)
+            logger.error("%s classifier error: %s", method, e)
+            FALLBACKS.inc(method=method)
+            return self.classify(text, 'keywords')
+
+        if not verdict.degraded:
+            verdict_cache.set(text, method, version, verdict)
+        return verdict
+
+    def classify_with_ai(self, text):
+        """Classify using OpenAI GPT-4o-mini; raises if the API is unavailable"""
+        return classify_with_llm(text)
 
     def classify_with_keywords(self, text):
-        """Fallback keyword classification"""
-        text_lower = text.lower() if text else ""
-        
-        red_keywords = [
-            "fuck you", "kill you", "bitch", "asshole", "cunt",
-            "idiot", "stupid", "hate you", "kill", "murder", "attack"
-        ]
-        
-        yellow_keywords = [
-            "prize", "winner", "won", "congratulations",
-            "claim", "free money", "verify account"
-        ]
-        
-        for keyword in red_keywords:
-            if keyword in text_lower:
-                return "red"
-        
-        for keyword in yellow_keywords:
-            if keyword in text_lower:
-                return "yellow"
-        
-        return "green"
+        """Fallback keyword classification (shared lexicon automaton)"""
+        return classify_text(text)
+
+
+class ClassifyBatchView(ClassifyTextView):
+    """
+    Classify many plain texts in one request.
+    Expects {"texts": [...]} and returns one result per text, in input order.
+    """
+    @instrumented('classify-batch', get_classification_method)
+    def post(self, request, *args, **kwargs):
+        with stage('parse'):
+            data = request.data
+        if not isinstance(data, dict):
+            return Response(
+                {"error": "Invalid JSON"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        texts = data.get('texts')
+        error = validate_texts(texts)
+        if error:
+            return Response(
+                {"error": error},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        limited = throttle('classify-batch', 'client', client_address(request), len(texts))
+        if limited:
+            return limited
+
+        try:
+            method = get_classification_method()
+            logger.debug("Classifying batch of %d texts with %s", len(texts), method)
+
+            if method == 'model':
+                verdicts = self.classify_batch_vectorized(texts, 'model', classify_many)
+            elif method == 'cascade':
+                verdicts = self.classify_batch_vectorized(texts, 'cascade', classify_cascade_many)
+            elif method == 'ai':
+                verdicts = self.classify_batch_vectorized(texts, 'ai', classify_many_with_ai)
+            else:
+                verdicts = [self.classify(text, method) for text in texts]
+            count_verdicts(method, verdicts)
+
+            return Response(batch_response(method, verdicts), status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.error("Batch classification error: %s", e)
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    def classify_batch_vectorized(self, texts, method, classify_many):
+        """
+        Run classify_many once over the cache misses, falling back to
+        keywords if it fails
+        """
+        version = classifier_version(method)
+        verdicts = verdict_cache.get_many(texts, method, version)
+        missing = [i for i in range(len(texts)) if i not in verdicts]
+        if missing:
+            try:
+                computed = classify_many([texts[i] for i in missing])
+            except Exception as e:
+                logger.error("Model error: %s", e)
+                FALLBACKS.inc(method=method)
+                return [self.classify(text, 'keywords') for text in texts]
+            computed = dict(zip(missing, computed))
+            verdict_cache.set_many({i: texts[i] for i in missing}, method, version,
+                                   {i: verdict for i, verdict in computed.items() if not verdict.degraded})
+            verdicts.update(computed)
+        return [verdicts[i] for i in range(len(texts))]
 
 
 class ClassifyMessageView(APIView):
@@ -156,8 +307,17 @@ class ClassifyMessageView(APIView):
     LEGACY: For Cloud Function to classify already-saved messages
     This is kept for backward compatibility but won't work well with encrypted text
     """
+    legacy_warned = False
+
+    @instrumented('classify', lambda: 'keywords')
     def post(self, request, *args, **kwargs):
-        data = request.data
+        with stage('parse'):
+            data = request.data
+        if not isinstance(data, dict):
+            return Response(
+                {"error": "Invalid JSON"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         chat_id = data.get('chatId')
         message_id = data.get('messageId')
         encrypted_text = data.get('encryptedText')
@@ -168,18 +328,22 @@ class ClassifyMessageView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        limited = throttle('classify', 'chat', chat_id)
+        if limited:
+            return limited
+
         try:
             # Note: This will classify encrypted text (won't work well)
-            logger.warning("Classifying encrypted text - consider using /classify-text/ endpoint instead")
-            flag = self.classify_with_keywords(encrypted_text)
-            
-            logger.info(f"Message {message_id} classified as: {flag}")
-
-            # Update Firestore
-            db = firestore.client()
-            message_ref = db.collection('chats').document(chat_id).collection('messages').document(message_id)
-            message_ref.update({'flag': flag})
-            
+            if not ClassifyMessageView.legacy_warned:
+                ClassifyMessageView.legacy_warned = True
+                logger.warning("Classifying encrypted text - consider using /classify-text/ endpoint instead")
+            # Retries of the same message that arrive together share one write
+            flag = message_calls.run(
+                (chat_id, message_id, encrypted_text),
+                lambda: self.classify_and_store(chat_id, message_id, encrypted_text),
+            )
+            count_verdicts('keywords', [Verdict(flag, None, 'keywords')])
+
             return Response({
                 "status": "success", 
                 "flag": flag,
@@ -188,31 +352,22 @@ class ClassifyMessageView(APIView):
             }, status=status.HTTP_200_OK)
 
         except Exception as e:
-            logger.error(f"Classification error: {str(e)}")
+            logger.error("Classification error: %s", e)
             return Response(
                 {"error": str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def classify_and_store(self, chat_id, message_id, encrypted_text):
+        """Classify the message and store its flag in Firestore; returns the flag"""
+        flag = self.classify_with_keywords(encrypted_text)
+        logger.debug("Message %s classified as: %s", message_id, flag)
+
+        # Queued for a batched write unless FLAG_WRITE_BEHIND is off
+        with stage('firestore'):
+            write_flag(chat_id, message_id, flag)
+        return flag
+
     def classify_with_keywords(self, text):
-        """Fallback keyword classification"""
-        text_lower = text.lower() if text else ""
-        
-        red_keywords = [
-            "fuck you", "kill you", "bitch", "asshole",
-            "kill", "murder", "attack", "threat"
-        ]
-        
-        yellow_keywords = [
-            "prize", "winner", "congratulations you won"
-        ]
-        
-        for keyword in red_keywords:
-            if keyword in text_lower:
-                return "red"
-        
-        for keyword in yellow_keywords:
-            if keyword in text_lower:
-                return "yellow"
-        
-        return "green"
\ No newline at end of file
+        """Fallback keyword classification (shared lexicon automaton)"""
+        return classify_text(text)
\ No newline at end of file
@@ -0,0 +1,404 @@
+# api/writebehind.py
+# Write-behind queue for message flag updates from /classify/.
+#
+# The view answers as soon as it has a flag; the Firestore write happens
+# later. Updates wait in a bounded buffer keyed by message, so a message
+# classified again before its write goes out is written once, with the
+# newest flag. A background thread commits them in WriteBatches of up to
+# FLAG_WRITE_BATCH_SIZE, at most FLAG_WRITE_FLUSH_SECONDS after the first
+# one arrives.
+#
+# Delivery is at least once: a failed batch is put back and retried with
+# exponential backoff, so a write may be repeated. An update that keeps
+# failing is retried on its own (one bad document fails its whole batch),
+# and if that fails too it is appended to a local spool file
+# (FLAG_WRITE_SPOOL_PATH), as are updates still queued when close() gives
+# up draining after FLAG_WRITE_DRAIN_SECONDS. The next process to start a
+# queue replays the spool, along with any replay a dead process left
+# unfinished. Updates are only lost if the spool can't be
+# written (or FLAG_WRITE_SPOOL_PATH is empty), if the process dies without
+# running close(), or if the host's disk is lost; each is logged or
+# counted as 'dropped'. With the buffer full, or once the queue is closed,
+# the caller writes inline, so a slow Firestore pushes back on requests
+# instead of growing memory.
+import atexit
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .metrics import FLAG_FLUSH_SECONDS, FLAG_WRITE_LAG_SECONDS, FLAG_WRITES
+
+logger = logging.getLogger(__name__)
+
+
+def message_reference(db, chat_id, message_id):
+    return db.collection('chats').document(chat_id).collection('messages').document(message_id)
+
+
+class FlagWriter:
+    """
+    Buffers {'flag': flag} updates for chats/{chatId}/messages/{messageId}
+    and commits them in batches from a background thread. get_db() returns
+    the Firestore client (or a fake) at each commit. Updates that can't be
+    written go to spool_path, one JSON object per line, for replay_spool().
+    """
+
+    def __init__(self, get_db, batch_size=500, flush_seconds=0.05, max_pending=10000, max_attempts=5,
+                 backoff_seconds=0.1, max_backoff_seconds=5.0, spool_path=None):
+        self.get_db = get_db
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.spool_path = os.fspath(spool_path) if spool_path else None
+        self._spool_lock = threading.Lock()
+        # (chat_id, message_id) -> [flag, enqueued at, failed attempts]; oldest first
+        self._pending = OrderedDict()
+        self._in_flight = 0
+        self._failures = 0
+        self._closed = False
+        # Set once close() stops draining; a failed batch is spooled, not put back
+        self._gave_up = False
+        self._thread = None
+        self._cond = threading.Condition()
+        self._closing = threading.Event()
+
+    def __len__(self):
+        """Updates not yet committed, including the batch being written"""
+        return len(self._pending) + self._in_flight
+
+    def enqueue(self, chat_id, message_id, flag):
+        """
+        Queue a flag update and return True, or write it inline and return
+        False when the buffer is full or the queue is closed (raising if
+        that write fails, as a direct write would).
+        """
+        key = (chat_id, message_id)
+        with self._cond:
+            if not self._closed:
+                entry = self._pending.get(key)
+                if entry is not None:
+                    # Newest flag wins; keep its place and age in the queue
+                    entry[0], entry[2] = flag, 0
+                    return True
+                if len(self._pending) < self.max_pending:
+                    self._pending[key] = [flag, time.monotonic(), 0]
+                    self._start()
+                    self._cond.notify()
+                    return True
+        FLAG_WRITES.inc(result='inline')
+        self._write([(key, [flag, time.monotonic(), 0])])
+        return False
+
+    def _start(self):
+        # Called with the lock held; threads don't survive a fork, so a
+        # worker forked from a process that used the queue starts its own
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='flag-writer', daemon=True)
+            self._thread.start()
+
+    def _take(self):
+        """Wait for a batch: full, FLUSH_SECONDS old, or anything when closing. None when drained and closed"""
+        with self._cond:
+            while not self._pending:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            deadline = next(iter(self._pending.values()))[1] + self.flush_seconds
+            while len(self._pending) < self.batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._pending.popitem(last=False) for _ in range(min(self.batch_size, len(self._pending)))]
+            self._in_flight = len(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if batch is None:
+                return
+            try:
+                self._flush(batch)
+            except Exception:
+                logger.exception("Flag writer failed; %d updates put back", len(batch))
+                self._requeue(batch)
+            finally:
+                with self._cond:
+                    self._in_flight = 0
+                    self._cond.notify_all()
+
+    def _write(self, batch):
+        db = self.get_db()
+        writes = db.batch()
+        for (chat_id, message_id), (flag, _, _) in batch:
+            writes.update(message_reference(db, chat_id, message_id), {'flag': flag})
+        with FLAG_FLUSH_SECONDS.time():
+            writes.commit()
+        now = time.monotonic()
+        for _, (_, enqueued, _) in batch:
+            FLAG_WRITE_LAG_SECONDS.observe(now - enqueued)
+
+    def _flush(self, batch):
+        try:
+            self._write(batch)
+        except Exception as e:
+            self._failures += 1
+            FLAG_WRITES.inc(len(batch), result='retried')
+            logger.warning("Writing %d flag updates failed (attempt %d): %s", len(batch), self._failures, e)
+            exhausted = [item for item in batch if item[1][2] + 1 >= self.max_attempts]
+            self._requeue([item for item in batch if item[1][2] + 1 < self.max_attempts])
+            for item in exhausted:
+                self._write_alone(item)
+            self._backoff()
+            return
+        self._failures = 0
+        FLAG_WRITES.inc(len(batch), result='ok')
+
+    def _write_alone(self, item):
+        """Last try for an update that failed max_attempts times in a batch"""
+        (chat_id, message_id), (flag, _, _) = item
+        try:
+            self._write([item])
+        except Exception as e:
+            logger.error("Giving up on flag %s for chats/%s/messages/%s: %s", flag, chat_id, message_id, e)
+            self._spool([item])
+        else:
+            FLAG_WRITES.inc(result='ok')
+
+    def _spool(self, items):
+        """Append updates to the spool file for a later replay; they are dropped if that fails"""
+        if not items:
+            return
+        if not self.spool_path:
+            FLAG_WRITES.inc(len(items), result='dropped')
+            logger.error("Dropping %d flag updates: no FLAG_WRITE_SPOOL_PATH to spool them to", len(items))
+            return
+        lines = ''.join(
+            json.dumps({'chat': chat_id, 'message': message_id, 'flag': flag}) + '\n'
+            for (chat_id, message_id), (flag, _, _) in items
+        )
+        try:
+            os.makedirs(os.path.dirname(self.spool_path) or '.', exist_ok=True)
+            with self._spool_lock, open(self.spool_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            FLAG_WRITES.inc(len(items), result='dropped')
+            logger.error("Dropping %d flag updates, could not spool them: %s", len(items), e)
+        else:
+            FLAG_WRITES.inc(len(items), result='spooled')
+            logger.warning("Spooled %d flag updates to %s", len(items), self.spool_path)
+
+    def replay_spool(self):
+        """
+        Queue the updates spooled by earlier runs and remove the spool. It
+        is renamed to <spool>.<pid>.replay first, so of several processes
+        sharing it only one replays each update; a replay file whose
+        process died before queueing it is picked up the same way. Returns
+        the number of updates queued.
+        """
+        if not self.spool_path:
+            return 0
+        claimed = f'{self.spool_path}.{os.getpid()}.replay'
+        count = 0
+        # Our own pid's file is a dead predecessor's: replay it before the
+        # spool is renamed over it
+        for path in sorted(self._orphaned_replays(), key=lambda path: path != claimed) + [self.spool_path]:
+            try:
+                if path != claimed:
+                    os.replace(path, claimed)
+                count += self._replay(claimed)
+            except FileNotFoundError:
+                # Another process claimed it first
+                continue
+            except OSError as e:
+                # Left in place for the next process to start; stop before
+                # another file is renamed over it
+                logger.error("Could not replay spooled flag updates from %s: %s", path, e)
+                break
+        if count:
+            logger.info("Replaying %d spooled flag updates", count)
+        return count
+
+    def _orphaned_replays(self):
+        """Replay files whose process is gone"""
+        directory, name = os.path.split(self.spool_path)
+        pattern = re.compile(re.escape(name) + r'\.(\d+)\.replay')
+        try:
+            names = os.listdir(directory or '.')
+        except FileNotFoundError:
+            return []
+        return [
+            os.path.join(directory, match.group(0))
+            for match in map(pattern.fullmatch, names)
+            if match and not _alive(int(match.group(1)))
+        ]
+
+    def _replay(self, path):
+        """Queue the updates in a claimed spool file, then remove it"""
+        items = []
+        now = time.monotonic()
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    update = json.loads(line)
+                    items.append(((update['chat'], update['message']), [update['flag'], now, 0]))
+                except (ValueError, KeyError, TypeError) as e:
+                    # A line cut short by a crash mid-append
+                    logger.error("Skipping unreadable spooled flag update %r: %s", line, e)
+        with self._cond:
+            closed = self._closed
+            if not closed:
+                # Past max_pending if need be: these were accepted long ago,
+                # and writing them inline would hold up the worker's start
+                for key, entry in items:
+                    # A flag queued since is newer than the spooled one
+                    self._pending.setdefault(key, entry)
+                if self._pending:
+                    self._start()
+                    self._cond.notify()
+        if closed:
+            self._spool(items)
+        os.remove(path)
+        return len(items)
+
+    def _requeue(self, batch):
+        """Put failed updates back at the front, unless a newer flag was queued meanwhile"""
+        with self._cond:
+            # No longer in flight: queued again, or spooled below
+            self._in_flight = max(0, self._in_flight - len(batch))
+            if self._gave_up:
+                spool, batch = batch, []
+            for key, (flag, enqueued, attempts) in reversed(batch):
+                if key not in self._pending:
+                    self._pending[key] = [flag, enqueued, attempts + 1]
+                    self._pending.move_to_end(key, last=False)
+        if self._gave_up:
+            self._spool(spool)
+
+    def _backoff(self):
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (self._failures - 1))
+        delay *= random.uniform(0.5, 1.0)
+        if self._closing.is_set():
+            # Draining: still back off, within close()'s timeout
+            time.sleep(delay)
+        else:
+            # close() cuts this wait short to start draining
+            self._closing.wait(delay)
+
+    def flush(self, timeout=None):
+        """Wait until every queued update is written or given up on; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                if self._thread is None or not self._thread.is_alive():
+                    self._start()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.1)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Stop queueing (later updates are written inline) and drain the
+        buffer for up to timeout seconds; what is still queued then is
+        spooled. Returns the number of updates that were not written.
+        """
+        timeout = settings.FLAG_WRITE_DRAIN_SECONDS if timeout is None else timeout
+        with self._cond:
+            self._closed = True
+            self._closing.set()
+            self._cond.notify_all()
+            if self._pending and (self._thread is None or not self._thread.is_alive()):
+                self._start()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        with self._cond:
+            self._gave_up = True
+            left = list(self._pending.items())
+            self._pending.clear()
+        if left:
+            logger.error("Shut down with %d flag updates not written to Firestore", len(left))
+            self._spool(left)
+        # A batch still in flight is written, or spooled if that fails
+        return len(left) + self._in_flight
+
+
+def _alive(pid):
+    """Whether another process with this pid is running"""
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Someone else's process
+        return True
+    return True
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_flag_writer():
+    """
+    Return the process-wide FlagWriter, or None when FLAG_WRITE_BEHIND is
+    off. Creating it replays what earlier runs spooled.
+    """
+    global _writer
+    if not settings.FLAG_WRITE_BEHIND:
+        return None
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                from .firebase import get_firestore
+
+                _writer = FlagWriter(
+                    get_firestore,
+                    batch_size=settings.FLAG_WRITE_BATCH_SIZE,
+                    flush_seconds=settings.FLAG_WRITE_FLUSH_SECONDS,
+                    max_pending=settings.FLAG_WRITE_MAX_PENDING,
+                    max_attempts=settings.FLAG_WRITE_MAX_ATTEMPTS,
+                    spool_path=settings.FLAG_WRITE_SPOOL_PATH,
+                )
+                atexit.register(_writer.close)
+                _writer.replay_spool()
+    return _writer
+
+
+def write_flag(chat_id, message_id, flag):
+    """Store a message's flag: through the write-behind queue if enabled, else directly"""
+    writer = get_flag_writer()
+    if writer is not None:
+        return writer.enqueue(chat_id, message_id, flag)
+    from .firebase import get_firestore
+
+    message_reference(get_firestore(), chat_id, message_id).update({'flag': flag})
+    return False
+
+
+def queue_depth():
+    return len(_writer) if _writer is not None else 0
+
+
+def shutdown():
+    """Drain this process's queue, if it has one (gunicorn worker_exit)"""
+    if _writer is not None:
+        _writer.close()
@@ -14,3 +14,14 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend_django.settings')
 
 application = get_asgi_application()
+
+# Streaming classification needs the request body chunk by chunk, which
+# Django's handler doesn't expose, so it's served in front of Django.
+from api.streaming import StreamClassifyApp  # noqa: E402
+
+application = StreamClassifyApp(application)
+
+# Load the classifier model once at startup rather than on the first request.
+from api.engine import preload  # noqa: E402
+
+preload()
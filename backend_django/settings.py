@@ -6,8 +6,6 @@ Generated by 'django-admin startproject' using Django 5.2.7.
 
 import os
 from pathlib import Path
-import firebase_admin
-from firebase_admin import credentials
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -49,6 +47,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.artifacts.PinArtifactsMiddleware',
 ]
 
 ROOT_URLCONF = 'backend_django.urls'
@@ -99,18 +98,164 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
-# --- Firebase Admin SDK Initialization ---
+# --- Firebase Admin SDK ---
 # IMPORTANT: Update this filename to match your Secret File on Render.
-SERVICE_ACCOUNT_KEY_PATH = BASE_DIR / 'cipher-guardian-firebase-adminsdk-fbsvc-df095bfd03.json'
-
-try:
-    cred = credentials.Certificate(SERVICE_ACCOUNT_KEY_PATH)
-    # This check prevents the app from crashing during hot reloads on a dev server.
-    if not firebase_admin._apps:
-        firebase_admin.initialize_app(cred)
-    print("✅ Firebase Admin SDK initialized successfully.")
-except Exception as e:
-    print(f"🔥 Error initializing Firebase Admin SDK: {e}")
+# The SDK is initialized on first use (api.firebase.get_firestore), not here,
+# so workers and management commands that never touch Firestore don't pay
+# for importing grpc and google-cloud.
+SERVICE_ACCOUNT_KEY_PATH = os.environ.get(
+    'SERVICE_ACCOUNT_KEY_PATH', BASE_DIR / 'cipher-guardian-firebase-adminsdk-fbsvc-df095bfd03.json'
+)
+
+
+# --- Classification ---
+# Which classifier ClassifyTextView uses: 'keywords', 'ai', 'model' or 'cascade'.
+# When unset, USE_AI_CLASSIFICATION picks between 'ai' and 'keywords'.
+CLASSIFICATION_METHOD = os.environ.get('CLASSIFICATION_METHOD', '').lower()
+
+# Trained pipeline written by `python manage.py train_model`.
+CLASSIFIER_MODEL_PATH = os.environ.get(
+    'CLASSIFIER_MODEL_PATH', BASE_DIR / 'api' / 'message_classifier.joblib'
+)
+
+# Versioned lexicons and models (api/artifacts.py). When set, each worker
+# checks the directory's active.json every CLASSIFIER_REGISTRY_POLL_SECONDS
+# and swaps in the versions it names without a restart.
+CLASSIFIER_REGISTRY_DIR = os.environ.get('CLASSIFIER_REGISTRY_DIR')
+CLASSIFIER_REGISTRY_POLL_SECONDS = float(os.environ.get('CLASSIFIER_REGISTRY_POLL_SECONDS', '5'))
+
+# Threads available to the async views for running model inference.
+MODEL_EXECUTOR_WORKERS = int(os.environ.get('MODEL_EXECUTOR_WORKERS', '4'))
+
+# Cascade: a keyword hit with one of CASCADE_KEYWORD_FLAGS answers at once.
+# Otherwise the model answers, unless its green probability falls inside
+# [CASCADE_GREEN_LOW, CASCADE_GREEN_HIGH). Only those uncertain messages
+# are escalated to the LLM.
+CASCADE_KEYWORD_FLAGS = tuple(
+    flag.strip() for flag in os.environ.get('CASCADE_KEYWORD_FLAGS', 'red,yellow').split(',') if flag.strip()
+)
+CASCADE_GREEN_LOW = float(os.environ.get('CASCADE_GREEN_LOW', '0.2'))
+CASCADE_GREEN_HIGH = float(os.environ.get('CASCADE_GREEN_HIGH', '0.8'))
+
+# Process pool for CPU-bound model scoring (api/pool.py). Model batches of
+# at least CLASSIFIER_POOL_MIN_BATCH texts are split into chunks of at most
+# CLASSIFIER_POOL_CHUNK_SIZE and scored by CLASSIFIER_POOL_WORKERS child
+# processes per worker; 0 (the default) scores in-process. Size it so that
+# gunicorn workers x pool processes roughly matches the cores.
+CLASSIFIER_POOL_WORKERS = int(os.environ.get('CLASSIFIER_POOL_WORKERS', '0'))
+CLASSIFIER_POOL_MIN_BATCH = int(os.environ.get('CLASSIFIER_POOL_MIN_BATCH', '256'))
+CLASSIFIER_POOL_CHUNK_SIZE = int(os.environ.get('CLASSIFIER_POOL_CHUNK_SIZE', '2048'))
+
+# Upper bound on the number of texts accepted by /classify-batch/.
+CLASSIFY_BATCH_MAX_ITEMS = int(os.environ.get('CLASSIFY_BATCH_MAX_ITEMS', '1000'))
+
+# Longest text accepted by the streaming endpoint (ASGI only), in characters.
+STREAM_CLASSIFY_MAX_CHARS = int(os.environ.get('STREAM_CLASSIFY_MAX_CHARS', '100000'))
+
+# OpenAI client: one pooled client per process. Calls time out after
+# OPENAI_TIMEOUT seconds and at most OPENAI_MAX_CONCURRENCY run at once.
+# After OPENAI_BREAKER_FAILURES consecutive failures (or calls slower than
+# OPENAI_SLOW_CALL_SECONDS) the circuit opens and requests use the local
+# classifier for OPENAI_BREAKER_RESET_SECONDS.
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL')
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', '5'))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', '0'))
+OPENAI_MAX_CONCURRENCY = int(os.environ.get('OPENAI_MAX_CONCURRENCY', '16'))
+OPENAI_BREAKER_FAILURES = int(os.environ.get('OPENAI_BREAKER_FAILURES', '5'))
+OPENAI_BREAKER_RESET_SECONDS = float(os.environ.get('OPENAI_BREAKER_RESET_SECONDS', '30'))
+OPENAI_SLOW_CALL_SECONDS = float(os.environ.get('OPENAI_SLOW_CALL_SECONDS', '3'))
+
+# Micro-batching: when OPENAI_MICROBATCH_WAIT_MS > 0, concurrent AI
+# classifications are held for up to that long (or until MAX_ITEMS are
+# waiting) and sent to OpenAI as a single multi-message prompt.
+OPENAI_MICROBATCH_WAIT_MS = float(os.environ.get('OPENAI_MICROBATCH_WAIT_MS', '0'))
+OPENAI_MICROBATCH_MAX_ITEMS = int(os.environ.get('OPENAI_MICROBATCH_MAX_ITEMS', '16'))
+
+# USD per million tokens for the classification model (gpt-4o-mini list
+# prices); `evaluate_classifiers` uses them to estimate LLM cost.
+OPENAI_INPUT_COST_PER_MTOK = float(os.environ.get('OPENAI_INPUT_COST_PER_MTOK', '0.15'))
+OPENAI_OUTPUT_COST_PER_MTOK = float(os.environ.get('OPENAI_OUTPUT_COST_PER_MTOK', '0.60'))
+
+
+# --- Firestore Writes ---
+# /classify/ answers before its flag reaches Firestore (api/writebehind.py).
+# Updates wait in a buffer of at most FLAG_WRITE_MAX_PENDING messages and go
+# out in WriteBatches of up to FLAG_WRITE_BATCH_SIZE (Firestore's limit is
+# 500) within FLAG_WRITE_FLUSH_SECONDS; a failed batch is retried with
+# backoff. On shutdown a worker drains the buffer for up to
+# FLAG_WRITE_DRAIN_SECONDS. Updates that still fail after
+# FLAG_WRITE_MAX_ATTEMPTS, or are left when draining stops, are appended to
+# FLAG_WRITE_SPOOL_PATH (default var/ in the project) and replayed when a
+# worker next starts; put it on persistent disk. With it empty such updates
+# are lost (counted as dropped) although /classify/ already answered.
+# FLAG_WRITE_BEHIND=false writes before answering.
+# With FIRESTORE_EMULATOR_HOST set, writes go to the Firestore emulator.
+FLAG_WRITE_BEHIND = os.environ.get('FLAG_WRITE_BEHIND', 'true').lower() == 'true'
+FLAG_WRITE_BATCH_SIZE = int(os.environ.get('FLAG_WRITE_BATCH_SIZE', '500'))
+FLAG_WRITE_FLUSH_SECONDS = float(os.environ.get('FLAG_WRITE_FLUSH_SECONDS', '0.05'))
+FLAG_WRITE_MAX_PENDING = int(os.environ.get('FLAG_WRITE_MAX_PENDING', '10000'))
+FLAG_WRITE_MAX_ATTEMPTS = int(os.environ.get('FLAG_WRITE_MAX_ATTEMPTS', '5'))
+FLAG_WRITE_DRAIN_SECONDS = float(os.environ.get('FLAG_WRITE_DRAIN_SECONDS', '10'))
+FLAG_WRITE_SPOOL_PATH = os.environ.get('FLAG_WRITE_SPOOL_PATH', BASE_DIR / 'var' / 'flag_write_spool.jsonl')
+
+
+# --- Caching ---
+# 'verdicts' holds classification results keyed by a hash of the text and
+# classifier version. LocMemCache evicts least-recently-used entries past
+# MAX_ENTRIES and expires entries after TIMEOUT seconds. Set VERDICT_CACHE_URL
+# (redis://...) to share the cache across workers; requires the redis package.
+VERDICT_CACHE_URL = os.environ.get('VERDICT_CACHE_URL')
+VERDICT_CACHE_TIMEOUT = int(os.environ.get('VERDICT_CACHE_TIMEOUT', '3600'))
+VERDICT_CACHE_MAX_ENTRIES = int(os.environ.get('VERDICT_CACHE_MAX_ENTRIES', '10000'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'verdicts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'verdicts',
+        'TIMEOUT': VERDICT_CACHE_TIMEOUT,
+        'OPTIONS': {'MAX_ENTRIES': VERDICT_CACHE_MAX_ENTRIES},
+    },
+}
+if VERDICT_CACHE_URL:
+    CACHES['verdicts'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': VERDICT_CACHE_URL,
+        'TIMEOUT': VERDICT_CACHE_TIMEOUT,
+    }
+
+
+# --- Rate Limiting ---
+# Token buckets: each key gets *_PER_SECOND requests per second on average
+# and bursts of up to *_BURST; a rate of 0 turns the limit off. Chat limits
+# apply to /classify/ (per chatId, against Cloud Function retry storms);
+# client limits apply to the text endpoints, per client address, and a
+# batch takes one token per text. Behind a proxy, set
+# RATE_LIMIT_CLIENT_HEADER (e.g. X-Forwarded-For) or every request shares
+# the proxy's address. Buckets are per worker unless
+# RATE_LIMIT_CACHE_URL (redis://...) shares them.
+CHAT_RATE_LIMIT_PER_SECOND = float(os.environ.get('CHAT_RATE_LIMIT_PER_SECOND', '2'))
+CHAT_RATE_LIMIT_BURST = int(os.environ.get('CHAT_RATE_LIMIT_BURST', '30'))
+CLIENT_RATE_LIMIT_PER_SECOND = float(os.environ.get('CLIENT_RATE_LIMIT_PER_SECOND', '0'))
+CLIENT_RATE_LIMIT_BURST = int(os.environ.get('CLIENT_RATE_LIMIT_BURST', '60'))
+RATE_LIMIT_CLIENT_HEADER = os.environ.get('RATE_LIMIT_CLIENT_HEADER')
+RATE_LIMIT_CACHE_URL = os.environ.get('RATE_LIMIT_CACHE_URL')
+if RATE_LIMIT_CACHE_URL:
+    CACHES['ratelimit'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': RATE_LIMIT_CACHE_URL,
+    }
+
+
+# --- Observability ---
+# /metrics serves per-worker latency histograms and counters in the
+# Prometheus text format; set METRICS_TOKEN to require
+# "Authorization: Bearer <token>". Per-request details are logged at DEBUG
+# only; REQUEST_LOG_SAMPLE_RATE of requests also get a one-line INFO summary.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+REQUEST_LOG_SAMPLE_RATE = float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', '0.01'))
 
 
 # --- Production Logging ---
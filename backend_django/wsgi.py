@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend_django.settings')
 
 application = get_wsgi_application()
+
+# Load the classifier model here so that, with gunicorn's preload_app, the
+# master process maps it once and forked workers share the pages.
+from api.engine import preload  # noqa: E402
+
+preload()
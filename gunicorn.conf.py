@@ -0,0 +1,42 @@
+# gunicorn.conf.py
+# Picked up automatically by `gunicorn backend_django.wsgi`.
+import gc
+
+# Import the app (and preload the classifier model) in the master process so
+# workers inherit it copy-on-write instead of each loading their own copy.
+preload_app = True
+
+
+def when_ready(server):
+    # Move everything loaded so far into the permanent generation so the
+    # cyclic GC in each worker doesn't touch (and un-share) those pages.
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # A process pool can't be inherited across a fork, so each worker starts
+    # its own (when CLASSIFIER_POOL_WORKERS is set) before serving requests.
+    # This must come before anything that starts a thread: the pool only
+    # forks its children while the worker is single-threaded.
+    from api.pool import get_pool
+
+    pool = get_pool()
+    if pool is not None:
+        pool.start()
+    # Likewise the thread that watches the lexicon and model registry
+    from api.artifacts import get_watcher
+
+    watcher = get_watcher()
+    if watcher is not None:
+        watcher.start()
+    # Replay flag updates spooled when an earlier worker couldn't write them
+    from api.writebehind import get_flag_writer
+
+    get_flag_writer()
+
+
+def worker_exit(server, worker):
+    # Write out the flag updates still queued for Firestore before exiting
+    from api.writebehind import shutdown
+
+    shutdown()